@@ -14,7 +14,6 @@ Key features:
 
 import os
 from typing import Optional, Dict, Any
-from decimal import Decimal
 from datetime import datetime, timedelta
 from eth_account import Account
 from eth_account.messages import encode_defunct
@@ -22,9 +21,14 @@ from web3 import Web3
 from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy import select, func
 from .database import ApiUsage
+from .money import to_micros, from_micros, micros_to_wei, wei_to_micros
 from .config import settings
+from .logs import get_logger
+from . import metrics
 import secrets
 
+log = get_logger("wallet")
+
 
 class AgentWalletService:
     """
@@ -54,60 +58,54 @@ class AgentWalletService:
         if self.agent_address and self.account.address.lower() != self.agent_address.lower():
             raise ValueError(f"Agent address mismatch: {self.account.address} != {self.agent_address}")
         
-        print(f"🤖 Agent Wallet initialized: {self.account.address}")
+        log.info("agent_wallet_initialized", address=self.account.address)
     
-    async def get_balance(self) -> Decimal:
+    @metrics.timed("get_balance")
+    async def get_balance(self) -> int:
         """
         Get current CRO balance of the agent wallet.
         
         Returns:
-            Balance in CRO (not wei)
+            Balance in CRO micro-units (not wei)
         """
         try:
             balance_wei = self.w3.eth.get_balance(self.account.address)
-            balance_cro = Decimal(self.w3.from_wei(balance_wei, 'ether'))
-            return balance_cro
+            return wei_to_micros(balance_wei)
         except Exception as e:
-            print(f"❌ Error getting balance: {e}")
-            return Decimal(0)
+            log.error("balance_check_failed", address=self.account.address, error=str(e))
+            return 0
     
+    @metrics.timed("check_payment_allowed")
     async def check_payment_allowed(
         self, 
-        amount_cro: Decimal,
+        amount_micros: int,
         db: AsyncSession
     ) -> tuple[bool, Optional[str]]:
         """
         Check if payment is allowed based on safety limits.
         
         Args:
-            amount_cro: Amount to pay in CRO
+            amount_micros: Amount to pay in CRO micro-units
             db: Database session for checking daily spend
         
         Returns:
             Tuple of (is_allowed, reason_if_not)
         """
         # Check per-transaction limit
-        if amount_cro > Decimal(str(settings.AGENT_MAX_PER_TRANSACTION)):
+        if amount_micros > to_micros(settings.AGENT_MAX_PER_TRANSACTION):
             return False, f"Exceeds per-transaction limit ({settings.AGENT_MAX_PER_TRANSACTION} CRO)"
         
         # Check daily spend limit
-        today = datetime.utcnow().date()
-        daily_spend_query = select(func.sum(ApiUsage.cost)).where(
-            ApiUsage.user_address == self.account.address,
-            func.date(ApiUsage.timestamp) == today
-        )
-        result = await db.execute(daily_spend_query)
-        daily_spend = result.scalar() or 0
+        daily_spend = await self.get_daily_spend(db)
         
-        if daily_spend + float(amount_cro) > settings.AGENT_MAX_DAILY_SPEND:
+        if daily_spend + amount_micros > to_micros(settings.AGENT_MAX_DAILY_SPEND):
             return False, f"Would exceed daily limit ({settings.AGENT_MAX_DAILY_SPEND} CRO)"
         
         # Check wallet balance
         balance = await self.get_balance()
-        min_balance = Decimal(str(settings.AGENT_MIN_BALANCE))
         
-        if balance - amount_cro < min_balance:
-            return False, f"Insufficient balance (need to keep {min_balance} CRO minimum)"
+        if balance - amount_micros < to_micros(settings.AGENT_MIN_BALANCE):
+            return False, f"Insufficient balance (need to keep {settings.AGENT_MIN_BALANCE} CRO minimum)"
         
         return True, None
     
@@ -210,11 +208,12 @@ class AgentWalletService:
         
         return domain_separator
     
+    @metrics.timed("pay_for_api_usage")
     async def pay_for_api_usage(
         self,
         user_address: str,
         api_id: str,
-        cost_cro: Decimal,
+        cost_micros: int,
         db: AsyncSession
     ) -> tuple[bool, Optional[str], Optional[str]]:
         """
@@ -226,53 +225,57 @@ class AgentWalletService:
         Args:
             user_address: User whose budget is being spent
             api_id: API being called
-            cost_cro: Cost in CRO
+            cost_micros: Cost in CRO micro-units
             db: Database session
         
         Returns:
             Tuple of (success, transaction_hash, error_message)
         """
+        cost_cro = from_micros(cost_micros)
+        
         # Check if payment is allowed
-        allowed, reason = await self.check_payment_allowed(cost_cro, db)
+        with metrics.stage("pay_for_api_usage", "limits"):
+            allowed, reason = await self.check_payment_allowed(cost_micros, db)
         if not allowed:
+            log.warning("payment_blocked", user=user_address, api_id=api_id, cost_cro=cost_cro, reason=reason)
             return False, None, f"Payment blocked: {reason}"
         
         try:
-            # Convert CRO to wei
-            amount_wei = self.w3.to_wei(float(cost_cro), 'ether')
+            # Convert to wei (exact: one micro-unit is 10^12 wei)
+            amount_wei = micros_to_wei(cost_micros)
             
             # Generate payment ID
             payment_id = f"guardian-{user_address[:8]}-{api_id[:8]}-{int(datetime.utcnow().timestamp())}"
             
             # Create payment authorization
-            auth = self.create_payment_authorization(
-                payment_id=payment_id,
-                recipient=settings.X402_FACILITATOR_ADDRESS,
-                amount_wei=amount_wei
-            )
+            with metrics.stage("pay_for_api_usage", "authorization"):
+                auth = self.create_payment_authorization(
+                    payment_id=payment_id,
+                    recipient=settings.X402_FACILITATOR_ADDRESS,
+                    amount_wei=amount_wei
+                )
             
             # TODO: Submit to x402 facilitator
             # For now, simulate success
             tx_hash = f"0x{secrets.token_hex(32)}"
             
-            print(f"✅ Agent paid {cost_cro} CRO for {api_id} (user: {user_address[:8]}...)")
-            print(f"   TX: {tx_hash}")
+            log.info("payment_succeeded", user=user_address, api_id=api_id, cost_cro=cost_cro, tx_hash=tx_hash)
             
             return True, tx_hash, None
             
         except Exception as e:
-            print(f"❌ Payment failed: {e}")
+            log.exception("payment_failed", user=user_address, api_id=api_id, cost_cro=cost_cro)
             return False, None, str(e)
     
-    async def get_daily_spend(self, db: AsyncSession) -> Decimal:
-        """Get total spent today by the agent."""
+    async def get_daily_spend(self, db: AsyncSession) -> int:
+        """Get total spent today by the agent, in micro-units."""
         today = datetime.utcnow().date()
-        query = select(func.sum(ApiUsage.cost)).where(
+        query = select(func.sum(ApiUsage.cost_micros)).where(
             ApiUsage.user_address == self.account.address,
             func.date(ApiUsage.timestamp) == today
         )
         result = await db.execute(query)
-        return Decimal(str(result.scalar() or 0))
+        return result.scalar() or 0
     
     async def get_wallet_status(self, db: AsyncSession) -> Dict[str, Any]:
         """
@@ -286,14 +289,14 @@ class AgentWalletService:
         
         return {
             'address': self.account.address,
-            'balance_cro': float(balance),
-            'daily_spend_cro': float(daily_spend),
+            'balance_cro': from_micros(balance),
+            'daily_spend_cro': from_micros(daily_spend),
             'daily_limit_cro': settings.AGENT_MAX_DAILY_SPEND,
             'per_tx_limit_cro': settings.AGENT_MAX_PER_TRANSACTION,
             'min_balance_cro': settings.AGENT_MIN_BALANCE,
-            'remaining_daily': settings.AGENT_MAX_DAILY_SPEND - float(daily_spend),
-            'can_operate': balance > Decimal(str(settings.AGENT_MIN_BALANCE)),
-            'needs_funding': balance < Decimal(str(settings.AGENT_MIN_BALANCE * 2))
+            'remaining_daily': from_micros(to_micros(settings.AGENT_MAX_DAILY_SPEND) - daily_spend),
+            'can_operate': balance > to_micros(settings.AGENT_MIN_BALANCE),
+            'needs_funding': balance < to_micros(settings.AGENT_MIN_BALANCE * 2)
         }
 
 
@@ -1,51 +1,282 @@
 """
 AI analysis service using OpenAI or Deepseek for intelligent budget insights.
+
+With AI_PROVIDER=hedged, every provider with an API key is used. Providers
+are ranked by their recent AI_HEDGE_PERCENTILE latency, after any whose
+error rate (a moving average) is above AI_MAX_ERROR_RATE. A request goes to
+the first one; if it has not returned a valid JSON object within that
+provider's percentile latency (or fails sooner), the same request is also
+sent to the next. The first valid response wins and the others are
+cancelled, so a slow tail on one provider is bounded by the other, at the
+cost of a second request for roughly the slowest 5% of calls.
 """
 
+import asyncio
 import json
-from typing import Dict, Any, List, Optional
-from openai import AsyncOpenAI
+from collections import deque
+from time import perf_counter
+from typing import Dict, Any, List, Optional, Tuple, Union, TYPE_CHECKING
 from .config import settings
+from .rate_estimator import RateEstimator
+from .logs import get_logger
+from . import metrics
+
+if TYPE_CHECKING:
+    from .analytics import UsageColumns
+
+
+PROVIDERS = ("openai", "deepseek")
+
+# Weight of each request's outcome in a provider's error rate
+ERROR_ALPHA = 0.1
+
+# Shared SDK clients per provider, created on first use
+_clients: Dict[str, Any] = {}
+
+log = get_logger("ai")
+
+
+def get_client(provider: str):
+    """
+    Get or create the OpenAI-compatible client for a provider.
+    
+    The OpenAI SDK is imported here rather than at module load, since it
+    dominates import time and many requests never call the model.
+    """
+    if provider not in _clients:
+        from openai import AsyncOpenAI
+        
+        if provider == "openai":
+            _clients[provider] = AsyncOpenAI(api_key=settings.OPENAI_API_KEY)
+        elif provider == "deepseek":
+            _clients[provider] = AsyncOpenAI(
+                api_key=settings.DEEPSEEK_API_KEY,
+                base_url=settings.DEEPSEEK_BASE_URL
+            )
+        else:
+            raise ValueError(f"Unknown AI provider: {provider}")
+    return _clients[provider]
+
+
+def _provider_settings(provider: str) -> Tuple[Optional[str], str]:
+    """(API key, model) of a provider."""
+    if provider == "openai":
+        return settings.OPENAI_API_KEY, settings.OPENAI_MODEL
+    return settings.DEEPSEEK_API_KEY, settings.DEEPSEEK_MODEL
+
+
+class ProviderStats:
+    """Recent latencies (seconds) and error rate of one provider."""
+
+    __slots__ = ("latencies", "error_rate", "requests", "errors", "hedges", "cancelled")
+
+    def __init__(self):
+        self.latencies = deque(maxlen=settings.AI_LATENCY_SAMPLES)
+        self.error_rate = 0.0
+        self.requests = 0
+        self.errors = 0
+        self.hedges = 0  # Requests sent here because another provider was slow or failed
+        self.cancelled = 0  # Requests that lost a hedge race (no latency sample: it is censored)
+
+    def record(self, latency: float, ok: bool):
+        """Record a completed request (failed ones count toward the error rate only)."""
+        self.requests += 1
+        if ok:
+            self.latencies.append(latency)
+        else:
+            self.errors += 1
+        self.error_rate += ERROR_ALPHA * ((0.0 if ok else 1.0) - self.error_rate)
+
+    def percentile(self, q: float) -> Optional[float]:
+        """Latency percentile `q` (0-100), or None before AI_HEDGE_MIN_SAMPLES requests."""
+        if len(self.latencies) < settings.AI_HEDGE_MIN_SAMPLES:
+            return None
+        ordered = sorted(self.latencies)
+        return ordered[min(len(ordered) - 1, int(q / 100 * len(ordered)))]
+
+    def hedge_delay(self) -> float:
+        """Seconds to wait for this provider before also trying the next."""
+        latency = self.percentile(settings.AI_HEDGE_PERCENTILE)
+        if latency is None:
+            return settings.AI_HEDGE_DEFAULT_DELAY_SECONDS
+        return max(settings.AI_HEDGE_MIN_DELAY_SECONDS, latency)
+
+
+_stats: Dict[str, ProviderStats] = {}
+
+
+def get_provider_stats(provider: str) -> ProviderStats:
+    """Latency and error tracking of a provider (per process)."""
+    stats = _stats.get(provider)
+    if stats is None:
+        stats = _stats[provider] = ProviderStats()
+    return stats
+
+
+def rank_providers(providers: List[str]) -> List[str]:
+    """Providers in the order to try: healthy ones first, then by percentile latency."""
+    def key(provider: str) -> Tuple[bool, float]:
+        stats = get_provider_stats(provider)
+        return stats.error_rate > settings.AI_MAX_ERROR_RATE, stats.hedge_delay()
+    return sorted(providers, key=key)
+
+
+def provider_latencies() -> List[Tuple[Dict[str, str], float]]:
+    """AI_HEDGE_PERCENTILE latency per provider (gauge)."""
+    return [
+        ({"provider": provider}, stats.percentile(settings.AI_HEDGE_PERCENTILE) or 0.0)
+        for provider, stats in sorted(_stats.items())
+    ]
+
+
+def provider_error_rates() -> List[Tuple[Dict[str, str], float]]:
+    """Moving-average error rate per provider (gauge)."""
+    return [({"provider": provider}, stats.error_rate) for provider, stats in sorted(_stats.items())]
+
+
+async def _first_result(
+    running: Dict["asyncio.Task", str],
+    timeout: Optional[float]
+) -> Tuple[Optional[Dict[str, Any]], Optional[BaseException]]:
+    """
+    Wait for the first successful attempt.
+
+    Returns early with no result once every running attempt has failed, or
+    when `timeout` (None = no limit) passes. Finished attempts are removed
+    from `running`.
+
+    Returns:
+        (result or None, last error)
+    """
+    loop = asyncio.get_running_loop()
+    deadline = None if timeout is None else loop.time() + timeout
+    error = None
+    while running:
+        remaining = None if deadline is None else deadline - loop.time()
+        if remaining is not None and remaining <= 0:
+            break
+        done, _ = await asyncio.wait(running, timeout=remaining, return_when=asyncio.FIRST_COMPLETED)
+        if not done:
+            break
+        for task in done:
+            running.pop(task)
+            if task.exception() is None:
+                return task.result(), error
+            error = task.exception()
+    return None, error
 
 
 class AIAnalyzer:
     """AI-powered budget analysis and recommendations."""
     
     def __init__(self):
-        """Initialize AI client based on configured provider."""
+        """Validate the configured provider(s); clients are created on first use."""
         self.provider = settings.AI_PROVIDER
         
-        if self.provider == "openai":
-            if not settings.OPENAI_API_KEY:
-                raise ValueError("OPENAI_API_KEY not configured")
-            self.client = AsyncOpenAI(api_key=settings.OPENAI_API_KEY)
-            self.model = settings.OPENAI_MODEL
-        elif self.provider == "deepseek":
-            if not settings.DEEPSEEK_API_KEY:
-                raise ValueError("DEEPSEEK_API_KEY not configured")
-            self.client = AsyncOpenAI(
-                api_key=settings.DEEPSEEK_API_KEY,
-                base_url=settings.DEEPSEEK_BASE_URL
-            )
-            self.model = settings.DEEPSEEK_MODEL
+        if self.provider == "hedged":
+            self.providers = [p for p in PROVIDERS if _provider_settings(p)[0]]
+            if not self.providers:
+                raise ValueError("OPENAI_API_KEY or DEEPSEEK_API_KEY not configured")
+        elif self.provider in PROVIDERS:
+            if not _provider_settings(self.provider)[0]:
+                raise ValueError(f"{self.provider.upper()}_API_KEY not configured")
+            self.providers = [self.provider]
         else:
             raise ValueError(f"Unknown AI provider: {self.provider}")
+        self.model = _provider_settings(self.providers[0])[1]
+    
+    @property
+    def client(self):
+        """OpenAI-compatible client for the first configured provider."""
+        return get_client(self.providers[0])
+    
+    async def _attempt(self, provider: str, request: Dict[str, Any]) -> Dict[str, Any]:
+        """One chat completion on `provider`, parsed as a JSON object (tracked in its stats)."""
+        stats = get_provider_stats(provider)
+        start = perf_counter()
+        try:
+            response = await get_client(provider).chat.completions.create(
+                model=_provider_settings(provider)[1],
+                **request
+            )
+            result = json.loads(response.choices[0].message.content)
+            if not isinstance(result, dict):
+                raise ValueError("Response is not a JSON object")
+        except asyncio.CancelledError:
+            # Lost the race: only a lower bound on its latency, kept out of the percentile
+            stats.cancelled += 1
+            raise
+        except Exception:
+            stats.record(perf_counter() - start, ok=False)
+            raise
+        stats.record(perf_counter() - start, ok=True)
+        return result
+    
+    async def _complete(self, operation: str, system: str, prompt: str, temperature: float) -> Dict[str, Any]:
+        """
+        Chat completion returning a JSON object, hedged across providers.
+        
+        Args:
+            operation: Operation name (for logs)
+            system: System message
+            prompt: User message
+            temperature: Sampling temperature
+            
+        Raises:
+            The last provider's error if none returned a valid response
+        """
+        request = {
+            "messages": [
+                {"role": "system", "content": system},
+                {"role": "user", "content": prompt}
+            ],
+            "response_format": {"type": "json_object"},
+            "temperature": temperature
+        }
+        if len(self.providers) == 1:
+            return await self._attempt(self.providers[0], request)
+        
+        providers = rank_providers(self.providers)
+        running: Dict["asyncio.Task", str] = {}
+        error: Optional[BaseException] = None
+        try:
+            for i, provider in enumerate(providers):
+                if i > 0:
+                    get_provider_stats(provider).hedges += 1
+                    log.info("ai_request_hedged", operation=operation, provider=provider, after=providers[i - 1])
+                running[asyncio.ensure_future(self._attempt(provider, request))] = provider
+                # The next provider is tried after this one's hedge delay, or at once if all attempts failed
+                delay = get_provider_stats(provider).hedge_delay() if i + 1 < len(providers) else None
+                result, failed = await _first_result(running, delay)
+                error = failed or error
+                if result is not None:
+                    return result
+            raise error
+        finally:
+            for task in running:
+                task.cancel()
     
+    @metrics.timed("ai.analyze_spending_patterns")
     async def analyze_spending_patterns(
         self,
-        usage_data: List[Dict[str, Any]],
+        usage_data: Union["UsageColumns", List[Dict[str, Any]]],
         budget_info: Dict[str, Any]
     ) -> Dict[str, Any]:
         """
         Analyze spending patterns and provide insights.
         
         Args:
-            usage_data: List of API usage records
+            usage_data: API usage window as columns (or a list of usage records)
             budget_info: Budget configuration and current status
             
         Returns:
             Analysis results with patterns, anomalies, and recommendations
         """
+        from .analytics import UsageColumns
+        
+        if not isinstance(usage_data, UsageColumns):
+            usage_data = UsageColumns.from_records(usage_data)
+        
         # Prepare context for AI
         context = self._prepare_analysis_context(usage_data, budget_info)
         
@@ -83,58 +314,67 @@ class AIAnalyzer:
         """
         
         try:
-            response = await self.client.chat.completions.create(
-                model=self.model,
-                messages=[
-                    {
-                        "role": "system",
-                        "content": "You are an expert AI financial analyst specializing in API cost optimization."
-                    },
-                    {
-                        "role": "user",
-                        "content": prompt
-                    }
-                ],
-                response_format={"type": "json_object"},
-                temperature=0.7
-            )
+            with metrics.stage("ai.analyze_spending_patterns", "llm_call"):
+                analysis = await self._complete(
+                    "analyze_spending_patterns",
+                    "You are an expert AI financial analyst specializing in API cost optimization.",
+                    prompt,
+                    temperature=0.7
+                )
             
-            analysis = json.loads(response.choices[0].message.content)
             return analysis
             
         except Exception as e:
-            print(f"AI analysis error: {e}")
+            log.error("ai_request_failed", operation="analyze_spending_patterns", provider=self.provider, error=str(e))
             return self._fallback_analysis(usage_data, budget_info)
     
+    @metrics.timed("ai.detect_unusual_pattern")
     async def detect_unusual_pattern(
         self,
         recent_usage: List[Dict[str, Any]],
-        historical_average: Dict[str, Any]
+        historical_average: Dict[str, Any],
+        recent_count: Optional[int] = None,
+        recent_cost: Optional[float] = None,
+        recent_rate: Optional[float] = None,
+        recent_cost_rate: Optional[float] = None
     ) -> Optional[Dict[str, Any]]:
         """
         Detect if current usage pattern is unusual compared to historical data.
         
+        The LLM is only called when the recent call rate or cost rate exceeds
+        UNUSUAL_PATTERN_MULTIPLIER times the historical rate.
+        
         Args:
-            recent_usage: Recent API calls
-            historical_average: Historical usage statistics
+            recent_usage: Recent API calls (all of them, or a sample of the latest;
+                may be empty when recent_count and the rates are given)
+            historical_average: avg_calls_per_minute and avg_cost_per_minute
+            recent_count: Calls in the recent window (default: len(recent_usage))
+            recent_cost: Cost in the recent window (default: sum over recent_usage)
+            recent_rate: Recent calls per minute (default: estimated from recent_usage timestamps)
+            recent_cost_rate: Recent cost per minute (default: estimated from recent_usage)
             
         Returns:
             Alert information if pattern is unusual, None otherwise
         """
-        if not recent_usage:
+        if not recent_usage and not recent_count:
             return None
         
         # Calculate recent metrics
-        recent_cost = sum(u.get("cost", 0) for u in recent_usage)
-        recent_count = len(recent_usage)
-        recent_rate = recent_count / max(1, len(recent_usage) / 60)  # calls per minute
+        if recent_cost is None:
+            recent_cost = sum(u.get("cost", 0) for u in recent_usage)
+        if recent_count is None:
+            recent_count = len(recent_usage)
+        if recent_rate is None or recent_cost_rate is None:
+            estimator = RateEstimator.from_usage(recent_usage)
+            recent_rate = estimator.rate()
+            recent_cost_rate = estimator.cost_rate()
         
         # Compare with historical
         avg_cost = historical_average.get("avg_cost_per_minute", 0)
         avg_rate = historical_average.get("avg_calls_per_minute", 0)
         
         # Check for unusual patterns
-        cost_multiplier = recent_cost / max(0.01, avg_cost) if avg_cost > 0 else 1
+        cost_multiplier = recent_cost_rate / max(0.01, avg_cost) if avg_cost > 0 else 1
         rate_multiplier = recent_rate / max(0.01, avg_rate) if avg_rate > 0 else 1
         
         if cost_multiplier > settings.UNUSUAL_PATTERN_MULTIPLIER or \
@@ -142,8 +382,9 @@ class AIAnalyzer:
             
             prompt = f"""
             Unusual API usage detected:
-            - Recent cost rate: ${recent_cost}/min (normal: ${avg_cost}/min)
-            - Recent call rate: {recent_rate} calls/min (normal: {avg_rate} calls/min)
+            - Recent cost rate: ${recent_cost_rate:.4f}/min (normal: ${avg_cost:.4f}/min)
+            - Recent call rate: {recent_rate:.2f} calls/min (normal: {avg_rate:.2f} calls/min)
+            - Last {settings.ANALYSIS_WINDOW_MINUTES} minutes: {recent_count} calls, ${recent_cost:.4f}
             - Cost multiplier: {cost_multiplier:.1f}x
             - Rate multiplier: {rate_multiplier:.1f}x
             
@@ -166,26 +407,16 @@ class AIAnalyzer:
             """
             
             try:
-                response = await self.client.chat.completions.create(
-                    model=self.model,
-                    messages=[
-                        {
-                            "role": "system",
-                            "content": "You are a security and cost analyst for API usage."
-                        },
-                        {
-                            "role": "user",
-                            "content": prompt
-                        }
-                    ],
-                    response_format={"type": "json_object"},
-                    temperature=0.3
-                )
-                
-                return json.loads(response.choices[0].message.content)
+                with metrics.stage("ai.detect_unusual_pattern", "llm_call"):
+                    return await self._complete(
+                        "detect_unusual_pattern",
+                        "You are a security and cost analyst for API usage.",
+                        prompt,
+                        temperature=0.3
+                    )
                 
             except Exception as e:
-                print(f"Pattern detection error: {e}")
+                log.error("ai_request_failed", operation="detect_unusual_pattern", provider=self.provider, error=str(e))
                 # Fallback to rule-based detection
                 return {
                     "is_unusual": True,
@@ -197,104 +428,93 @@ class AIAnalyzer:
         
         return None
     
-    async def suggest_optimization(
+    @metrics.timed("ai.phrase_optimizations")
+    async def phrase_optimizations(
         self,
-        api_usage_summary: Dict[str, Any]
+        recommendations: List[Dict[str, Any]]
     ) -> List[Dict[str, Any]]:
         """
-        Suggest cost optimizations based on usage patterns.
+        Rewrite the descriptions of computed recommendations for the user.
+        
+        Only the wording comes from the model: types, APIs and savings are
+        kept as computed. On any error the recommendations are returned
+        unchanged.
         
         Args:
-            api_usage_summary: Summary of API usage by provider
+            recommendations: Recommendations from the local recommender
             
         Returns:
-            List of optimization suggestions
+            The recommendations with `description` rewritten
         """
+        if not recommendations:
+            return recommendations
+        facts = [
+            {
+                "index": i,
+                "type": rec["type"],
+                "current_api": rec["current_api"],
+                "suggested_api": rec["suggested_api"],
+                "estimated_monthly_savings": rec["estimated_monthly_savings"],
+                "evidence": rec.get("evidence", {}),
+                "description": rec["description"]
+            }
+            for i, rec in enumerate(recommendations)
+        ]
         prompt = f"""
-        Analyze this API usage and suggest cost optimizations:
+        Rewrite the description of each API cost optimization below in one or two
+        clear, actionable sentences for the user. Keep every number as given and
+        do not add new suggestions.
         
-        {json.dumps(api_usage_summary, indent=2)}
+        {json.dumps(facts, indent=2)}
         
-        Consider:
-        - Switching to cheaper models for simple tasks (e.g., GPT-4 → GPT-3.5-turbo)
-        - Batch processing to reduce API calls
-        - Caching frequently requested data
-        - Using alternative providers with better pricing
-        
-        Respond with JSON array of optimizations:
-        [
-            {{
-                "type": "model_switch|batching|caching|provider_switch",
-                "current_api": "Current API/model",
-                "suggested_api": "Suggested alternative",
-                "description": "Why this helps",
-                "estimated_monthly_savings": 45.00,
-                "implementation_difficulty": "easy|medium|hard",
-                "priority": "high|medium|low"
-            }}
-        ]
+        Respond with JSON:
+        {{"descriptions": [{{"index": 0, "description": "..."}}]}}
         """
         
         try:
-            response = await self.client.chat.completions.create(
-                model=self.model,
-                messages=[
-                    {
-                        "role": "system",
-                        "content": "You are a cost optimization expert for API services."
-                    },
-                    {
-                        "role": "user",
-                        "content": prompt
-                    }
-                ],
-                response_format={"type": "json_object"},
-                temperature=0.5
-            )
+            with metrics.stage("ai.phrase_optimizations", "llm_call"):
+                result = await self._complete(
+                    "phrase_optimizations",
+                    "You are a cost optimization expert for API services.",
+                    prompt,
+                    temperature=0.3
+                )
             
-            result = json.loads(response.choices[0].message.content)
-            return result.get("optimizations", [])
+            phrased = [dict(rec) for rec in recommendations]
+            for item in result.get("descriptions", []):
+                index = item.get("index")
+                if isinstance(index, int) and 0 <= index < len(phrased) and item.get("description"):
+                    phrased[index]["description"] = str(item["description"])
+            return phrased
             
         except Exception as e:
-            print(f"Optimization suggestion error: {e}")
-            return []
+            log.error("ai_request_failed", operation="phrase_optimizations", provider=self.provider, error=str(e))
+            return recommendations
     
     def _prepare_analysis_context(
         self,
-        usage_data: List[Dict[str, Any]],
+        usage_data: "UsageColumns",
         budget_info: Dict[str, Any]
     ) -> Dict[str, Any]:
         """Prepare structured context for AI analysis."""
-        # Aggregate by API/provider
-        api_breakdown = {}
-        for usage in usage_data:
-            api_key = f"{usage.get('provider')}:{usage.get('api_name')}"
-            if api_key not in api_breakdown:
-                api_breakdown[api_key] = {
-                    "provider": usage.get("provider"),
-                    "api_name": usage.get("api_name"),
-                    "total_cost": 0,
-                    "request_count": 0,
-                    "tokens_used": 0
-                }
-            api_breakdown[api_key]["total_cost"] += usage.get("cost", 0)
-            api_breakdown[api_key]["request_count"] += usage.get("request_count", 1)
-            api_breakdown[api_key]["tokens_used"] += usage.get("tokens_used", 0)
+        # Aggregate by API/provider (vectorized group-by)
+        api_breakdown = usage_data.breakdown()
         
         return {
             "budget": budget_info,
             "total_usage_records": len(usage_data),
             "api_breakdown": api_breakdown,
+            "hourly_distribution": usage_data.hourly_histogram(),
             "time_period": f"Last {len(usage_data)} transactions"
         }
     
     def _fallback_analysis(
         self,
-        usage_data: List[Dict[str, Any]],
+        usage_data: "UsageColumns",
         budget_info: Dict[str, Any]
     ) -> Dict[str, Any]:
         """Fallback analysis when AI is unavailable."""
-        total_cost = sum(u.get("cost", 0) for u in usage_data)
+        total_cost = usage_data.total_cost()
         
         return {
             "patterns_detected": [
@@ -0,0 +1,310 @@
+"""
+Columnar analytics for API usage windows.
+
+Usage rows are fetched as plain tuples with a Core ``select`` (no ORM
+entities) and packed into NumPy arrays. Breakdowns, percentiles and hourly
+histograms are then computed with vectorized group-by instead of per-row
+Python loops. Costs are fetched as integer micro-units (see money.py) and
+summed as int64, so totals are exact; a float view is used for averages,
+percentiles and other statistics. Rows carry their API as the integer
+`api_dim_id` (see dimensions); names are looked up once per distinct API.
+"""
+
+from datetime import datetime
+from operator import attrgetter, itemgetter
+from typing import Dict, Any, List, Optional, Sequence, Tuple
+
+import numpy as np
+from sqlalchemy import select, func, and_
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from .database import ApiUsage
+from .dimensions import get_api_dimensions
+from .money import MICROS, to_micros, from_micros
+from .retention import retention_cutoff, read_archived_usage
+
+
+# Column order used by fetch_usage_columns and UsageColumns.from_rows
+USAGE_COLUMNS = (
+    ApiUsage.api_dim_id,
+    ApiUsage.cost_micros,
+    func.coalesce(ApiUsage.request_count, 1),
+    func.coalesce(ApiUsage.tokens_used, 0),
+    ApiUsage.timestamp,
+)
+
+
+ApiLabels = Dict[int, Tuple[str, str]]  # API code -> (provider, api_name)
+
+
+def _encode(keys: Sequence[Tuple[str, str]], labels: ApiLabels) -> np.ndarray:
+    """Codes for (provider, api_name) keys without an `api_dim_id`, added to `labels` as negative codes."""
+    index = {key: code for code, key in labels.items() if code < 0}
+    codes = np.fromiter(
+        (index.setdefault(key, -1 - len(index)) for key in keys),
+        dtype=np.int64,
+        count=len(keys)
+    )
+    labels.update((code, key) for key, code in index.items())
+    return codes
+
+
+def _group_sum(codes: np.ndarray, values: np.ndarray, n_groups: int) -> np.ndarray:
+    """Exact int64 sum of `values` per group code (np.bincount only sums floats)."""
+    sums = np.zeros(n_groups, dtype=np.int64)
+    np.add.at(sums, codes, values)
+    return sums
+
+
+def _as_datetime(value: Any) -> Optional[datetime]:
+    """Accept datetimes or ISO-8601 strings."""
+    if isinstance(value, str):
+        return datetime.fromisoformat(value)
+    return value
+
+
+class UsageColumns:
+    """
+    Column buffers for a window of API usage.
+
+    Each attribute is a NumPy array with one entry per usage row (timestamps
+    are kept as datetime objects). `api` holds each row's API code, and
+    `api_labels` the (provider, api_name) of each code: an `api_dim_id`, or a
+    negative code for rows without one (archived or passed as dicts).
+    `cost_micros` holds the exact costs and `cost` the same values as float
+    amounts. Group-by operations work on the codes, so the
+    "provider:api_name" key is only built once per group.
+    """
+
+    def __init__(
+        self,
+        api: np.ndarray,
+        api_labels: ApiLabels,
+        cost_micros: np.ndarray,
+        request_count: np.ndarray,
+        tokens_used: np.ndarray,
+        timestamp: np.ndarray
+    ):
+        self.api = api
+        self.api_labels = api_labels
+        self.cost_micros = cost_micros
+        self.cost = cost_micros / MICROS
+        self.request_count = request_count
+        self.tokens_used = tokens_used
+        self.timestamp = timestamp
+        self._groups: Optional[Tuple[List[Tuple[str, str]], np.ndarray]] = None
+
+    @classmethod
+    def from_rows(cls, rows: Sequence[Sequence[Any]], api_labels: ApiLabels) -> "UsageColumns":
+        """
+        Build columns from (api code, cost_micros, request_count, tokens_used, timestamp) tuples.
+
+        Args:
+            rows: Row tuples in USAGE_COLUMNS order
+            api_labels: (provider, api_name) of every code in the rows
+        """
+        n = len(rows)
+        if n == 0:
+            return cls.empty()
+
+        # Column-wise itemgetter passes avoid materializing zip(*rows)
+        def column(i: int):
+            return map(itemgetter(i), rows)
+
+        return cls(
+            api=np.fromiter(column(0), dtype=np.int64, count=n),
+            api_labels=api_labels,
+            cost_micros=np.fromiter(column(1), dtype=np.int64, count=n),
+            request_count=np.fromiter(column(2), dtype=np.int64, count=n),
+            tokens_used=np.fromiter(column(3), dtype=np.int64, count=n),
+            timestamp=np.fromiter(column(4), dtype=object, count=n),
+        )
+
+    @classmethod
+    def from_records(cls, records: Sequence[Dict[str, Any]]) -> "UsageColumns":
+        """Build columns from usage dicts (as previously passed to the analyzer)."""
+        labels: ApiLabels = {}
+        codes = _encode([(r.get("provider"), r.get("api_name")) for r in records], labels)
+        rows = [
+            (
+                code,
+                r.get("cost_micros") or to_micros(r.get("cost") or 0),
+                r.get("request_count") or 1,
+                r.get("tokens_used") or 0,
+                _as_datetime(r.get("timestamp")),
+            )
+            for code, r in zip(codes.tolist(), records)
+        ]
+        return cls.from_rows(rows, labels)
+
+    @classmethod
+    def empty(cls) -> "UsageColumns":
+        """Columns for an empty window."""
+        return cls(
+            api=np.empty(0, dtype=np.int64),
+            api_labels={},
+            cost_micros=np.empty(0, dtype=np.int64),
+            request_count=np.empty(0, dtype=np.int64),
+            tokens_used=np.empty(0, dtype=np.int64),
+            timestamp=np.empty(0, dtype=object),
+        )
+
+    def __len__(self) -> int:
+        return len(self.cost)
+
+    def total_cost(self) -> float:
+        """Sum of cost over the window."""
+        return from_micros(int(self.cost_micros.sum()))
+
+    def groups(self) -> Tuple[List[Tuple[str, str]], np.ndarray]:
+        """
+        Group rows by (provider, api_name).
+
+        Codes are grouped first; codes with the same names (e.g. two api_ids
+        recorded under one api_name) are then merged, per code, not per row.
+
+        Returns:
+            Tuple of (group keys, per-row group index)
+        """
+        if self._groups is None:
+            if len(self) == 0:
+                self._groups = ([], np.empty(0, dtype=np.intp))
+            else:
+                codes, inverse = np.unique(self.api, return_inverse=True)
+                index: Dict[Tuple[str, str], int] = {}
+                merged = np.array(
+                    [index.setdefault(self.api_labels[c], len(index)) for c in codes.tolist()],
+                    dtype=np.intp
+                )
+                self._groups = (list(index), merged[inverse.ravel()])
+        return self._groups
+
+    def cost_by_key(self) -> Dict[str, float]:
+        """Total cost per "provider:api_name"."""
+        keys, inverse = self.groups()
+        sums = _group_sum(inverse, self.cost_micros, len(keys))
+        return {
+            f"{provider}:{api_name}": from_micros(total)
+            for (provider, api_name), total in zip(keys, sums.tolist())
+        }
+
+    def breakdown(self, percentiles: Sequence[float] = (50, 95)) -> Dict[str, Dict[str, Any]]:
+        """
+        Per-API breakdown with sums, counts and cost percentiles.
+
+        Args:
+            percentiles: Per-call cost percentiles to include (0-100)
+
+        Returns:
+            Dict keyed by "provider:api_name"
+        """
+        keys, inverse = self.groups()
+        n_groups = len(keys)
+        if n_groups == 0:
+            return {}
+
+        total_cost = _group_sum(inverse, self.cost_micros, n_groups) / MICROS
+        request_count = np.bincount(inverse, weights=self.request_count, minlength=n_groups)
+        tokens_used = np.bincount(inverse, weights=self.tokens_used, minlength=n_groups)
+        calls = np.bincount(inverse, minlength=n_groups)
+        avg_cost = np.divide(
+            total_cost, request_count,
+            out=np.zeros(n_groups), where=request_count > 0
+        )
+        group_percentiles = {
+            p: self._group_percentile(inverse, calls, p / 100.0).tolist()
+            for p in percentiles
+        }
+
+        breakdown = {}
+        for i, (provider, api_name) in enumerate(keys):
+            entry = {
+                "provider": provider,
+                "api_name": api_name,
+                "total_cost": float(total_cost[i]),
+                "request_count": int(request_count[i]),
+                "tokens_used": int(tokens_used[i]),
+                "calls": int(calls[i]),
+                "avg_cost_per_request": float(avg_cost[i]),
+            }
+            for p, values in group_percentiles.items():
+                entry[f"p{p:g}_cost"] = values[i]
+            breakdown[f"{provider}:{api_name}"] = entry
+        return breakdown
+
+    def hourly_histogram(self) -> Dict[str, List[float]]:
+        """Calls and cost per hour of day (UTC), 24 buckets each."""
+        if len(self) == 0:
+            return {"calls": [0] * 24, "cost": [0.0] * 24}
+        hours = np.fromiter(map(attrgetter("hour"), self.timestamp), dtype=np.intp, count=len(self))
+        return {
+            "calls": np.bincount(hours, minlength=24).tolist(),
+            "cost": (_group_sum(hours, self.cost_micros, 24) / MICROS).tolist(),
+        }
+
+    def _group_percentile(self, inverse: np.ndarray, counts: np.ndarray, q: float) -> np.ndarray:
+        """Linear-interpolated cost quantile per group, without a Python loop over rows."""
+        order = np.lexsort((self.cost, inverse))
+        sorted_cost = self.cost[order]
+        starts = np.concatenate(([0], np.cumsum(counts)[:-1]))
+        pos = (counts - 1) * q
+        lower = np.floor(pos).astype(np.int64)
+        upper = np.ceil(pos).astype(np.int64)
+        frac = pos - lower
+        lo = sorted_cost[starts + lower]
+        hi = sorted_cost[starts + upper]
+        return lo + (hi - lo) * frac
+
+
+async def fetch_usage_columns(
+    db: AsyncSession,
+    user_address: str,
+    since: datetime,
+    until: Optional[datetime] = None
+) -> UsageColumns:
+    """
+    Fetch a user's usage window as columns.
+
+    Windows reaching back past the retention cutoff also read the archived
+    rows for the range, so callers see one continuous history.
+
+    Args:
+        db: Database session
+        user_address: User to fetch usage for
+        since: Inclusive window start
+        until: Exclusive window end (default: open-ended)
+
+    Returns:
+        UsageColumns for the window
+    """
+    conditions = [
+        ApiUsage.user_address == user_address,
+        ApiUsage.timestamp >= since
+    ]
+    if until is not None:
+        conditions.append(ApiUsage.timestamp < until)
+
+    stmt = select(*USAGE_COLUMNS).where(and_(*conditions))
+    result = await db.execute(stmt)
+    rows = result.all()
+    labels: ApiLabels = {
+        dim_id: (provider, api_name)
+        for dim_id, (provider, _, api_name) in (
+            await get_api_dimensions(user_address).labels(db, set(map(itemgetter(0), rows)))
+        ).items()
+    }
+
+    if since < retention_cutoff():
+        archived = await read_archived_usage(db, user_address, since, until)
+        codes = _encode([(r["provider"], r["api_name"]) for r in archived], labels)
+        rows = [
+            (
+                code,
+                r["cost_micros"],
+                r["request_count"] or 1,
+                r["tokens_used"] or 0,
+                datetime.fromisoformat(r["timestamp"])
+            )
+            for code, r in zip(codes.tolist(), archived)
+        ] + list(rows)
+    return UsageColumns.from_rows(rows, labels)
@@ -0,0 +1,338 @@
+"""
+Offline backtest of alert and anomaly policies over historical usage.
+
+Replays stored usage (raw rows plus archives) through the budget threshold
+alerts and the unusual-pattern prefilter, for one user or every user on the
+local shards, and reports what each policy variant would have raised.
+Nothing goes through the service per event. A shard's usage is loaded as
+NumPy columns sorted by (user, time), and everything is computed with
+vectorized passes over them:
+
+- Month-to-date spend is a cumulative sum restarted per (user, month). A
+  threshold alert is the first row of a user-month at or above the level,
+  as raised at ingest. A pause is the pause-level crossing, and its blocked
+  spend is what the user spent after it that month.
+- Calls and cost in the analysis window before each call, in the 7-day
+  baseline before that window, and in the day after the call are prefix-sum
+  differences at `searchsorted` bounds. They do not depend on the policy, so
+  they are computed once per shard, and each variant is one comparison.
+  Rates are window averages rather than the service's EWMAs. A flag is a
+  call that would be sent to the LLM (whose verdict cannot be replayed), at
+  most once per analysis window slot per user.
+
+False positives are judged in hindsight, the same way for every variant. A
+warning or critical alert is false if the month ended under the limit. An
+unusual-pattern flag is false if the next day's spend stayed under
+`incident_ratio` times the baseline daily spend. Alerts whose month or next
+day is not over yet are counted as unresolved.
+"""
+
+from datetime import datetime, timedelta
+from operator import itemgetter
+from typing import Any, Dict, Iterable, List, Optional, Sequence, Tuple
+
+import numpy as np
+from sqlalchemy import select, and_
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from .database import ApiUsage, BudgetConfig
+from .budget_cache import month_start
+from .money import MICROS, from_micros
+from .retention import retention_cutoff, read_archived_usage
+from .schemas import BacktestPolicy
+from .config import settings
+
+DAY = 86400
+BASELINE_DAYS = 7
+MIN_RECENT_CALLS = 10  # As in BudgetGuardianService._check_unusual_patterns
+
+Row = Tuple[str, datetime, int]  # (user_address, timestamp, cost_micros)
+
+
+EPOCH = datetime(1970, 1, 1)
+MICROSECOND = timedelta(microseconds=1)
+
+
+def epoch_micros(timestamps: Iterable[datetime], count: int = -1) -> np.ndarray:
+    """Epoch microseconds of naive UTC datetimes (faster than converting them to datetime64)."""
+    return np.fromiter(((ts - EPOCH) // MICROSECOND for ts in timestamps), dtype=np.int64, count=count)
+
+
+def _month_ends(months: np.ndarray) -> np.ndarray:
+    """Epoch seconds of the start of the month after each datetime64[M]."""
+    return (months + 1).astype("datetime64[us]").astype(np.int64) / 1e6
+
+
+class UsageSeries:
+    """
+    A shard's usage as columns sorted by (user, time), with the policy-independent features.
+
+    Args:
+        rows: (user_address, timestamp, cost_micros) tuples, in any order
+        configs: Budget config per user (monthly_limit_micros, warning_threshold, pause_threshold)
+        window_seconds: Analysis window (ANALYSIS_WINDOW_MINUTES)
+    """
+
+    def __init__(self, rows: Sequence[Row], configs: Dict[str, Dict[str, Any]], window_seconds: int):
+        self.window_seconds = window_seconds
+        n = len(rows)
+        index: Dict[str, int] = {}
+        user = np.fromiter((index.setdefault(r[0], len(index)) for r in rows), dtype=np.int64, count=n)
+        micros = epoch_micros(map(itemgetter(1), rows), n)
+        cost = np.fromiter(map(itemgetter(2), rows), dtype=np.int64, count=n)
+        order = np.lexsort((micros, user))
+        micros = micros[order]
+        self.users: List[str] = list(index)
+        self.user = user[order]
+        self.t = micros / 1e6
+        self.cost = cost[order]
+        self.prefix = np.concatenate(([0], np.cumsum(self.cost)))  # Spend before row i = prefix[i]
+
+        # Per-user budget settings (NaN limit = no config)
+        self.limit = np.full(len(index), np.nan)
+        self.warning = np.full(len(index), 0.8)
+        self.pause = np.full(len(index), 1.0)
+        for i, address in enumerate(self.users):
+            config = configs.get(address)
+            if config and config["monthly_limit_micros"] > 0:
+                self.limit[i] = config["monthly_limit_micros"]
+                self.warning[i] = config["warning_threshold"] or 0.8
+                self.pause[i] = config["pause_threshold"] or 1.0
+
+        self._months(micros.astype("datetime64[us]").astype("datetime64[M]"))
+        self._windows()
+
+    def __len__(self) -> int:
+        return len(self.t)
+
+    def _months(self, month: np.ndarray):
+        """Group rows by (user, month): month-to-date spend, month totals and ends."""
+        new_group = np.ones(len(self), dtype=bool)
+        new_group[1:] = (self.user[1:] != self.user[:-1]) | (month[1:] != month[:-1])
+        starts = np.flatnonzero(new_group)
+        ends = np.append(starts[1:], len(self))
+        self.group = np.cumsum(new_group) - 1
+        self.group_user = self.user[starts]
+        self.group_total = self.prefix[ends] - self.prefix[starts]
+        self.group_end = _month_ends(month[starts])
+        self.month_to_date = self.prefix[1:] - self.prefix[starts][self.group]
+
+    def _window_sums(self, key: np.ndarray, low: float, high: float) -> Tuple[np.ndarray, np.ndarray]:
+        """Calls and cost of the same user in (t + low, t + high] for every row."""
+        lo = np.searchsorted(key, key + low, side="right")
+        hi = np.searchsorted(key, key + high, side="right")
+        return hi - lo, self.prefix[hi] - self.prefix[lo]
+
+    def _windows(self):
+        """Recent window, baseline and next-day sums, and the prefilter's multipliers."""
+        if len(self) == 0:
+            self.recent_calls = np.empty(0, dtype=np.int64)
+            self.rate_multiplier = self.cost_multiplier = self.next_day = self.baseline_day = np.empty(0)
+            return
+        # One sorted key for all users: each user's times shifted past the previous user's
+        t0 = self.t.min()
+        span = self.t.max() - t0 + 2 * (BASELINE_DAYS + 1) * DAY
+        key = self.user * span + (self.t - t0)
+
+        w = self.window_seconds
+        self.recent_calls, recent_cost = self._window_sums(key, -w, 0)
+        baseline_calls, baseline_cost = self._window_sums(key, -w - BASELINE_DAYS * DAY, -w)
+        _, self.next_day = self._window_sums(key, 0, DAY)
+
+        # Same formulas as AIAnalyzer.detect_unusual_pattern (per minute, cost in currency units)
+        minutes = w / 60
+        baseline_minutes = BASELINE_DAYS * 1440
+        avg_rate = baseline_calls / baseline_minutes
+        avg_cost = baseline_cost / MICROS / baseline_minutes
+        self.rate_multiplier = np.where(
+            avg_rate > 0, (self.recent_calls / minutes) / np.maximum(0.01, avg_rate), 1.0
+        )
+        self.cost_multiplier = np.where(
+            avg_cost > 0, (recent_cost / MICROS / minutes) / np.maximum(0.01, avg_cost), 1.0
+        )
+        self.baseline_day = baseline_cost / BASELINE_DAYS
+
+    def _crossings(self, level: np.ndarray) -> np.ndarray:
+        """Row index of each user-month's first row at or above the user's `level` (-1 = none)."""
+        first = np.full(len(self.group_total), -1)
+        rows = np.flatnonzero(self.month_to_date >= level[self.user])  # NaN levels never match
+        groups, index = np.unique(self.group[rows], return_index=True)
+        first[groups] = rows[index]
+        return first
+
+    def replay(self, policy: BacktestPolicy, since: float, until: float, incident_ratio: float) -> Dict[str, Any]:
+        """
+        Alerts, pauses and false positives of one policy over [since, until) (epoch seconds).
+
+        Returns:
+            Counts per alert type, pauses (amounts in micro-units) and blocked spend
+        """
+        in_range = (self.t >= since) & (self.t < until)
+        alerts: Dict[str, int] = {}
+        false_positives: Dict[str, int] = {}
+        unresolved: Dict[str, int] = {}
+        pauses: List[Dict[str, Any]] = []
+        blocked = 0
+
+        resolved_month = self.group_end <= until
+        under_limit = self.group_total < self.limit[self.group_user]
+        warning = self.warning if policy.warning_threshold is None else policy.warning_threshold
+        critical = settings.CRITICAL_THRESHOLD if policy.critical_threshold is None else policy.critical_threshold
+        pause = self.pause if policy.pause_threshold is None else policy.pause_threshold
+        for alert_type, fraction in (("warning", warning), ("critical", critical), ("pause", pause)):
+            crossing = self._crossings(self.limit * fraction)
+            raised = crossing >= 0
+            raised[raised] = in_range[crossing[raised]]
+            alerts[alert_type] = int(raised.sum())
+            if alert_type != "pause":
+                false_positives[alert_type] = int((raised & resolved_month & under_limit).sum())
+                unresolved[alert_type] = int((raised & ~resolved_month).sum())
+                continue
+            for group in np.flatnonzero(raised).tolist():
+                row = crossing[group]
+                after = int(self.group_total[group] - self.month_to_date[row])
+                blocked += after
+                pauses.append({
+                    "user_address": self.users[self.group_user[group]],
+                    "paused_at": datetime.utcfromtimestamp(self.t[row]).isoformat(),
+                    "blocked_spend_micros": after
+                })
+
+        multiplier = (
+            settings.UNUSUAL_PATTERN_MULTIPLIER if policy.unusual_pattern_multiplier is None
+            else policy.unusual_pattern_multiplier
+        )
+        flagged = np.flatnonzero(
+            in_range
+            & (self.recent_calls >= MIN_RECENT_CALLS)
+            & ((self.cost_multiplier > multiplier) | (self.rate_multiplier > multiplier))
+        )
+        # At most one check per analysis window slot per user (the service's cooldown)
+        slot = (self.t[flagged] // self.window_seconds).astype(np.int64)
+        slot_key = self.user[flagged].astype(np.int64) * (int(slot.max(initial=0)) + 1) + slot
+        flagged = flagged[np.unique(slot_key, return_index=True)[1]]
+        settled = self.t[flagged] + DAY <= until
+        incident = self.next_day[flagged] > incident_ratio * self.baseline_day[flagged]
+        alerts["unusual_pattern"] = len(flagged)
+        false_positives["unusual_pattern"] = int((settled & ~incident).sum())
+        unresolved["unusual_pattern"] = int((~settled).sum())
+
+        return {
+            "alerts": alerts,
+            "false_positives": false_positives,
+            "unresolved": unresolved,
+            "pauses": pauses,
+            "blocked_spend_micros": blocked
+        }
+
+
+async def load_series(
+    db: AsyncSession,
+    since: datetime,
+    until: datetime,
+    user_address: Optional[str] = None
+) -> UsageSeries:
+    """
+    Load a shard's usage for a backtest of [since, until).
+
+    Rows are read from the start of `since`'s month (for month-to-date spend)
+    or the baseline before it, whichever is earlier, including archives.
+
+    Args:
+        db: Shard database session
+        since: Start of the replayed period
+        until: End of the replayed period
+        user_address: One user (default: every user on the shard)
+    """
+    window_seconds = settings.ANALYSIS_WINDOW_MINUTES * 60
+    load_since = min(month_start(since), since - timedelta(days=BASELINE_DAYS, seconds=window_seconds))
+    conditions = [ApiUsage.timestamp >= load_since, ApiUsage.timestamp < until]
+    config_stmt = select(
+        BudgetConfig.user_address, BudgetConfig.monthly_limit_micros,
+        BudgetConfig.warning_threshold, BudgetConfig.pause_threshold
+    )
+    if user_address is not None:
+        conditions.append(ApiUsage.user_address == user_address)
+        config_stmt = config_stmt.where(BudgetConfig.user_address == user_address)
+
+    stmt = select(ApiUsage.user_address, ApiUsage.timestamp, ApiUsage.cost_micros).where(and_(*conditions))
+    rows: List[Row] = list((await db.execute(stmt)).all())
+    if load_since < retention_cutoff():
+        archived = await read_archived_usage(db, user_address, load_since, until)
+        rows.extend(
+            (r["user_address"], datetime.fromisoformat(r["timestamp"]), r["cost_micros"]) for r in archived
+        )
+    configs = {row["user_address"]: row for row in (await db.execute(config_stmt)).mappings()}
+    return UsageSeries(rows, configs, window_seconds)
+
+
+async def backtest(
+    db: AsyncSession,
+    policies: Sequence[BacktestPolicy],
+    days: int = 30,
+    user_address: Optional[str] = None,
+    incident_ratio: float = 2.0,
+    now: Optional[datetime] = None
+) -> List[Dict[str, Any]]:
+    """
+    Replay the last `days` of one shard's usage through each policy.
+
+    Returns:
+        One result per policy (see UsageSeries.replay)
+    """
+    until = now or datetime.utcnow()
+    since = until - timedelta(days=days)
+    series = await load_series(db, since, until, user_address)
+    start, end = (epoch_micros([since, until]) / 1e6).tolist()
+    return [series.replay(policy, start, end, incident_ratio) for policy in policies]
+
+
+def merge_results(policies: Sequence[BacktestPolicy], shards: Sequence[List[Dict[str, Any]]]) -> List[Dict[str, Any]]:
+    """Sum per-shard results per policy, with amounts converted from micro-units."""
+    merged = []
+    for i, policy in enumerate(policies):
+        results = [shard[i] for shard in shards]
+        counts = {
+            field: {
+                alert_type: sum(r[field][alert_type] for r in results)
+                for alert_type in results[0][field]
+            } if results else {}
+            for field in ("alerts", "false_positives", "unresolved")
+        }
+        pauses = sorted((p for r in results for p in r["pauses"]), key=itemgetter("paused_at"))
+        merged.append({
+            "policy": policy.model_dump(),
+            **counts,
+            "pauses": [
+                {
+                    "user_address": p["user_address"],
+                    "paused_at": p["paused_at"],
+                    "blocked_spend": from_micros(p["blocked_spend_micros"])
+                }
+                for p in pauses
+            ],
+            "blocked_spend": from_micros(sum(r["blocked_spend_micros"] for r in results))
+        })
+    return merged
+
+
+async def run_backtest(
+    policies: Sequence[BacktestPolicy],
+    days: int = 30,
+    user_address: Optional[str] = None,
+    incident_ratio: float = 2.0
+) -> List[Dict[str, Any]]:
+    """Backtest one user (on its shard) or every user on the local shards, merged per policy."""
+    from .sharding import get_shard_router
+
+    router = get_shard_router()
+    now = datetime.utcnow()
+    if user_address is not None:
+        async with router.shard_for(user_address).session_maker() as db:
+            shards = [await backtest(db, policies, days, user_address, incident_ratio, now)]
+    else:
+        async def run(db: AsyncSession, shard) -> List[Dict[str, Any]]:
+            return await backtest(db, policies, days, None, incident_ratio, now)
+
+        shards = await router.fan_out(run)
+    return merge_results(policies, shards)
@@ -0,0 +1,313 @@
+"""
+Budget ledger for pre-payment admission decisions.
+
+Each shard keeps, per user, the budget config fields that matter for
+admission and the user's budget rules. Entries are loaded from the database
+on first use (or after BUDGET_CACHE_TTL_SECONDS). Month-to-date spend and
+rule spend live in the shared store (see shared_state): they are seeded from
+the database by the first worker that needs them, then incremented by the
+write paths. Config and rule changes bump a per-user epoch in the store, and
+the other workers reload their entry when they see it change. An admission
+check on a warm entry is one store read (a dict lookup with the in-process
+store) and a comparison, so the backend can call it before serving every
+paid request. Spend, limits and costs are integer micro-units (see money.py);
+decisions report them as amounts.
+"""
+
+import time
+from datetime import datetime
+from typing import Dict, Any, List, Optional, Sequence, Tuple
+
+from sqlalchemy import select, func, and_
+from sqlalchemy.ext.asyncio import async_sessionmaker
+
+from .database import BudgetConfig, ApiUsage
+from .money import from_micros
+from .budget_rules import RuleCounter, load_rule_counters
+from .config import settings
+from .sharding import get_shard_router
+from .shared_state import SharedStore, get_shared_store, state_key
+from . import metrics
+
+# Month-to-date spend counters expire after a month plus margin
+SPEND_TTL_SECONDS = 40 * 86400
+
+# (user_address, cost_micros, provider, api_id)
+SpendEvent = Tuple[str, int, Optional[str], Optional[str]]
+
+
+def month_start(now: Optional[datetime] = None) -> datetime:
+    """Start of the current (UTC) month."""
+    now = now or datetime.utcnow()
+    return now.replace(day=1, hour=0, minute=0, second=0, microsecond=0)
+
+
+def spend_key(user_address: str, month: datetime) -> str:
+    return state_key("spend_micros", user_address, month.strftime("%Y-%m"))
+
+
+def epoch_key(user_address: str) -> str:
+    return state_key("budget_epoch", user_address)
+
+
+class LedgerEntry:
+    """Cached budget state for one user (amounts in micro-units)."""
+
+    __slots__ = (
+        "has_config", "limit_micros", "pause_threshold", "is_active", "month", "spend", "rules", "epoch",
+        "loaded_at"
+    )
+
+    def __init__(
+        self,
+        has_config: bool,
+        limit_micros: int,
+        pause_threshold: float,
+        is_active: bool,
+        month: datetime,
+        spend: int,
+        rules: List[RuleCounter],
+        epoch: float = 0.0
+    ):
+        self.has_config = has_config
+        self.limit_micros = limit_micros
+        self.pause_threshold = pause_threshold
+        self.is_active = is_active
+        self.month = month
+        self.spend = spend  # Mirror of the shared spend counter
+        self.rules = rules
+        self.epoch = epoch
+        self.loaded_at = time.monotonic()
+
+    @property
+    def pause_at(self) -> int:
+        """Spend at which the user is paused."""
+        return round(self.limit_micros * self.pause_threshold)
+
+
+class BudgetLedger:
+    """
+    Per-shard admission cache: budget config and month-to-date spend per user.
+
+    Decisions match `is_paused` in BudgetGuardianService.get_budget_status, but
+    also deny a call whose cost would take the user past the pause threshold
+    or past the limit of any budget rule matching the call.
+    """
+
+    def __init__(
+        self,
+        session_maker: async_sessionmaker,
+        ttl_seconds: Optional[float] = None,
+        store: Optional[SharedStore] = None
+    ):
+        self.session_maker = session_maker
+        self.ttl_seconds = settings.BUDGET_CACHE_TTL_SECONDS if ttl_seconds is None else ttl_seconds
+        self.store = store or get_shared_store()
+        self._entries: Dict[str, LedgerEntry] = {}
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    async def _load(self, user_address: str) -> LedgerEntry:
+        """Load a user's config and rules, seeding shared counters no worker has yet."""
+        start = month_start()
+        config_stmt = select(
+            BudgetConfig.monthly_limit_micros,
+            BudgetConfig.pause_threshold,
+            BudgetConfig.is_active
+        ).where(BudgetConfig.user_address == user_address)
+        spend_stmt = select(func.sum(ApiUsage.cost_micros)).where(
+            and_(
+                ApiUsage.user_address == user_address,
+                ApiUsage.timestamp >= start
+            )
+        )
+
+        async with self.session_maker() as session:
+            config = (await session.execute(config_stmt)).one_or_none()
+            spend = (await session.execute(spend_stmt)).scalar() or 0
+            rules = await load_rule_counters(session, user_address)
+
+        if config is None:
+            entry = LedgerEntry(False, 0, 1.0, False, start, spend, rules)
+        else:
+            entry = LedgerEntry(
+                True, config.monthly_limit_micros, config.pause_threshold, config.is_active, start, spend, rules
+            )
+
+        await self.store.set(spend_key(user_address, start), spend, SPEND_TTL_SECONDS, nx=True)
+        for rule in rules:
+            await self.store.set(rule.key(), rule.spent, rule.ttl, nx=True)
+        await self._refresh(user_address, entry, check_epoch=False)
+        self._entries[user_address] = entry
+        return entry
+
+    async def _refresh(self, user_address: str, entry: LedgerEntry, check_epoch: bool = True) -> bool:
+        """
+        Read the entry's shared counters and epoch in one round trip.
+
+        Returns:
+            False if `check_epoch` is set and the epoch changed (the entry is
+            stale and must be reloaded)
+        """
+        keys = [spend_key(user_address, entry.month), epoch_key(user_address)]
+        keys.extend(rule.key() for rule in entry.rules)
+        values = await self.store.mget(keys)
+        epoch = float(values[1] or 0)
+        if check_epoch and epoch != entry.epoch:
+            return False
+        entry.epoch = epoch
+        entry.spend = int(values[0] or 0)
+        for rule, value in zip(entry.rules, values[2:]):
+            rule.update(int(value or 0))
+        return True
+
+    async def get(self, user_address: str) -> LedgerEntry:
+        """Cached entry for a user, loading it on a miss, expiry or month rollover."""
+        entry = self._entries.get(user_address)
+        if (
+            entry is not None
+            and time.monotonic() - entry.loaded_at < self.ttl_seconds
+            and entry.month == month_start()
+        ):
+            metrics.cache_hit("budget_ledger")
+            return entry
+        metrics.cache_miss("budget_ledger")
+        return await self._load(user_address)
+
+    async def get_current(self, user_address: str) -> LedgerEntry:
+        """Entry for a user with spend read from the shared store (reloaded if stale)."""
+        entry = await self.get(user_address)
+        if not await self._refresh(user_address, entry):
+            entry = await self._load(user_address)  # Config or rules changed in another worker
+        return entry
+
+    @metrics.timed("budget_admit")
+    async def admit(
+        self,
+        user_address: str,
+        cost_micros: int = 0,
+        provider: Optional[str] = None,
+        api_id: Optional[str] = None
+    ) -> Dict[str, Any]:
+        """
+        Decide whether a call costing `cost_micros` may be served for a user.
+
+        Args:
+            user_address: User whose budget is charged
+            cost_micros: Cost of the call about to be served, in micro-units
+            provider: Provider of the call (for provider rules)
+            api_id: API of the call (for API rules)
+
+        Returns:
+            Decision dict: allowed, reason, rule_id, current_spend, monthly_limit, remaining_budget
+        """
+        entry = await self.get_current(user_address)
+        allowed, reason, rule_id = True, "ok", None
+        if entry.has_config and entry.is_active and entry.spend >= entry.pause_at:
+            allowed, reason = False, "paused"
+        elif entry.has_config and entry.is_active and entry.spend + cost_micros > entry.pause_at:
+            allowed, reason = False, "would_exceed"
+        else:
+            for rule in entry.rules:
+                if rule.matches(provider, api_id) and rule.would_exceed(cost_micros):
+                    allowed, reason, rule_id = False, "rule_exceeded", rule.rule_id
+                    break
+            else:
+                if not entry.has_config:
+                    reason = "no_budget"
+        return {
+            "user_address": user_address,
+            "allowed": allowed,
+            "reason": reason,
+            "rule_id": rule_id,
+            "cost": from_micros(cost_micros),
+            "current_spend": from_micros(entry.spend),
+            "monthly_limit": from_micros(entry.limit_micros),
+            "remaining_budget": from_micros(max(0, entry.pause_at - entry.spend)) if entry.has_config else None
+        }
+
+    async def record_spend(
+        self,
+        user_address: str,
+        cost_micros: int,
+        provider: Optional[str] = None,
+        api_id: Optional[str] = None
+    ) -> List[RuleCounter]:
+        """
+        Add recorded usage to a user's shared counters (no-op if the user is not cached).
+
+        Returns:
+            Rules whose limit this usage crossed
+        """
+        return (await self.record_spend_many([(user_address, cost_micros, provider, api_id)]))[0][1]
+
+    async def record_spend_many(self, events: Sequence[SpendEvent]) -> List[Tuple[int, List[RuleCounter]]]:
+        """
+        Add recorded usage events to the shared counters in one round trip.
+
+        Each increment is atomic, so exactly one worker sees a given limit
+        being crossed. A counter that had disappeared from the store (e.g. a
+        restarted Redis) is dropped along with the local entry, and is
+        re-seeded from the database on next use.
+
+        Returns:
+            Per event: month-to-date spend (micro-units) after it, and the rules it took over their limit
+        """
+        increments = []
+        plan = []
+        for user_address, cost, provider, api_id in events:
+            entry = self._entries.get(user_address)
+            if entry is None:
+                plan.append(None)
+                continue
+            rules = [rule for rule in entry.rules if rule.matches(provider, api_id)]
+            plan.append((entry, rules, len(increments)))
+            increments.append((spend_key(user_address, entry.month), cost, SPEND_TTL_SECONDS))
+            increments.extend((rule.key(), cost, rule.ttl) for rule in rules)
+        values = await self.store.incr_many(increments)
+
+        results = []
+        lost = set()
+        for (user_address, cost, _, _), planned in zip(events, plan):
+            if planned is None:
+                results.append((0, []))
+                continue
+            entry, rules, offset = planned
+            spend = values[offset]
+            if entry.spend > 0 and spend <= cost:
+                lost.add(user_address)
+            entry.spend = spend
+            crossed = [rule for i, rule in enumerate(rules, offset + 1) if rule.update(values[i], cost)]
+            results.append((spend, crossed))
+
+        for user_address in lost:
+            entry = self._entries.pop(user_address)
+            await self.store.delete(spend_key(user_address, entry.month), *(rule.key() for rule in entry.rules))
+        return results
+
+    async def update_config(self, config: BudgetConfig):
+        """Apply a created/updated/paused budget config to the cached entry and tell other workers."""
+        epoch = await self.store.incr(epoch_key(config.user_address))
+        entry = self._entries.get(config.user_address)
+        if entry is None:
+            return
+        entry.has_config = True
+        entry.limit_micros = config.monthly_limit_micros
+        entry.pause_threshold = config.pause_threshold
+        entry.is_active = config.is_active
+        entry.epoch = epoch
+
+    async def invalidate(self, user_address: Optional[str] = None):
+        """Drop one user's entry in every worker, or all of this worker's entries."""
+        if user_address is None:
+            self._entries.clear()
+            return
+        self._entries.pop(user_address, None)
+        await self.store.incr(epoch_key(user_address))
+
+
+def get_budget_ledger(user_address: str) -> BudgetLedger:
+    """Budget ledger of the local shard holding a user's data."""
+    shard = get_shard_router().shard_for(user_address)
+    return shard.cache("budget_ledger", lambda: BudgetLedger(shard.session_maker))
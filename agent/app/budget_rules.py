@@ -0,0 +1,141 @@
+"""
+Hierarchical budget rules (per user, provider or API; hourly, daily or monthly).
+
+Each rule has a counter of spend in its current calendar window, kept in
+the shared store (one key per rule and window, expiring after the window).
+Counters are seeded from the database once (one SUM per rule) and then
+incremented at ingest. Limits and spend are integer micro-units (see
+money.py). Evaluating the rules for a usage event costs O(rules) with no
+SQL.
+"""
+
+from datetime import datetime
+from typing import List, Optional
+
+from sqlalchemy import select, func, and_
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from .database import BudgetRule, ApiUsage, ApiDimension
+from .shared_state import state_key
+
+SCOPES = ("user", "provider", "api")
+WINDOWS = ("hour", "day", "month")
+
+# Shared counter expiry per window (window length plus margin)
+WINDOW_TTL_SECONDS = {"hour": 2 * 3600, "day": 2 * 86400, "month": 40 * 86400}
+
+
+def window_start(window: str, now: Optional[datetime] = None) -> datetime:
+    """Start of the calendar window (UTC) containing `now`."""
+    now = now or datetime.utcnow()
+    if window == "hour":
+        return now.replace(minute=0, second=0, microsecond=0)
+    if window == "day":
+        return now.replace(hour=0, minute=0, second=0, microsecond=0)
+    if window == "month":
+        return now.replace(day=1, hour=0, minute=0, second=0, microsecond=0)
+    raise ValueError(f"Unknown budget window: {window}")
+
+
+class RuleCounter:
+    """
+    Spend counter for one budget rule, reset at each window boundary.
+
+    `spent` mirrors the rule's shared counter as of the last read or increment.
+    Both `limit_micros` and `spent` are in micro-units.
+    """
+
+    __slots__ = ("user_address", "rule_id", "scope", "scope_value", "window", "limit_micros", "window_start", "spent")
+
+    def __init__(
+        self,
+        user_address: str,
+        rule_id: int,
+        scope: str,
+        scope_value: Optional[str],
+        window: str,
+        limit_micros: int,
+        start: datetime,
+        spent: int = 0
+    ):
+        self.user_address = user_address
+        self.rule_id = rule_id
+        self.scope = scope
+        self.scope_value = scope_value
+        self.window = window
+        self.limit_micros = limit_micros
+        self.window_start = start
+        self.spent = spent
+
+    def matches(self, provider: Optional[str], api_id: Optional[str]) -> bool:
+        """Whether a usage event for this provider/API counts against the rule."""
+        if self.scope == "user":
+            return True
+        if self.scope == "provider":
+            return provider == self.scope_value
+        return api_id == self.scope_value
+
+    def current(self, now: Optional[datetime] = None) -> int:
+        """Spend in the current window (rolls the window over if it has ended)."""
+        start = window_start(self.window, now)
+        if start != self.window_start:
+            self.window_start = start
+            self.spent = 0
+        return self.spent
+
+    def key(self, now: Optional[datetime] = None) -> str:
+        """Shared store key of the counter for the current window (rule ids are only unique per shard)."""
+        self.current(now)
+        return state_key("rule_micros", self.user_address, self.rule_id, self.window_start.strftime("%Y%m%d%H"))
+
+    @property
+    def ttl(self) -> float:
+        return WINDOW_TTL_SECONDS[self.window]
+
+    def would_exceed(self, cost_micros: int, now: Optional[datetime] = None) -> bool:
+        return self.current(now) + cost_micros > self.limit_micros
+
+    def update(self, spent: int, cost_micros: int = 0) -> bool:
+        """
+        Set the counter from its shared value after adding `cost_micros`.
+
+        Returns:
+            True if this spend took the counter over its limit
+        """
+        self.spent = spent
+        return spent - cost_micros <= self.limit_micros < spent
+
+    def describe(self) -> str:
+        """Short label, e.g. "daily openai" or "hourly api-7"."""
+        period = {"hour": "hourly", "day": "daily", "month": "monthly"}[self.window]
+        return f"{period} {self.scope_value or 'total'}"
+
+
+async def load_rule_counters(db: AsyncSession, user_address: str) -> List[RuleCounter]:
+    """Load a user's active rules with spend so far in each rule's window."""
+    stmt = select(BudgetRule).where(
+        and_(
+            BudgetRule.user_address == user_address,
+            BudgetRule.is_active == True
+        )
+    ).order_by(BudgetRule.id)
+    rules = (await db.execute(stmt)).scalars().all()
+
+    now = datetime.utcnow()
+    counters = []
+    for rule in rules:
+        start = window_start(rule.window, now)
+        conditions = [ApiUsage.user_address == user_address, ApiUsage.timestamp >= start]
+        if rule.scope == "provider":
+            conditions.append(ApiUsage.api_dim_id.in_(
+                select(ApiDimension.id).where(ApiDimension.provider == rule.scope_value)
+            ))
+        elif rule.scope == "api":
+            conditions.append(ApiUsage.api_dim_id.in_(
+                select(ApiDimension.id).where(ApiDimension.api_id == rule.scope_value)
+            ))
+        spent = (await db.execute(select(func.sum(ApiUsage.cost_micros)).where(and_(*conditions)))).scalar() or 0
+        counters.append(RuleCounter(
+            user_address, rule.id, rule.scope, rule.scope_value, rule.window, rule.limit_micros, start, spent
+        ))
+    return counters
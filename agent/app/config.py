@@ -18,6 +18,26 @@ class Settings(BaseSettings):
     
     # Database
     DATABASE_URL: str = "sqlite+aiosqlite:///./guardian.db"
+    AUTO_MIGRATE: bool = False  # Create tables at startup instead of via `python main.py migrate`
+    DATABASE_ECHO: bool = False  # Log every SQL statement (SQLAlchemy echo, debugging only)
+    
+    # Usage ingest (events are buffered and committed in groups)
+    USAGE_WRITER_FLUSH_MS: float = 5.0  # Longest an event waits for its group commit
+    USAGE_WRITER_MAX_BATCH: int = 500  # Rows per commit
+    USAGE_WRITER_LOG_DIR: str = ""  # Append-only ingest log directory, one locked log per writer process (empty = no log, events are acknowledged at commit)
+    USAGE_WRITER_LOG_MAX_BYTES: int = 16 * 1024 * 1024  # Truncate the log past this size once it is fully committed
+    USAGE_WRITER_MAX_RETRIES: int = 5  # Failed commits of a logged batch before it goes to the dead-letter file
+    IDEMPOTENCY_CACHE_SIZE: int = 100000  # Recent idempotency keys kept in memory, per shard
+    
+    # Retention (raw api_usage rows are rolled up daily, then archived)
+    USAGE_RETENTION_DAYS: int = 90
+    USAGE_RETENTION_INTERVAL_HOURS: float = 0  # Run retention in the app every N hours (0 = only via `python main.py retention`)
+    ARCHIVE_DIR: str = "./archive"
+    
+    # Sharding (users are split across SHARD_COUNT databases by address hash)
+    SHARD_COUNT: int = 1
+    SHARD_DATABASE_URL: str = "sqlite+aiosqlite:///./guardian-shard-{shard}.db"
+    SHARD_LOCAL: str = ""  # Comma-separated shard indices served by this node (empty = all)
     
     # OpenAI
     OPENAI_API_KEY: Optional[str] = None
@@ -28,8 +48,14 @@ class Settings(BaseSettings):
     DEEPSEEK_BASE_URL: str = "https://api.deepseek.com/v1"
     DEEPSEEK_MODEL: str = "deepseek-chat"
     
-    # AI Provider (openai or deepseek)
+    # AI Provider (openai, deepseek, or hedged: every provider with a key, see ai_analyzer.py)
     AI_PROVIDER: str = "openai"
+    AI_HEDGE_PERCENTILE: float = 95  # Send the request to the next provider once the first is slower than this latency percentile
+    AI_HEDGE_MIN_DELAY_SECONDS: float = 0.25  # Least wait before hedging
+    AI_HEDGE_DEFAULT_DELAY_SECONDS: float = 2.0  # Wait before hedging until a provider has AI_HEDGE_MIN_SAMPLES latencies
+    AI_HEDGE_MIN_SAMPLES: int = 20
+    AI_LATENCY_SAMPLES: int = 200  # Recent latencies kept per provider
+    AI_MAX_ERROR_RATE: float = 0.2  # Providers failing more often than this (moving average) are tried last
     
     # Cronos/Web3
     CRONOS_RPC_URL: str = "https://evm-t3.cronos.org"
@@ -59,6 +85,41 @@ class Settings(BaseSettings):
     # Analysis Settings
     UNUSUAL_PATTERN_MULTIPLIER: float = 3.0  # 3x normal rate
     ANALYSIS_WINDOW_MINUTES: int = 5
+    USAGE_WINDOW_MAX_USERS: int = 10000  # Users with an in-memory sliding window, per shard
+    WINDOW_BUCKET_SECONDS: int = 10  # Bucket length of the per-user call and cost counts in the shared store
+    RECENT_RATE_SECONDS: int = 60  # Span of the shared recent call rate compared with the baseline
+    BASELINE_REFRESH_MINUTES: int = 60  # Age at which a cached window's 7-day baseline is re-read
+    FORECAST_ALPHA: float = 0.3  # Weight of each closed hour in the forecast spend level
+    FORECAST_BETA: float = 0.1  # Weight of each closed hour in the forecast spend trend
+    FORECAST_DAMPING: float = 0.98  # Trend damping per hour ahead (1 = linear extrapolation)
+    FORECAST_ALERT_COOLDOWN_HOURS: float = 6.0  # Least time between two exhaustion forecast alerts for a user
+    
+    # Optimization recommender (computed from usage rollups)
+    RECOMMENDER_LOOKBACK_DAYS: int = 30
+    RECOMMENDER_MIN_SAVINGS: float = 1.0  # Smallest estimated monthly saving worth suggesting
+    RECOMMENDER_MIN_REPEAT_RATIO: float = 0.1  # Share of repeated identical calls that suggests caching
+    RECOMMENDER_BATCH_MIN_CALLS_PER_DAY: float = 100  # Call rate that suggests batching
+    PRICE_CATALOG_PATH: str = ""  # JSON price entries added to / replacing the built-in catalog
+    OPTIMIZATION_TTL_DAYS: int = 30  # Pending suggestions not suggested again for this long are deleted
+    
+    # Monthly reports (batch job: `python main.py reports`)
+    REPORT_WORKERS: int = 4  # Chunks of users processed concurrently
+    REPORT_CHUNK_USERS: int = 500  # Users per chunk (one set of grouped queries and one insert)
+    
+    # Admission cache (pre-payment budget checks)
+    BUDGET_CACHE_TTL_SECONDS: float = 30.0  # Reload cached config and rules from the database after this
+    
+    # Shared state for multiple workers ("" = in-process, "redis://host:6379/0", "fakeredis://")
+    SHARED_STATE_URL: str = ""
+    
+    # Metrics
+    METRICS_ENABLED: bool = True
+    
+    # Logging (structured events, written by a background thread)
+    LOG_LEVEL: str = "INFO"
+    LOG_FORMAT: str = "json"  # "json" (one object per line) or "text"
+    LOG_SAMPLE_RATES: str = "usage_recorded=0.01"  # Comma-separated event=rate; unlisted events are all kept
+    LOG_QUEUE_SIZE: int = 10000  # Records waiting for the writer thread; more are dropped, not waited on
     
     # Notification Settings
     ENABLE_EMAIL_NOTIFICATIONS: bool = False
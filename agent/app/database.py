@@ -1,31 +1,83 @@
 """
 Database models for AI Budget Guardian.
+
+Amounts are stored as integer micro-units (see money.py). The float amount
+columns (`cost`, `monthly_limit`, `limit_amount`) predate them and are kept
+for older readers, but nothing writes them: each is derived from its
+micro-unit column, by a column default for rows inserted with Core and by a
+validator for ORM objects.
 """
 
 from datetime import datetime
 from typing import Optional
-from sqlalchemy import Column, Integer, Float, String, DateTime, Boolean, Text, JSON
+from sqlalchemy import Column, Integer, BigInteger, Float, String, DateTime, Boolean, Text, JSON, UniqueConstraint, Index
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.ext.asyncio import create_async_engine, AsyncSession, async_sessionmaker
+from sqlalchemy.orm import validates
 
 from .config import settings
+from .money import from_micros
 
 Base = declarative_base()
 
 
+def _from_micros_column(micros_column: str):
+    """Insert default of a float amount column: the row's micro-unit amount as a float."""
+    def default(context):
+        return from_micros(context.get_current_parameters()[micros_column])
+    return default
+
+
 class BudgetConfig(Base):
     """User budget configuration."""
     __tablename__ = "budget_configs"
     
     id = Column(Integer, primary_key=True, index=True)
     user_address = Column(String, unique=True, index=True, nullable=False)
-    monthly_limit = Column(Float, nullable=False)
+    monthly_limit = Column(Float, nullable=False)  # Derived from monthly_limit_micros
+    monthly_limit_micros = Column(BigInteger, nullable=False)  # Authoritative limit (see money.py)
     warning_threshold = Column(Float, default=0.8)
     pause_threshold = Column(Float, default=1.0)
     guardian_wallet = Column(String, nullable=True)
     is_active = Column(Boolean, default=True)
     created_at = Column(DateTime, default=datetime.utcnow)
     updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+    
+    @validates("monthly_limit_micros")
+    def _derive_monthly_limit(self, key, value):
+        self.monthly_limit = from_micros(value)
+        return value
+
+
+class BudgetRule(Base):
+    """Sub-limit on a user's spend: per user, provider or API, per hour, day or month."""
+    __tablename__ = "budget_rules"
+    
+    id = Column(Integer, primary_key=True, index=True)
+    user_address = Column(String, index=True, nullable=False)
+    scope = Column(String, nullable=False)  # user, provider, api
+    scope_value = Column(String, nullable=True)  # provider name or api_id (None for user scope)
+    window = Column(String, nullable=False)  # hour, day, month
+    limit_amount = Column(Float, nullable=False)  # Derived from limit_micros
+    limit_micros = Column(BigInteger, nullable=False)
+    is_active = Column(Boolean, default=True)
+    created_at = Column(DateTime, default=datetime.utcnow)
+    
+    @validates("limit_micros")
+    def _derive_limit_amount(self, key, value):
+        self.limit_amount = from_micros(value)
+        return value
+
+
+class ApiDimension(Base):
+    """Dictionary of APIs seen in usage: an integer key per (provider, api_id)."""
+    __tablename__ = "api_dimensions"
+    __table_args__ = (UniqueConstraint("provider", "api_id"),)
+    
+    id = Column(Integer, primary_key=True)
+    provider = Column(String, nullable=False)
+    api_id = Column(String, nullable=False)
+    api_name = Column(String, nullable=False)  # Name the API was last recorded with
 
 
 class ApiUsage(Base):
@@ -34,25 +86,64 @@ class ApiUsage(Base):
     
     id = Column(Integer, primary_key=True, index=True)
     user_address = Column(String, index=True, nullable=False)
-    api_id = Column(String, index=True, nullable=False)
-    api_name = Column(String, nullable=False)
-    provider = Column(String, nullable=False)  # openai, deepseek, sendgrid, etc.
-    cost = Column(Float, nullable=False)
+    api_dim_id = Column(Integer, index=True, nullable=False)  # api_dimensions.id (provider, api_id and name)
+    cost = Column(Float, nullable=False, default=_from_micros_column("cost_micros"))  # Derived from cost_micros
+    cost_micros = Column(BigInteger, nullable=False)  # Authoritative cost, summed instead of `cost`
     request_count = Column(Integer, default=1)
     tokens_used = Column(Integer, nullable=True)
     endpoint = Column(String, nullable=True)
     status = Column(String, default="success")  # success, failed, blocked
     extra_data = Column(JSON, nullable=True)
+    idempotency_key = Column(String, unique=True, index=True, nullable=True)  # Transaction hash or x402 payment ID
     timestamp = Column(DateTime, default=datetime.utcnow, index=True)
 
 
+class UsageRollup(Base):
+    """Daily API usage aggregates per user and API (kept after raw rows are archived)."""
+    __tablename__ = "usage_rollups"
+    __table_args__ = (Index("uq_usage_rollups_user_day_api", "user_address", "day", "api_dim_id", unique=True),)
+    
+    id = Column(Integer, primary_key=True, index=True)
+    user_address = Column(String, index=True, nullable=False)
+    day = Column(DateTime, index=True, nullable=False)  # UTC midnight
+    api_dim_id = Column(Integer, nullable=False)  # api_dimensions.id
+    calls = Column(Integer, nullable=False)
+    request_count = Column(Integer, nullable=False)
+    tokens_used = Column(Integer, nullable=False)
+    cost = Column(Float, nullable=False, default=_from_micros_column("cost_micros"))  # Derived from cost_micros
+    cost_micros = Column(BigInteger, nullable=False)
+    repeat_calls = Column(Integer, nullable=True, default=0)  # Calls repeating an identical request earlier that day
+
+
+class UsageArchive(Base):
+    """Compressed NDJSON archive of raw api_usage rows moved out of the hot table."""
+    __tablename__ = "usage_archives"
+    
+    id = Column(Integer, primary_key=True, index=True)
+    month = Column(String, index=True, nullable=False)  # YYYY-MM
+    path = Column(String, nullable=False)
+    rows = Column(Integer, nullable=False)
+    min_timestamp = Column(DateTime, nullable=False)
+    max_timestamp = Column(DateTime, nullable=False)
+    created_at = Column(DateTime, default=datetime.utcnow)
+
+
+class IngestCheckpoint(Base):
+    """Last ingest log sequence number committed to api_usage (one row per log)."""
+    __tablename__ = "ingest_checkpoints"
+    
+    name = Column(String, primary_key=True)  # Log file name
+    last_seq = Column(Integer, nullable=False)
+    updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+
+
 class BudgetAlert(Base):
     """Budget alerts and notifications."""
     __tablename__ = "budget_alerts"
     
     id = Column(Integer, primary_key=True, index=True)
     user_address = Column(String, index=True, nullable=False)
-    alert_type = Column(String, nullable=False)  # warning, critical, pause, unusual_pattern
+    alert_type = Column(String, nullable=False)  # warning, critical, pause, unusual_pattern, rule_<id>
     severity = Column(String, default="info")  # info, warning, critical
     message = Column(Text, nullable=False)
     current_spend = Column(Float, nullable=False)
@@ -72,12 +163,25 @@ class Optimization(Base):
     optimization_type = Column(String, nullable=False)  # model_switch, rate_limit, consolidate
     current_api = Column(String, nullable=False)
     suggested_api = Column(String, nullable=True)
+    fingerprint = Column(String, nullable=True)  # type|current_api|suggested_api (see optimizations.py)
     estimated_savings = Column(Float, nullable=False)
     description = Column(Text, nullable=False)
     is_applied = Column(Boolean, default=False)
     applied_at = Column(DateTime, nullable=True)
     extra_data = Column(JSON, nullable=True)
     created_at = Column(DateTime, default=datetime.utcnow)
+    updated_at = Column(DateTime, default=datetime.utcnow, index=True)  # Last suggested (pending ones expire)
+
+
+# One pending suggestion per user and fingerprint (applied ones are not indexed)
+Index(
+    "uq_optimizations_pending_fingerprint",
+    Optimization.user_address,
+    Optimization.fingerprint,
+    unique=True,
+    sqlite_where=Optimization.is_applied == False,
+    postgresql_where=Optimization.is_applied == False
+)
 
 
 class MonthlyReport(Base):
@@ -97,18 +201,49 @@ class MonthlyReport(Base):
     created_at = Column(DateTime, default=datetime.utcnow)
 
 
-# Database engine and session
-engine = create_async_engine(settings.DATABASE_URL, echo=True)
-async_session_maker = async_sessionmaker(engine, class_=AsyncSession, expire_on_commit=False)
+# Database engine and session (created on first use to keep imports cheap)
+_engine = None
+_async_session_maker = None
+
+
+def get_engine():
+    """Get or create the database engine."""
+    global _engine
+    if _engine is None:
+        _engine = create_async_engine(settings.DATABASE_URL, echo=settings.DATABASE_ECHO)
+    return _engine
+
+
+def get_session_maker():
+    """Get or create the session factory."""
+    global _async_session_maker
+    if _async_session_maker is None:
+        _async_session_maker = async_sessionmaker(get_engine(), class_=AsyncSession, expire_on_commit=False)
+    return _async_session_maker
+
+
+def conflict_insert(dialect):
+    """INSERT construct with ON CONFLICT clauses for a dialect (PostgreSQL, otherwise SQLite)."""
+    from sqlalchemy.dialects import postgresql, sqlite
+    return postgresql.insert if dialect.name == "postgresql" else sqlite.insert
+
+
+def __getattr__(name):
+    """Lazy `engine` and `async_session_maker` module attributes."""
+    if name == "engine":
+        return get_engine()
+    if name == "async_session_maker":
+        return get_session_maker()
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
 
 
 async def init_db():
     """Initialize database tables."""
-    async with engine.begin() as conn:
+    async with get_engine().begin() as conn:
         await conn.run_sync(Base.metadata.create_all)
 
 
 async def get_db() -> AsyncSession:
     """Get database session."""
-    async with async_session_maker() as session:
+    async with get_session_maker()() as session:
         yield session
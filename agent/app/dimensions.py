@@ -0,0 +1,139 @@
+"""
+Dictionary encoding of the API a usage row belongs to.
+
+Usage events name their API with free-text provider, api_id and api_name
+strings. Each distinct (provider, api_id) gets an integer key in
+`api_dimensions`. api_usage and usage_rollups rows store only that key, in
+`api_dim_id`. Grouped queries (rollups,
+recommendations, analytics) group by that integer and look the names up once
+per group instead of per row; other readers join api_dimensions or use the
+cache below.
+
+Keys are interned at ingest by a per-shard cache: the usage writer resolves
+a batch's APIs from memory, and only APIs it has not seen yet cost a query
+(plus one INSERT ... ON CONFLICT DO NOTHING for the new APIs, committed
+before the batch so the cache never holds a key that was rolled back, and
+safe against another worker adding the same API). The same cache maps keys
+back to names for readers. An API's name is the one it was last recorded
+with: when an event names a known API differently, the dimension row is
+updated (in the same transaction as any new APIs) and so is the cache. Other
+workers pick the new name up when they see it in an event, or on restart.
+The number of distinct APIs is small, so the cache is not bounded.
+"""
+
+from typing import Any, Dict, Iterable, List, Sequence, Tuple
+
+from sqlalchemy import bindparam, select, tuple_, update
+from sqlalchemy.ext.asyncio import AsyncEngine
+
+from .database import ApiDimension, conflict_insert
+from .sharding import Shard, get_shard_router
+from .usage_event import UsageEvent
+from . import metrics
+
+Key = Tuple[str, str]  # (provider, api_id)
+Label = Tuple[str, str, str]  # (provider, api_id, api_name)
+
+
+class ApiDimensions:
+    """Intern cache of one shard's api_dimensions table."""
+
+    def __init__(self):
+        self._ids: Dict[Key, int] = {}
+        self._labels: Dict[int, Label] = {}
+
+    def __len__(self) -> int:
+        return len(self._ids)
+
+    async def _load(self, conn, condition):
+        stmt = select(ApiDimension.id, ApiDimension.provider, ApiDimension.api_id, ApiDimension.api_name).where(
+            condition
+        )
+        for dim_id, provider, api_id, api_name in (await conn.execute(stmt)).all():
+            self._ids[(provider, api_id)] = dim_id
+            self._labels[dim_id] = (provider, api_id, api_name)
+
+    async def _load_keys(self, conn, keys: Sequence[Key]):
+        for i in range(0, len(keys), 500):
+            await self._load(conn, tuple_(ApiDimension.provider, ApiDimension.api_id).in_(keys[i:i + 500]))
+
+    def _renamed(self, names: Dict[Key, str]) -> List[Key]:
+        """Known APIs whose cached name differs from `names`."""
+        return [key for key, name in names.items() if key in self._ids and self._labels[self._ids[key]][2] != name]
+
+    async def _intern(self, engine: AsyncEngine, labels: Iterable[Label]):
+        """
+        Make sure every (provider, api_id) has a key, adding dimension rows
+        for new APIs and renaming known ones recorded with a new name.
+        """
+        names: Dict[Key, str] = {}
+        for provider, api_id, api_name in labels:
+            names[(provider, api_id)] = api_name  # The batch's last name wins
+        missing = [key for key in names if key not in self._ids]
+        if not missing and not self._renamed(names):
+            metrics.cache_hit("api_dimensions")
+            return
+        if missing:
+            metrics.cache_miss("api_dimensions")
+        async with engine.begin() as conn:
+            if missing:
+                await self._load_keys(conn, missing)
+                new = [key for key in missing if key not in self._ids]
+                if new:
+                    # DO NOTHING for APIs added concurrently by another worker
+                    await conn.execute(conflict_insert(conn.dialect)(ApiDimension).on_conflict_do_nothing(
+                        index_elements=[ApiDimension.provider, ApiDimension.api_id]
+                    ), [
+                        {"provider": provider, "api_id": api_id, "api_name": names[(provider, api_id)]}
+                        for provider, api_id in new
+                    ])
+                    await self._load_keys(conn, new)
+            renamed = self._renamed(names)
+            if renamed:
+                await conn.execute(
+                    update(ApiDimension).where(ApiDimension.id == bindparam("dim_id")).values(
+                        api_name=bindparam("new_name")
+                    ),
+                    [{"dim_id": self._ids[key], "new_name": names[key]} for key in renamed]
+                )
+        for key in renamed:
+            self._labels[self._ids[key]] = (*key, names[key])
+
+    async def intern_events(self, engine: AsyncEngine, events: Sequence[UsageEvent]):
+        """
+        Set `api_dim_id` on usage events, adding dimension rows for new APIs.
+
+        Call before opening the transaction that inserts the events.
+
+        Args:
+            engine: Shard database engine
+            events: Usage events
+        """
+        await self._intern(engine, ((e.provider, e.api_id, e.api_name) for e in events))
+        for event in events:
+            event.api_dim_id = self._ids[(event.provider, event.api_id)]
+
+    async def intern_rows(self, engine: AsyncEngine, rows: Sequence[Dict[str, Any]]):
+        """Replace the API names of api_usage row dicts with their `api_dim_id` (as `intern_events`)."""
+        await self._intern(engine, ((r["provider"], r["api_id"], r["api_name"]) for r in rows))
+        for row in rows:
+            row["api_dim_id"] = self._ids[(row.pop("provider"), row.pop("api_id"))]
+            del row["api_name"]
+
+    async def labels(self, conn, dim_ids: Iterable[int]) -> Dict[int, Label]:
+        """(provider, api_id, api_name) per key, reading keys not cached yet."""
+        dim_ids = list(dim_ids)
+        unknown = [dim_id for dim_id in dim_ids if dim_id not in self._labels]
+        for i in range(0, len(unknown), 500):
+            await self._load(conn, ApiDimension.id.in_(unknown[i:i + 500]))
+        return {dim_id: self._labels[dim_id] for dim_id in dim_ids if dim_id in self._labels}
+
+
+def shard_dimensions(shard: Shard) -> ApiDimensions:
+    """Intern cache of a local shard."""
+    return shard.cache("api_dimensions", ApiDimensions)
+
+
+def get_api_dimensions(user_address: str) -> ApiDimensions:
+    """Intern cache of the local shard holding a user's data."""
+    return shard_dimensions(get_shard_router().shard_for(user_address))
@@ -0,0 +1,156 @@
+"""
+Budget exhaustion forecasting from hourly spend.
+
+A SpendForecast smooths a user's spend per hour with Holt's linear method
+(damped trend): a level (expected spend in the next hour) and a trend (how
+much that changes per hour), both updated once per closed hour. It is fed
+the same calls as the sliding window, so each call costs O(1) and nothing
+is read back from the database: the level starts from the 7-day baseline
+the window is seeded with, and hours without calls close as zero spend.
+
+Spend over the next `t` hours is the integral of the damped trend line,
+which has a closed form, so projected end-of-month spend is O(1) and the
+time the budget runs out is a short bisection. Projections stop at the end
+of the month, when the budget resets.
+"""
+
+import math
+from datetime import datetime, timedelta
+from typing import Dict, Optional, Tuple
+
+from .rate_estimator import epoch_seconds
+
+HOUR = 3600
+
+# Hours without calls that are smoothed one by one; after a longer gap the
+# forecast restarts from zero, which it has decayed to by then anyway.
+MAX_IDLE_HOURS = 24 * 7
+
+
+def next_month(now: datetime) -> datetime:
+    """Start of the month after `now` (when monthly budgets reset)."""
+    if now.month == 12:
+        return datetime(now.year + 1, 1, 1)
+    return datetime(now.year, now.month + 1, 1)
+
+
+class SpendForecast:
+    """
+    Damped-trend exponential smoothing of spend per hour (micro-units).
+
+    Args:
+        alpha: Weight of each closed hour in the level (0-1)
+        beta: Weight of each closed hour in the trend (0-1)
+        damping: Trend damping per hour ahead (0-1, 1 = undamped)
+        level: Initial spend per hour (e.g. the historical average)
+    """
+
+    __slots__ = ("alpha", "beta", "damping", "level", "trend", "hour", "bucket")
+
+    def __init__(self, alpha: float, beta: float, damping: float, level: float = 0.0):
+        self.alpha = alpha
+        self.beta = beta
+        self.damping = damping
+        self.level = level
+        self.trend = 0.0
+        self.hour: Optional[int] = None  # Epoch hour being accumulated
+        self.bucket = 0  # Spend in that hour so far
+
+    def _close(self, spend: float):
+        """Smooth one closed hour into level and trend."""
+        level = self.alpha * spend + (1 - self.alpha) * (self.level + self.damping * self.trend)
+        self.trend = self.beta * (level - self.level) + (1 - self.beta) * self.damping * self.trend
+        self.level = level
+
+    def advance(self, hour: int, closed: Optional[Dict[int, int]] = None):
+        """
+        Close every hour before epoch hour `hour`.
+
+        Args:
+            hour: Current epoch hour
+            closed: Spend per epoch hour counted elsewhere (e.g. by all
+                workers); an hour is closed with the larger of that and
+                the spend observed here
+        """
+        if self.hour is None:
+            self.hour = hour
+            return
+        if hour <= self.hour:
+            return
+        closed = closed or {}
+        idle = hour - self.hour - 1
+        self._close(max(self.bucket, closed.get(self.hour, 0)))
+        if idle > MAX_IDLE_HOURS:
+            self.level = self.trend = 0.0
+        else:
+            for idle_hour in range(self.hour + 1, hour):
+                self._close(closed.get(idle_hour, 0))
+        self.hour = hour
+        self.bucket = 0
+
+    def observe(self, t: float, cost_micros: int):
+        """Record spend at epoch time `t` (seconds)."""
+        hour = int(t // HOUR)
+        self.advance(hour)
+        if hour >= self.hour:
+            self.bucket += cost_micros
+        # Late calls for an hour already closed are not smoothed again
+
+    def _cumulative(self, t: float) -> float:
+        """Expected spend over the next `t` hours (without the trend line's negative part)."""
+        phi = self.damping
+        if self.trend < 0:
+            # A falling trend reaches zero spend at t0 (if ever); nothing is spent after that
+            if phi >= 1:
+                t0 = -self.level / self.trend
+            else:
+                floor = 1 + self.level * (1 - phi) / (self.trend * phi)  # phi ** t0
+                t0 = math.log(floor) / math.log(phi) if floor > 0 else math.inf
+            t = min(t, max(t0, 0.0))
+        if t <= 0:
+            return 0.0
+        if phi >= 1:
+            return self.level * t + self.trend * t * t / 2
+        return self.level * t + self.trend * phi / (1 - phi) * (t - (1 - phi ** t) / math.log(1 / phi))
+
+    def project(
+        self,
+        now: datetime,
+        spend_micros: int,
+        limit_micros: int,
+        month_end: datetime
+    ) -> Tuple[int, Optional[datetime]]:
+        """
+        Projected spend at month end and the time the limit is reached.
+
+        Args:
+            now: Current time (naive UTC)
+            spend_micros: Month-to-date spend
+            limit_micros: Monthly limit
+            month_end: Start of next month (projections stop there)
+
+        Returns:
+            (projected month-end spend in micro-units, exhaustion time or None
+            if the limit is not reached this month)
+        """
+        t_now = epoch_seconds(now)
+        self.advance(int(t_now // HOUR))
+        horizon = max(0.0, (month_end - now).total_seconds() / HOUR)
+        month_spend = spend_micros + max(0.0, self._cumulative(horizon))
+        remaining = limit_micros - spend_micros
+        if limit_micros <= 0 or month_spend < limit_micros:
+            return round(month_spend), None
+        if remaining <= 0:
+            return round(month_spend), now
+        low, high = 0.0, horizon
+        while high - low > 1 / 60:  # One minute
+            mid = (low + high) / 2
+            if self._cumulative(mid) >= remaining:
+                high = mid
+            else:
+                low = mid
+        return round(month_spend), now + timedelta(hours=high)
+
+    def hourly_rate(self) -> float:
+        """Expected spend in the next hour (micro-units)."""
+        return max(0.0, self.level + self.damping * self.trend)
@@ -3,18 +3,33 @@ Budget Guardian service - Core business logic.
 Includes autonomous payment handling via agent wallet (inspired by demo/a2a).
 """
 
+import time
 from datetime import datetime, timedelta
 from typing import Dict, Any, List, Optional
 from sqlalchemy import select, func, and_
 from sqlalchemy.ext.asyncio import AsyncSession
 
-from .database import BudgetConfig, ApiUsage, BudgetAlert, Optimization, MonthlyReport
+from .database import BudgetConfig, BudgetRule, ApiUsage, BudgetAlert, MonthlyReport
 from .schemas import (
-    BudgetConfigCreate, ApiUsageCreate, BudgetStatusResponse,
-    BudgetAlertResponse, OptimizationResponse
+    BudgetConfigCreate, BudgetConfigResponse, BudgetRuleCreate, ApiUsageCreate, BudgetStatusResponse,
+    BudgetAlertResponse
 )
 from .ai_analyzer import AIAnalyzer
+from .budget_cache import get_budget_ledger, LedgerEntry
+from .sliding_window import get_usage_windows, get_shared_usage_counts
+from .forecast import next_month
+from .optimizations import upsert_optimizations
+from .usage_writer import get_usage_writer
+from .usage_event import UsageEvent
+from .shared_state import get_shared_store, state_key
+from .status_query import budget_status_query, StatusParts
+from .money import to_micros, from_micros
+from .responses import columns_for, fetch_rows
+from .logs import get_logger, bind_user
 from .config import settings
+from . import metrics
+
+log = get_logger("service")
 
 
 class BudgetGuardianService:
@@ -27,9 +42,16 @@ class BudgetGuardianService:
     
     def __init__(self, db: AsyncSession):
         self.db = db
-        self.ai_analyzer = AIAnalyzer()
+        self._ai_analyzer = None  # Lazy load: only analysis paths need the AI client
         self._agent_wallet = None  # Lazy load to avoid circular imports
     
+    @property
+    def ai_analyzer(self) -> AIAnalyzer:
+        """Lazy-load AI analyzer."""
+        if self._ai_analyzer is None:
+            self._ai_analyzer = AIAnalyzer()
+        return self._ai_analyzer
+    
     @property
     def agent_wallet(self):
         """Lazy-load agent wallet service."""
@@ -38,7 +60,7 @@ class BudgetGuardianService:
             try:
                 self._agent_wallet = get_agent_wallet()
             except ValueError as e:
-                print(f"⚠️  Agent wallet not configured: {e}")
+                log.warning("agent_wallet_unavailable", error=str(e))
                 self._agent_wallet = None
         return self._agent_wallet
     
@@ -56,22 +78,86 @@ class BudgetGuardianService:
         
         if existing_config:
             # Update existing
-            existing_config.monthly_limit = config_data.monthly_limit
+            existing_config.monthly_limit_micros = to_micros(config_data.monthly_limit)
             existing_config.warning_threshold = config_data.warning_threshold
             existing_config.pause_threshold = config_data.pause_threshold
             existing_config.guardian_wallet = config_data.guardian_wallet
             existing_config.updated_at = datetime.utcnow()
             await self.db.commit()
             await self.db.refresh(existing_config)
+            await get_budget_ledger(existing_config.user_address).update_config(existing_config)
             return existing_config
         
         # Create new
-        new_config = BudgetConfig(**config_data.model_dump())
+        new_config = BudgetConfig(
+            **config_data.model_dump(exclude={"monthly_limit"}), monthly_limit_micros=to_micros(config_data.monthly_limit)
+        )
         self.db.add(new_config)
         await self.db.commit()
         await self.db.refresh(new_config)
+        await get_budget_ledger(new_config.user_address).update_config(new_config)
         return new_config
     
+    async def create_budget_rule(self, rule_data: BudgetRuleCreate) -> Dict[str, Any]:
+        """Create a budget rule (sub-limit) for a user."""
+        if rule_data.scope != "user" and not rule_data.scope_value:
+            raise ValueError(f"scope_value is required for {rule_data.scope} rules")
+        
+        rule = BudgetRule(**rule_data.model_dump(exclude={"limit_amount"}), limit_micros=to_micros(rule_data.limit_amount))
+        if rule.scope == "user":
+            rule.scope_value = None
+        self.db.add(rule)
+        await self.db.commit()
+        await self.db.refresh(rule)
+        
+        # Reload the user's counters (including the new rule) on next use
+        await get_budget_ledger(rule.user_address).invalidate(rule.user_address)
+        rules = await self.list_budget_rules(rule.user_address)
+        return next(r for r in rules if r["id"] == rule.id)
+    
+    async def list_budget_rules(self, user_address: str) -> List[Dict[str, Any]]:
+        """List a user's active budget rules with spend in each rule's current window."""
+        stmt = select(BudgetRule).where(
+            and_(
+                BudgetRule.user_address == user_address,
+                BudgetRule.is_active == True
+            )
+        ).order_by(BudgetRule.id)
+        rules = (await self.db.execute(stmt)).scalars().all()
+        
+        entry = await get_budget_ledger(user_address).get_current(user_address)
+        counters = {c.rule_id: c for c in entry.rules}
+        
+        results = []
+        for rule in rules:
+            counter = counters.get(rule.id)
+            results.append({
+                "id": rule.id,
+                "user_address": rule.user_address,
+                "scope": rule.scope,
+                "scope_value": rule.scope_value,
+                "window": rule.window,
+                "limit_amount": from_micros(rule.limit_micros),
+                "is_active": rule.is_active,
+                "created_at": rule.created_at,
+                "current_spend": from_micros(counter.current()) if counter else 0.0,
+                "window_start": counter.window_start if counter else None
+            })
+        return results
+    
+    async def delete_budget_rule(self, rule_id: int) -> bool:
+        """Deactivate a budget rule. Returns False if it does not exist."""
+        stmt = select(BudgetRule).where(BudgetRule.id == rule_id)
+        rule = (await self.db.execute(stmt)).scalar_one_or_none()
+        if not rule:
+            return False
+        
+        rule.is_active = False
+        await self.db.commit()
+        await get_budget_ledger(rule.user_address).invalidate(rule.user_address)
+        return True
+    
+    @metrics.timed("record_api_usage")
     async def record_api_usage(
         self,
         usage_data: ApiUsageCreate
@@ -79,169 +165,330 @@ class BudgetGuardianService:
         """
         Record API usage and check for budget alerts.
         
+        A retry carrying an already recorded idempotency key is dropped
+        without touching budget state (`duplicate` is True, and there are no
+        alerts or budget status).
+        
         Returns:
-            Dict with usage record and any triggered alerts
+            Dict with the usage event and id, any triggered alerts and the budget status
         """
-        # Create usage record
-        usage = ApiUsage(**usage_data.model_dump())
-        self.db.add(usage)
-        await self.db.commit()
-        await self.db.refresh(usage)
+        bind_user(usage_data.user_address)
+        writer = get_usage_writer(usage_data.user_address)
+        if writer.is_duplicate(usage_data.idempotency_key):
+            return self._duplicate_usage(writer.recent_keys.get(usage_data.idempotency_key))
+        
+        # Load the ledger entry and usage window before the insert so the new row is counted once
+        ledger = get_budget_ledger(usage_data.user_address)
+        entry = await ledger.get(usage_data.user_address)
+        window = await get_usage_windows(usage_data.user_address).get(self.db, usage_data.user_address)
+        
+        # Create usage record (committed together with other concurrent events). The read
+        # transaction is ended first so its connection is free for the writer while we wait.
+        with metrics.stage("record_api_usage", "insert"):
+            await self.db.commit()
+            usage = UsageEvent.from_create(usage_data)
+            ((usage_id, inserted),) = await writer.write([usage])
+            if not inserted:
+                return self._duplicate_usage(usage_id)
+            exceeded_rules = await ledger.record_spend(
+                usage.user_address, usage.cost_micros, usage.provider, usage.api_id
+            )
+            await get_shared_usage_counts().record({usage.user_address: window}, [usage])
         
         # Check budget status
-        status = await self.get_budget_status(usage_data.user_address)
+        with metrics.stage("record_api_usage", "budget_status"):
+            status = await self.get_budget_status(usage_data.user_address)
         alerts = []
         
-        # Check thresholds
-        if status["percentage_used"] >= 100 and status["is_paused"]:
-            alert = await self._create_alert(
-                user_address=usage_data.user_address,
-                alert_type="pause",
-                severity="critical",
-                message=f"⚠️ BUDGET PAUSED: You've reached 100% of your ${status['monthly_limit']} budget",
-                current_spend=status["current_spend"],
-                budget_limit=status["monthly_limit"],
-                recommendation="Increase your budget limit or wait until next month"
-            )
-            alerts.append(alert)
-        elif status["percentage_used"] >= 95:
-            alert = await self._create_alert(
-                user_address=usage_data.user_address,
-                alert_type="critical",
-                severity="critical",
-                message=f"🚨 CRITICAL: {status['percentage_used']:.0f}% of budget used (${status['current_spend']:.2f}/${status['monthly_limit']})",
-                current_spend=status["current_spend"],
-                budget_limit=status["monthly_limit"],
-                recommendation="Budget almost exhausted. Consider pausing non-essential API calls."
-            )
-            alerts.append(alert)
-        elif status["percentage_used"] >= 80:
+        # Check thresholds (against the shared month-to-date counter, as in ingest_usage)
+        level = self._threshold_level(entry, entry.spend)
+        if level is not None:
+            alerts.append(await self._threshold_alert(usage_data.user_address, entry, level))
+        
+        # Budget rules crossed by this usage (evaluated in memory)
+        for rule in exceeded_rules:
             alert = await self._create_alert(
                 user_address=usage_data.user_address,
-                alert_type="warning",
+                alert_type=f"rule_{rule.rule_id}",
                 severity="warning",
-                message=f"⚠️ WARNING: {status['percentage_used']:.0f}% of budget used with {status['days_remaining']} days remaining",
-                current_spend=status["current_spend"],
-                budget_limit=status["monthly_limit"],
-                recommendation=None
+                message=f"🚧 RULE LIMIT: {rule.describe()} spend ${from_micros(rule.spent):.2f} exceeded ${from_micros(rule.limit_micros)}",
+                current_spend=from_micros(rule.spent),
+                budget_limit=from_micros(rule.limit_micros),
+                recommendation="Calls matching this rule are denied until the window resets",
+                extra_data={"rule_id": rule.rule_id, "window": rule.window, "scope": rule.scope}
             )
             alerts.append(alert)
         
-        # Check for unusual patterns
-        await self._check_unusual_patterns(usage_data.user_address)
+        # Budget projected to run out before the month ends
+        if status["projected_exhaustion_at"] is not None and status["percentage_used"] < 100 and not status["is_paused"]:
+            alert = await self._forecast_alert(
+                usage_data.user_address,
+                to_micros(status["current_spend"]),
+                to_micros(status["monthly_limit"]),
+                to_micros(status["projected_month_spend"]),
+                status["projected_exhaustion_at"]
+            )
+            if alert:
+                alerts.append(alert)
         
+        # Check for unusual patterns
+        with metrics.stage("record_api_usage", "unusual_patterns"):
+            await self._check_unusual_patterns(usage_data.user_address)
+        
+        log.info(
+            "usage_recorded",
+            usage_id=usage.id,
+            provider=usage.provider,
+            api_id=usage.api_id,
+            cost=usage.cost,
+            alerts=len(alerts)
+        )
         return {
             "usage": usage,
+            "usage_id": usage.id,
+            "duplicate": False,
             "alerts": alerts,
             "budget_status": status
         }
     
+    @staticmethod
+    def _threshold_level(entry: LedgerEntry, spend: int) -> Optional[int]:
+        """
+        Highest budget threshold reached at a month-to-date spend.
+        
+        Args:
+            entry: Ledger entry of the user
+            spend: Month-to-date spend (micro-units)
+        
+        Returns:
+            0 (pause), 1 (CRITICAL_THRESHOLD), 2 (WARNING_THRESHOLD), or None
+        """
+        if not entry.has_config or entry.limit_micros <= 0:
+            return None
+        levels = (
+            entry.pause_at if entry.is_active else None,
+            round(entry.limit_micros * settings.CRITICAL_THRESHOLD),
+            round(entry.limit_micros * settings.WARNING_THRESHOLD)
+        )
+        for level, threshold in enumerate(levels):
+            if threshold is not None and spend >= threshold:
+                return level
+        return None
+    
+    async def _threshold_alert(self, user_address: str, entry: LedgerEntry, level: int) -> BudgetAlert:
+        """Pause/critical/warning alert for a level from `_threshold_level`."""
+        spend, monthly_limit = from_micros(entry.spend), from_micros(entry.limit_micros)
+        percentage_used = entry.spend * 100 / entry.limit_micros
+        now = datetime.utcnow()
+        days_remaining = (next_month(now).date() - now.date()).days
+        alert_type, message, recommendation = (
+            (
+                "pause",
+                f"⚠️ BUDGET PAUSED: You've reached {entry.pause_threshold:.0%} of your ${monthly_limit} budget",
+                "Increase your budget limit or wait until next month"
+            ),
+            (
+                "critical",
+                f"🚨 CRITICAL: {percentage_used:.0f}% of budget used (${spend:.2f}/${monthly_limit})",
+                "Budget almost exhausted. Consider pausing non-essential API calls."
+            ),
+            (
+                "warning",
+                f"⚠️ WARNING: {percentage_used:.0f}% of budget used with {days_remaining} days remaining",
+                None
+            )
+        )[level]
+        return await self._create_alert(
+            user_address=user_address,
+            alert_type=alert_type,
+            severity="warning" if alert_type == "warning" else "critical",
+            message=message,
+            current_spend=spend,
+            budget_limit=monthly_limit,
+            recommendation=recommendation
+        )
+    
+    @staticmethod
+    def _duplicate_usage(usage_id: Optional[int]) -> Dict[str, Any]:
+        """Result of record_api_usage for a dropped retry (id of the original, if committed)."""
+        return {
+            "usage": None,
+            "usage_id": usage_id,
+            "duplicate": True,
+            "alerts": [],
+            "budget_status": None
+        }
+    
+    @metrics.timed("ingest_usage")
+    async def ingest_usage(
+        self,
+        usage_list: List[ApiUsageCreate]
+    ) -> Dict[str, Any]:
+        """
+        Record a batch of API usage for users on this session's shard.
+        
+        Rows go through the shard's group-commit writer and are acknowledged
+        once durable. Budget counters and rate windows are then updated for
+        the rows actually inserted, and alerts are created only when the
+        batch crosses a threshold (`_threshold_level`) or a budget rule limit.
+        Events with an idempotency key already seen (including earlier in
+        the same batch) are dropped. Unusual-pattern checks are left to the
+        caller (see `check_unusual_patterns`).
+        
+        Returns:
+            Dict with the number of rows accepted and dropped as duplicates,
+            the triggered alerts and the distinct users in the batch
+        """
+        users = list(dict.fromkeys(u.user_address for u in usage_list))
+        if not users:
+            return {"accepted": 0, "duplicates": 0, "alerts": [], "users": []}
+        ledger = get_budget_ledger(users[0])
+        windows = get_usage_windows(users[0])
+        
+        # Load ledger entries and windows before the insert so the rows are counted once.
+        # Ledger loads use their own sessions, so they run before this session takes a connection.
+        entries = {user: await ledger.get(user) for user in users}
+        user_windows = {user: await windows.get(self.db, user) for user in users}
+        
+        usage_events = [UsageEvent.from_create(u) for u in usage_list]
+        with metrics.stage("ingest_usage", "write"):
+            await self.db.commit()
+            accepted = await get_usage_writer(users[0]).append(usage_events)
+        usage_events = [event for event, is_new in zip(usage_events, accepted) if is_new]
+        
+        events = [(e.user_address, e.cost_micros, e.provider, e.api_id) for e in usage_events]
+        crossed_rules = []
+        crossed_thresholds = {}
+        for (user, cost, _, _), (spend, rules) in zip(events, await ledger.record_spend_many(events)):
+            crossed_rules.extend((user, rule) for rule in rules)
+            level = self._threshold_level(entries[user], spend)
+            before = self._threshold_level(entries[user], spend - cost)
+            if level is not None and (before is None or level < before):
+                crossed_thresholds[user] = min(level, crossed_thresholds.get(user, level))
+        await get_shared_usage_counts().record(user_windows, usage_events)
+        
+        alerts = []
+        for user, level in crossed_thresholds.items():
+            alerts.append(await self._threshold_alert(user, entries[user], level))
+        
+        for user, rule in crossed_rules:
+            alerts.append(await self._create_alert(
+                user_address=user,
+                alert_type=f"rule_{rule.rule_id}",
+                severity="warning",
+                message=f"🚧 RULE LIMIT: {rule.describe()} spend ${from_micros(rule.spent):.2f} exceeded ${from_micros(rule.limit_micros)}",
+                current_spend=from_micros(rule.spent),
+                budget_limit=from_micros(rule.limit_micros),
+                recommendation="Calls matching this rule are denied until the window resets",
+                extra_data={"rule_id": rule.rule_id, "window": rule.window, "scope": rule.scope}
+            ))
+        
+        # Budgets projected to run out before the month ends (from the in-memory forecasts)
+        now = datetime.utcnow()
+        month_end = next_month(now)
+        for user in users:
+            entry = entries[user]
+            if not entry.has_config or entry.limit_micros <= 0 or entry.spend >= min(entry.limit_micros, entry.pause_at):
+                continue
+            month_spend, exhaustion = user_windows[user].forecast.project(
+                now, entry.spend, entry.limit_micros, month_end
+            )
+            if exhaustion is not None:
+                alert = await self._forecast_alert(user, entry.spend, entry.limit_micros, month_spend, exhaustion)
+                if alert:
+                    alerts.append(alert)
+        
+        return {
+            "accepted": sum(accepted),
+            "duplicates": len(accepted) - sum(accepted),
+            "alerts": alerts,
+            "users": users
+        }
+    
+    async def check_unusual_patterns(self, user_addresses: List[str]):
+        """Run the unusual-pattern check for each user (after a batch ingest)."""
+        for user_address in user_addresses:
+            await self._check_unusual_patterns(user_address)
+    
+    @metrics.timed("get_budget_status")
     async def get_budget_status(
         self,
         user_address: str
     ) -> BudgetStatusResponse:
-        """Get current budget status."""
-        # Get budget config
-        config_stmt = select(BudgetConfig).where(
-            BudgetConfig.user_address == user_address
-        )
-        config_result = await self.db.execute(config_stmt)
-        config = config_result.scalar_one_or_none()
+        """
+        Get current budget status.
+        
+        Config, month-to-date spend, recent alerts and top optimizations are
+        read with one combined query. The burn-rate forecast comes from the
+        user's cached usage window, so a warm request is one database round
+        trip (plus one shared-store read in the first request of an hour, to
+        close the last hour with every worker's spend). On a window cache miss (the user's first request on this
+        worker, or after eviction) the window is seeded first, which adds the
+        7-day baseline and recent-calls queries of `UsageWindows.get`.
+        Alert and optimization rows are returned as the union's dicts, which
+        already have the response types; the route's `response_model`
+        validates them once, instead of once here and again there.
+        """
+        now = datetime.utcnow()
+        start_of_month = now.replace(day=1, hour=0, minute=0, second=0, microsecond=0)
+        
+        with metrics.stage("get_budget_status", "query"):
+            result = await self.db.execute(budget_status_query(user_address, start_of_month))
+            parts = StatusParts(result.all())
         
+        config = parts.config
         if not config:
             raise ValueError(f"No budget configuration found for {user_address}")
         
-        # Get current month's spending
-        current_month = datetime.utcnow().strftime("%Y-%m")
-        start_of_month = datetime.utcnow().replace(day=1, hour=0, minute=0, second=0, microsecond=0)
-        
-        usage_stmt = select(func.sum(ApiUsage.cost)).where(
-            and_(
-                ApiUsage.user_address == user_address,
-                ApiUsage.timestamp >= start_of_month
-            )
-        )
-        result = await self.db.execute(usage_stmt)
-        current_spend = result.scalar() or 0.0
-        
-        # Calculate metrics
-        remaining_budget = max(0, config.monthly_limit - current_spend)
-        percentage_used = (current_spend / config.monthly_limit * 100) if config.monthly_limit > 0 else 0
+        # Calculate metrics (exact in micro-units, converted for the response)
+        spend_micros = parts.spend_micros
+        limit_micros = config["monthly_limit_micros"]
+        remaining_budget = from_micros(max(0, limit_micros - spend_micros))
+        percentage_used = (spend_micros * 100 / limit_micros) if limit_micros > 0 else 0
         
         # Days remaining in month
-        today = datetime.utcnow().date()
-        if today.month == 12:
-            next_month = datetime(today.year + 1, 1, 1).date()
-        else:
-            next_month = datetime(today.year, today.month + 1, 1).date()
-        days_remaining = (next_month - today).days
+        month_end = next_month(now)
+        days_remaining = (month_end.date() - now.date()).days
         
         # Check if paused
-        is_paused = percentage_used >= (config.pause_threshold * 100) and config.is_active
+        is_paused = spend_micros >= round(limit_micros * config["pause_threshold"]) and bool(config["is_active"])
         
-        # Get recent alerts
-        alerts_stmt = select(BudgetAlert).where(
-            BudgetAlert.user_address == user_address
-        ).order_by(BudgetAlert.created_at.desc()).limit(5)
-        alerts_result = await self.db.execute(alerts_stmt)
-        recent_alerts = alerts_result.scalars().all()
-        
-        # Get available optimizations
-        opt_stmt = select(Optimization).where(
-            and_(
-                Optimization.user_address == user_address,
-                Optimization.is_applied == False
-            )
-        ).order_by(Optimization.estimated_savings.desc()).limit(5)
-        opt_result = await self.db.execute(opt_stmt)
-        optimizations = opt_result.scalars().all()
+        # Burn-rate forecast (kept up to date at ingest with the user's usage window)
+        with metrics.stage("get_budget_status", "forecast"):
+            window = await get_usage_windows(user_address).get(self.db, user_address)
+            await get_shared_usage_counts().sync_forecasts({user_address: window})
+            month_spend, exhaustion = window.forecast.project(now, spend_micros, limit_micros, month_end)
         
         return {
             "user_address": user_address,
-            "monthly_limit": config.monthly_limit,
-            "current_spend": current_spend,
+            "monthly_limit": from_micros(limit_micros),
+            "current_spend": from_micros(spend_micros),
             "remaining_budget": remaining_budget,
             "percentage_used": percentage_used,
             "days_remaining": days_remaining,
             "is_paused": is_paused,
-            "recent_alerts": [BudgetAlertResponse.model_validate(a) for a in recent_alerts],
-            "optimizations_available": [OptimizationResponse.model_validate(o) for o in optimizations]
+            "projected_month_spend": from_micros(month_spend),
+            "projected_exhaustion_at": exhaustion,
+            "recent_alerts": parts.alerts,
+            "optimizations_available": parts.optimizations
         }
     
+    @metrics.timed("analyze_spending")
     async def analyze_spending(
         self,
         user_address: str,
         time_window_hours: int = 24
     ) -> Dict[str, Any]:
         """Perform AI analysis of spending patterns."""
-        # Get usage data
-        since = datetime.utcnow() - timedelta(hours=time_window_hours)
-        usage_stmt = select(ApiUsage).where(
-            and_(
-                ApiUsage.user_address == user_address,
-                ApiUsage.timestamp >= since
-            )
-        ).order_by(ApiUsage.timestamp.desc())
+        from .analytics import fetch_usage_columns
         
-        usage_result = await self.db.execute(usage_stmt)
-        usage_records = usage_result.scalars().all()
+        # Get usage data as columns
+        since = datetime.utcnow() - timedelta(hours=time_window_hours)
+        usage = await fetch_usage_columns(self.db, user_address, since)
         
         # Get budget info
         status = await self.get_budget_status(user_address)
         
-        # Prepare data for AI
-        usage_data = [
-            {
-                "api_name": u.api_name,
-                "provider": u.provider,
-                "cost": u.cost,
-                "request_count": u.request_count,
-                "tokens_used": u.tokens_used,
-                "timestamp": u.timestamp.isoformat()
-            }
-            for u in usage_records
-        ]
-        
         budget_info = {
             "monthly_limit": status["monthly_limit"],
             "current_spend": status["current_spend"],
@@ -251,50 +498,33 @@ class BudgetGuardianService:
         
         # Run AI analysis
         analysis = await self.ai_analyzer.analyze_spending_patterns(
-            usage_data=usage_data,
+            usage_data=usage,
             budget_info=budget_info
         )
         
-        # Store optimization suggestions
-        for rec in analysis.get("recommendations", []):
-            opt = Optimization(
-                user_address=user_address,
-                optimization_type=rec.get("type", "unknown"),
-                current_api=rec.get("current_api", ""),
-                suggested_api=rec.get("suggested_api"),
-                estimated_savings=rec.get("estimated_monthly_savings", 0),
-                description=rec.get("description", ""),
-                extra_data=rec
-            )
-            self.db.add(opt)
+        # Store optimization suggestions (refreshing ones already pending)
+        await upsert_optimizations(self.db, (
+            {
+                "user_address": user_address,
+                "optimization_type": rec.get("type", "unknown"),
+                "current_api": rec.get("current_api", ""),
+                "suggested_api": rec.get("suggested_api"),
+                "estimated_savings": rec.get("estimated_monthly_savings", 0),
+                "description": rec.get("description", ""),
+                "extra_data": rec
+            }
+            for rec in analysis.get("recommendations", [])
+        ))
         
         await self.db.commit()
         
-        # Calculate API breakdown
-        api_breakdown = {}
-        for u in usage_records:
-            key = f"{u.provider}:{u.api_name}"
-            if key not in api_breakdown:
-                api_breakdown[key] = {
-                    "provider": u.provider,
-                    "api_name": u.api_name,
-                    "total_cost": 0,
-                    "request_count": 0,
-                    "avg_cost_per_request": 0
-                }
-            api_breakdown[key]["total_cost"] += u.cost
-            api_breakdown[key]["request_count"] += u.request_count
-        
-        # Calculate averages
-        for key in api_breakdown:
-            data = api_breakdown[key]
-            if data["request_count"] > 0:
-                data["avg_cost_per_request"] = data["total_cost"] / data["request_count"]
+        # Calculate API breakdown (vectorized group-by)
+        api_breakdown = usage.breakdown()
         
         return {
             "user_address": user_address,
             "analysis_period": f"Last {time_window_hours} hours",
-            "total_spend": sum(u.cost for u in usage_records),
+            "total_spend": usage.total_cost(),
             "api_breakdown": api_breakdown,
             "patterns_detected": analysis.get("patterns_detected", []),
             "anomalies": analysis.get("anomalies", []),
@@ -303,63 +533,84 @@ class BudgetGuardianService:
             "summary": analysis.get("summary", "")
         }
     
+    @metrics.timed("recommend_optimizations")
+    async def recommend_optimizations(
+        self,
+        user_addresses: Optional[List[str]] = None,
+        phrase: bool = False
+    ) -> Dict[str, Any]:
+        """
+        Compute cost recommendations from usage rollups and upsert them.
+        
+        Args:
+            user_addresses: Users to analyze (default: every user on this shard)
+            phrase: Have the LLM rewrite the descriptions (numbers are kept)
+        
+        Returns:
+            Dict with users analyzed, optimizations created and refreshed, and
+            recommendations per user
+        """
+        from .recommender import load_profiles, recommend, save_recommendations
+        
+        with metrics.stage("recommend_optimizations", "load"):
+            profiles = await load_profiles(self.db, user_addresses)
+        recommendations = recommend(profiles)
+        if phrase:
+            await self.db.commit()  # Release the connection during the LLM calls
+            for user_address, recs in recommendations.items():
+                recommendations[user_address] = await self.ai_analyzer.phrase_optimizations(recs)
+        with metrics.stage("recommend_optimizations", "insert"):
+            created, refreshed = await save_recommendations(self.db, recommendations)
+        
+        return {
+            "users": len({p.user_address for p in profiles.values()}),
+            "created": created,
+            "refreshed": refreshed,
+            "recommendations": recommendations
+        }
+    
+    @metrics.timed("check_unusual_patterns")
     async def _check_unusual_patterns(self, user_address: str):
         """Check for unusual usage patterns."""
-        # Get recent usage (last 5 minutes)
-        recent_time = datetime.utcnow() - timedelta(minutes=settings.ANALYSIS_WINDOW_MINUTES)
-        recent_stmt = select(ApiUsage).where(
-            and_(
-                ApiUsage.user_address == user_address,
-                ApiUsage.timestamp >= recent_time
+        # Calls and cost in the analysis window and the last RECENT_RATE_SECONDS, from this
+        # worker's window and the shared buckets of all workers (each may miss calls: take the larger)
+        with metrics.stage("check_unusual_patterns", "recent_window"):
+            window = await get_usage_windows(user_address).get(self.db, user_address)
+            (shared_calls, shared_cost), (rate_calls, rate_cost) = await get_shared_usage_counts().totals(
+                user_address, (window.window_seconds, settings.RECENT_RATE_SECONDS)
             )
-        )
-        recent_result = await self.db.execute(recent_stmt)
-        recent_usage = recent_result.scalars().all()
+            recent_calls, recent_cost = max(window.totals(), (shared_calls, from_micros(shared_cost)))
         
-        if len(recent_usage) < 10:  # Not enough data
+        if recent_calls < 10:  # Not enough data
             return
         
-        # Get historical average
-        hist_time = datetime.utcnow() - timedelta(days=7)
-        hist_stmt = select(
-            func.count(ApiUsage.id).label("total_calls"),
-            func.sum(ApiUsage.cost).label("total_cost")
-        ).where(
-            and_(
-                ApiUsage.user_address == user_address,
-                ApiUsage.timestamp >= hist_time,
-                ApiUsage.timestamp < recent_time
-            )
-        )
-        hist_result = await self.db.execute(hist_stmt)
-        hist_data = hist_result.one()
-        
-        # Calculate averages
-        minutes_in_week = 7 * 24 * 60
-        avg_calls_per_minute = hist_data.total_calls / minutes_in_week if hist_data.total_calls else 0
-        avg_cost_per_minute = hist_data.total_cost / minutes_in_week if hist_data.total_cost else 0
+        # A user's pattern is sent for AI review at most once per analysis window,
+        # across all workers (claimed in the shared store before the call)
+        now = time.time()
+        cooldown_key = state_key("pattern_check", user_address)
+        if not await get_shared_store().set(cooldown_key, now, ttl=settings.ANALYSIS_WINDOW_MINUTES * 60, nx=True):
+            return
         
+        # Recent rate vs. the 7-day baseline
+        minutes = settings.RECENT_RATE_SECONDS / 60
         historical_avg = {
-            "avg_calls_per_minute": avg_calls_per_minute,
-            "avg_cost_per_minute": avg_cost_per_minute
+            "avg_calls_per_minute": window.baseline.rate(),
+            "avg_cost_per_minute": window.baseline.cost_rate()
         }
         
-        # Prepare recent usage for AI
-        recent_usage_data = [
-            {
-                "api_name": u.api_name,
-                "provider": u.provider,
-                "cost": u.cost,
-                "timestamp": u.timestamp.isoformat()
-            }
-            for u in recent_usage
-        ]
+        # Check with AI (window totals plus the most recent calls as a sample)
+        with metrics.stage("check_unusual_patterns", "detect"):
+            anomaly = await self.ai_analyzer.detect_unusual_pattern(
+                recent_usage=[event.sample() for event in window.recent],
+                historical_average=historical_avg,
+                recent_count=recent_calls,
+                recent_cost=recent_cost,
+                recent_rate=max(window.rate.rate(now), rate_calls / minutes),
+                recent_cost_rate=max(window.rate.cost_rate(now), from_micros(rate_cost) / minutes)
+            )
         
-        # Check with AI
-        anomaly = await self.ai_analyzer.detect_unusual_pattern(
-            recent_usage=recent_usage_data,
-            historical_average=historical_avg
-        )
+        if not anomaly:
+            await get_shared_store().delete(cooldown_key)  # No answer: retry on the next call
         
         if anomaly and anomaly.get("is_unusual"):
             # Create alert
@@ -369,7 +620,7 @@ class BudgetGuardianService:
                 alert_type="unusual_pattern",
                 severity=severity,
                 message=f"🔍 Unusual pattern detected: {anomaly.get('likely_cause', 'unknown')}",
-                current_spend=sum(u.cost for u in recent_usage),
+                current_spend=recent_cost,
                 budget_limit=0,  # Not budget-related
                 recommendation=anomaly.get("recommendation"),
                 extra_data=anomaly
@@ -385,7 +636,47 @@ class BudgetGuardianService:
                 if config:
                     config.is_active = False
                     await self.db.commit()
+                    await get_budget_ledger(user_address).update_config(config)
+    
+    async def _forecast_alert(
+        self,
+        user_address: str,
+        spend_micros: int,
+        limit_micros: int,
+        month_spend_micros: int,
+        exhaustion: datetime
+    ) -> Optional[BudgetAlert]:
+        """
+        Warn that the budget runs out before the month ends at the current burn rate.
+        
+        Sent at most once per FORECAST_ALERT_COOLDOWN_HOURS per user, across all
+        workers (claimed in the shared store), so the forecast can be checked on
+        every call without an alert query.
+        
+        Returns:
+            The alert, or None while the user is in cooldown
+        """
+        cooldown_key = state_key("forecast_alert", user_address)
+        cooldown = settings.FORECAST_ALERT_COOLDOWN_HOURS * 3600
+        if not await get_shared_store().set(cooldown_key, time.time(), ttl=cooldown, nx=True):
+            return None
+        monthly_limit = from_micros(limit_micros)
+        month_spend = from_micros(month_spend_micros)
+        return await self._create_alert(
+            user_address=user_address,
+            alert_type="forecast",
+            severity="warning",
+            message=f"📈 FORECAST: At the current rate your ${monthly_limit} budget runs out on {exhaustion:%Y-%m-%d %H:%M} UTC (${month_spend:.2f} projected this month)",
+            current_spend=from_micros(spend_micros),
+            budget_limit=monthly_limit,
+            recommendation="Reduce non-essential API calls or raise the monthly limit before then",
+            extra_data={
+                "projected_exhaustion_at": exhaustion.isoformat(),
+                "projected_month_spend": month_spend
+            }
+        )
     
+    @metrics.timed("create_alert")
     async def _create_alert(
         self,
         user_address: str,
@@ -400,15 +691,16 @@ class BudgetGuardianService:
         """Create a budget alert."""
         # Check if similar alert exists recently
         recent_time = datetime.utcnow() - timedelta(hours=1)
-        existing_stmt = select(BudgetAlert).where(
-            and_(
-                BudgetAlert.user_address == user_address,
-                BudgetAlert.alert_type == alert_type,
-                BudgetAlert.created_at >= recent_time
-            )
-        )
-        result = await self.db.execute(existing_stmt)
-        existing = result.scalar_one_or_none()
+        with metrics.stage("create_alert", "dedup"):
+            existing_stmt = select(BudgetAlert).where(
+                and_(
+                    BudgetAlert.user_address == user_address,
+                    BudgetAlert.alert_type == alert_type,
+                    BudgetAlert.created_at >= recent_time
+                )
+            ).limit(1)
+            result = await self.db.execute(existing_stmt)
+            existing = result.scalars().first()
         
         if existing:
             return existing  # Don't spam alerts
@@ -423,15 +715,19 @@ class BudgetGuardianService:
             recommendation=recommendation,
             extra_data=extra_data
         )
-        self.db.add(alert)
-        await self.db.commit()
-        await self.db.refresh(alert)
+        with metrics.stage("create_alert", "insert"):
+            self.db.add(alert)
+            await self.db.commit()
+            await self.db.refresh(alert)
         return alert
     
+    @metrics.timed("generate_monthly_report")
     async def generate_monthly_report(self, user_address: str) -> MonthlyReport:
-        """Generate monthly spending report."""
-        current_month = datetime.utcnow().strftime("%Y-%m")
-        start_of_month = datetime.utcnow().replace(day=1, hour=0, minute=0, second=0, microsecond=0)
+        """Generate monthly spending report (same figures as the batch job, see reports.py)."""
+        from .reports import month_range, build_reports
+        from .sharding import get_shard_router
+        
+        month, start_of_month, end_of_month = month_range()
         
         # Get budget config
         config_stmt = select(BudgetConfig).where(
@@ -443,62 +739,58 @@ class BudgetGuardianService:
         if not config:
             raise ValueError(f"No budget configuration found for {user_address}")
         
-        # Get usage
-        usage_stmt = select(ApiUsage).where(
-            and_(
-                ApiUsage.user_address == user_address,
-                ApiUsage.timestamp >= start_of_month
-            )
-        )
-        usage_result = await self.db.execute(usage_stmt)
-        usage_records = usage_result.scalars().all()
-        
-        # API breakdown
-        api_breakdown = {}
-        for u in usage_records:
-            key = f"{u.provider}:{u.api_name}"
-            api_breakdown[key] = api_breakdown.get(key, 0) + u.cost
-        
-        total_spent = sum(u.cost for u in usage_records)
-        
-        # Count alerts
-        alerts_stmt = select(func.count(BudgetAlert.id)).where(
-            and_(
-                BudgetAlert.user_address == user_address,
-                BudgetAlert.created_at >= start_of_month
-            )
-        )
-        alerts_result = await self.db.execute(alerts_stmt)
-        alerts_count = alerts_result.scalar() or 0
-        
-        # Count optimizations
-        opt_stmt = select(
-            func.count(Optimization.id),
-            func.sum(Optimization.estimated_savings)
-        ).where(
-            and_(
-                Optimization.user_address == user_address,
-                Optimization.is_applied == True,
-                Optimization.applied_at >= start_of_month
-            )
-        )
-        opt_result = await self.db.execute(opt_stmt)
-        opt_data = opt_result.one()
-        
-        report = MonthlyReport(
-            user_address=user_address,
-            month=current_month,
-            total_spent=total_spent,
-            budget_limit=config.monthly_limit,
-            api_breakdown=api_breakdown,
-            alerts_triggered=alerts_count,
-            optimizations_applied=opt_data[0] or 0,
-            cost_saved=opt_data[1] or 0,
-            projected_cost_without_guardian=total_spent + (opt_data[1] or 0)
+        # Spend per API, alerts and applied optimizations (grouped queries)
+        (row,) = await build_reports(
+            self.db,
+            get_shard_router().shard_for(user_address),
+            [(user_address, config.monthly_limit_micros)],
+            month,
+            start_of_month,
+            end_of_month
         )
+        report = MonthlyReport(**row)
         
         self.db.add(report)
         await self.db.commit()
         await self.db.refresh(report)
         
         return report
+    
+    async def get_summary(self) -> Dict[str, Any]:
+        """Summary counts for this database (one shard in sharded mode)."""
+        start_of_month = datetime.utcnow().replace(day=1, hour=0, minute=0, second=0, microsecond=0)
+        
+        users_stmt = select(func.count(BudgetConfig.id))
+        users = (await self.db.execute(users_stmt)).scalar() or 0
+        
+        usage_stmt = select(
+            func.count(ApiUsage.id),
+            func.sum(ApiUsage.cost_micros)
+        ).where(ApiUsage.timestamp >= start_of_month)
+        usage_rows, month_spend = (await self.db.execute(usage_stmt)).one()
+        
+        alerts_stmt = select(func.count(BudgetAlert.id)).where(
+            BudgetAlert.created_at >= start_of_month
+        )
+        alerts = (await self.db.execute(alerts_stmt)).scalar() or 0
+        
+        return {
+            "users": users,
+            "usage_records_this_month": usage_rows or 0,
+            "current_month_spend": from_micros(month_spend),
+            "alerts_this_month": alerts
+        }
+    
+    async def list_budget_configs(self, limit: int = 100) -> List[Dict[str, Any]]:
+        """List budget configurations ordered by user address (BudgetConfigResponse fields)."""
+        stmt = select(*columns_for(BudgetConfig, BudgetConfigResponse)).order_by(
+            BudgetConfig.user_address
+        ).limit(limit)
+        return await fetch_rows(self.db, stmt)
+    
+    async def list_recent_alerts(self, limit: int = 50) -> List[Dict[str, Any]]:
+        """List the most recent alerts across all users (BudgetAlertResponse fields)."""
+        stmt = select(*columns_for(BudgetAlert, BudgetAlertResponse)).order_by(
+            BudgetAlert.created_at.desc()
+        ).limit(limit)
+        return await fetch_rows(self.db, stmt)
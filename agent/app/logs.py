@@ -0,0 +1,255 @@
+"""
+Structured logging: JSON lines written off the request path.
+
+Modules log named events with fields:
+
+    log = get_logger("wallet")
+    log.info("payment_succeeded", user=user_address, cost_cro=cost, tx_hash=tx_hash)
+
+A log call checks the level and the event's sample rate, builds the record
+(no caller lookup, no formatting) and puts it on a bounded queue. A listener
+thread formats and writes the records, so stdout I/O never blocks the event
+loop. When the queue is full the record is dropped and counted
+(`guardian_log_records_dropped`) instead of waiting.
+
+High-volume events are sampled per event name (LOG_SAMPLE_RATES, e.g.
+"usage_recorded=0.01"). Records kept by sampling carry `sample_rate`, so
+counts can be re-weighted. Warnings and errors are never sampled.
+
+Every record carries the request ID (the X-Request-ID header, or a generated
+one, echoed in the response) and the user address of the current request,
+from context variables set by CorrelationMiddleware and `bind_user`.
+"""
+
+import atexit
+import json
+import logging
+import queue
+import random
+import re
+import sys
+import uuid
+from contextvars import ContextVar
+from datetime import datetime, timezone
+from logging.handlers import QueueHandler, QueueListener
+from typing import Any, Dict, Optional
+from urllib.parse import parse_qs
+
+from .config import settings
+
+LOGGER_PREFIX = "guardian"
+
+request_id_var: ContextVar[Optional[str]] = ContextVar("request_id", default=None)
+user_var: ContextVar[Optional[str]] = ContextVar("user_address", default=None)
+
+# Records dropped because the queue was full
+dropped = 0
+
+_sample_rates: Dict[str, float] = {}
+_listener: Optional[QueueListener] = None
+
+_ADDRESS_SEGMENT = re.compile(r"/(0x[0-9a-fA-F]{40})(?:/|$)")
+_EXC_FORMATTER = logging.Formatter()
+
+
+def parse_sample_rates(spec: str) -> Dict[str, float]:
+    """Parse "event=rate,event=rate" into a dict."""
+    rates = {}
+    for item in spec.split(","):
+        if "=" in item:
+            event, rate = item.split("=", 1)
+            rates[event.strip()] = max(0.0, min(1.0, float(rate)))
+    return rates
+
+
+class JsonFormatter(logging.Formatter):
+    """One JSON object per line: ts, level, logger, event, correlation IDs, then fields."""
+
+    def format(self, record: logging.LogRecord) -> str:
+        data = {
+            "ts": datetime.fromtimestamp(record.created, timezone.utc).isoformat(timespec="milliseconds"),
+            "level": record.levelname.lower(),
+            "logger": record.name,
+            "event": record.getMessage()
+        }
+        data.update(getattr(record, "fields", None) or {})
+        if record.exc_text:
+            data["exc"] = record.exc_text
+        return json.dumps(data, ensure_ascii=False, default=str)
+
+
+class TextFormatter(logging.Formatter):
+    """Human-readable lines for development: time, level, logger, event and key=value fields."""
+
+    def format(self, record: logging.LogRecord) -> str:
+        ts = datetime.fromtimestamp(record.created).strftime("%H:%M:%S.%f")[:-3]
+        fields = getattr(record, "fields", None) or {}
+        line = " ".join(
+            [ts, record.levelname, record.name, record.getMessage()]
+            + [f"{key}={value}" for key, value in fields.items()]
+        )
+        if record.exc_text:
+            line += "\n" + record.exc_text
+        return line
+
+
+class _NonBlockingQueueHandler(QueueHandler):
+    """Enqueues records as they are; drops them when the queue is full."""
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        # Formatting happens in the listener thread. Tracebacks are rendered
+        # now, since the frames may be gone by then.
+        if record.exc_info:
+            record.exc_text = _EXC_FORMATTER.formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+    def enqueue(self, record: logging.LogRecord):
+        global dropped
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            dropped += 1
+
+
+class EventLogger:
+    """
+    Logger for named events with keyword fields.
+
+    Args:
+        logger: Underlying stdlib logger
+    """
+
+    __slots__ = ("logger",)
+
+    def __init__(self, logger: logging.Logger):
+        self.logger = logger
+
+    def _log(self, level: int, event: str, fields: Dict[str, Any], exc_info=None):
+        if not self.logger.isEnabledFor(level):
+            return
+        if level < logging.WARNING:
+            rate = _sample_rates.get(event)
+            if rate is not None:
+                if random.random() >= rate:
+                    return
+                fields["sample_rate"] = rate
+        request_id = request_id_var.get()
+        if request_id is not None:
+            fields.setdefault("request_id", request_id)
+        user = user_var.get()
+        if user is not None:
+            fields.setdefault("user", user)
+        record = self.logger.makeRecord(
+            self.logger.name, level, "", 0, event, (), exc_info, extra={"fields": fields}
+        )
+        self.logger.handle(record)
+
+    def debug(self, event: str, **fields):
+        self._log(logging.DEBUG, event, fields)
+
+    def info(self, event: str, **fields):
+        self._log(logging.INFO, event, fields)
+
+    def warning(self, event: str, **fields):
+        self._log(logging.WARNING, event, fields)
+
+    def error(self, event: str, **fields):
+        self._log(logging.ERROR, event, fields)
+
+    def exception(self, event: str, **fields):
+        """Error with the traceback of the exception being handled."""
+        self._log(logging.ERROR, event, fields, exc_info=sys.exc_info())
+
+
+def setup_logging():
+    """Attach the queue handler to the "guardian" loggers and start the writer thread (once)."""
+    global _listener
+    if _listener is not None:
+        return
+    _sample_rates.update(parse_sample_rates(settings.LOG_SAMPLE_RATES))
+
+    stream = logging.StreamHandler(sys.stdout)
+    stream.setFormatter(TextFormatter() if settings.LOG_FORMAT == "text" else JsonFormatter())
+    log_queue = queue.Queue(maxsize=settings.LOG_QUEUE_SIZE)
+
+    root = logging.getLogger(LOGGER_PREFIX)
+    root.setLevel(settings.LOG_LEVEL.upper())
+    root.addHandler(_NonBlockingQueueHandler(log_queue))
+    root.propagate = False
+
+    _listener = QueueListener(log_queue, stream)
+    _listener.start()
+    atexit.register(shutdown_logging)
+
+
+def shutdown_logging():
+    """Write out queued records and stop the writer thread."""
+    global _listener
+    if _listener is not None:
+        _listener.stop()
+        _listener = None
+
+
+def get_logger(name: str) -> EventLogger:
+    """Event logger "guardian.<name>"; configures logging on first use."""
+    setup_logging()
+    return EventLogger(logging.getLogger(f"{LOGGER_PREFIX}.{name}"))
+
+
+def bind_user(user_address: Optional[str]):
+    """Attach a user address to the records of the current request or task."""
+    user_var.set(user_address)
+
+
+def _user_from_scope(scope) -> Optional[str]:
+    """User address from a `0x…` path segment or a `user_address` query parameter."""
+    match = _ADDRESS_SEGMENT.search(scope.get("path", ""))
+    if match:
+        return match.group(1)
+    query = scope.get("query_string", b"")
+    if b"user_address=" in query:
+        values = parse_qs(query.decode()).get("user_address")
+        if values:
+            return values[0]
+    return None
+
+
+class CorrelationMiddleware:
+    """
+    ASGI middleware binding a request ID and user address to each HTTP request.
+
+    The request ID comes from the X-Request-ID header when the caller sends
+    one (so IDs follow a request across services) and is returned in the
+    response headers. Background tasks run inside the request, so their
+    records carry the same IDs.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+
+        request_id = None
+        for name, value in scope["headers"]:
+            if name == b"x-request-id":
+                request_id = value.decode("latin-1")[:128]
+                break
+        if not request_id:
+            request_id = uuid.uuid4().hex[:16]
+        request_token = request_id_var.set(request_id)
+        user_token = user_var.set(_user_from_scope(scope))
+        header = (b"x-request-id", request_id.encode("latin-1"))
+
+        async def send_with_id(message):
+            if message["type"] == "http.response.start":
+                message["headers"] = list(message.get("headers", [])) + [header]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_id)
+        finally:
+            request_id_var.reset(request_token)
+            user_var.reset(user_token)
@@ -2,25 +2,53 @@
 AI Budget Guardian - FastAPI Application
 """
 
+import asyncio
+import heapq
+from itertools import islice
+from operator import itemgetter
+
 from fastapi import FastAPI, Depends, HTTPException, BackgroundTasks
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import PlainTextResponse
 from sqlalchemy.ext.asyncio import AsyncSession
 from typing import List, Optional
 
-from .database import init_db, get_db
+from .database import get_db
 from .guardian_service import BudgetGuardianService
+from .ai_analyzer import provider_latencies, provider_error_rates
+from .sharding import (
+    get_shard_router,
+    get_user_db,
+    get_config_db,
+    get_rule_db,
+    get_usage_db,
+    get_analysis_db
+)
 from .schemas import (
     BudgetConfigCreate,
     BudgetConfigResponse,
+    BudgetRuleCreate,
+    BudgetRuleResponse,
     ApiUsageCreate,
+    ApiUsageBatch,
     BudgetStatusResponse,
     BudgetAlertResponse,
     OptimizationResponse,
     AnalysisRequest,
     AnalysisResponse,
-    MonthlyReportResponse
+    MonthlyReportResponse,
+    AdmissionRequest,
+    AdmissionBatchRequest,
+    AdmissionResponse,
+    BacktestRequest
 )
+from .responses import RowsResponse, columns_for, fetch_rows
+from .usage_writer import queue_depths, close_usage_writers
+from .logs import get_logger, CorrelationMiddleware
 from .config import settings
+from . import logs, metrics
+
+log = get_logger("api")
 
 app = FastAPI(
     title="AI Budget Guardian",
@@ -37,14 +65,89 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+# Request IDs and user addresses on every log record
+app.add_middleware(CorrelationMiddleware)
+
+
+# Alert notifications scheduled but not yet delivered
+pending_notifications = 0
+
+# Background batch report run (kept referenced until it finishes)
+report_task = None
+
+
+def _db_pool_stats():
+    """Connection pool gauges per local shard."""
+    values = []
+    for shard in get_shard_router().local_shards:
+        pool = shard.engine.sync_engine.pool
+        for stat in ("size", "checkedin", "checkedout", "overflow"):
+            fn = getattr(pool, stat, None)
+            if fn is not None:
+                values.append(({"shard": str(shard.index), "stat": stat}, fn()))
+    return values
+
+
+metrics.registry.register_gauge(
+    "guardian_db_pool_connections",
+    "Database connection pool state per shard",
+    _db_pool_stats
+)
+metrics.registry.register_gauge(
+    "guardian_usage_queue_depth",
+    "Usage rows queued for group commit per shard",
+    queue_depths
+)
+metrics.registry.register_gauge(
+    "guardian_pending_notifications",
+    "Alert notifications queued as background tasks",
+    lambda: pending_notifications
+)
+metrics.registry.register_gauge(
+    "guardian_log_records_dropped",
+    "Log records dropped because the log queue was full",
+    lambda: logs.dropped
+)
+metrics.registry.register_gauge(
+    "guardian_ai_provider_latency_seconds",
+    "Recent AI_HEDGE_PERCENTILE latency of LLM requests per provider",
+    provider_latencies
+)
+metrics.registry.register_gauge(
+    "guardian_ai_provider_error_rate",
+    "Moving-average error rate of LLM requests per provider",
+    provider_error_rates
+)
+
 
 @app.on_event("startup")
 async def startup_event():
-    """Initialize database on startup."""
-    await init_db()
-    print(f"🤖 AI Budget Guardian started")
-    print(f"🧠 AI Provider: {settings.AI_PROVIDER}")
-    print(f"🔗 Backend URL: {settings.BACKEND_URL}")
+    """
+    Log startup configuration.
+    
+    Schema creation is not run here (see `python main.py migrate`) unless
+    AUTO_MIGRATE is set; the engine, AI client and Web3 connect on first use.
+    """
+    router = get_shard_router()
+    if settings.AUTO_MIGRATE:
+        from .migrations import migrate
+        await migrate()
+    if settings.USAGE_RETENTION_INTERVAL_HOURS > 0:
+        from .retention import retention_loop
+        asyncio.create_task(retention_loop())
+    log.info(
+        "started",
+        shards=router.local_indexes,
+        shard_count=router.shard_count,
+        ai_provider=settings.AI_PROVIDER,
+        backend_url=settings.BACKEND_URL
+    )
+
+
+@app.on_event("shutdown")
+async def shutdown_event():
+    """Commit usage events still queued in the group-commit writers."""
+    await close_usage_writers()
 
 
 @app.get("/")
@@ -69,10 +172,19 @@ async def health_check():
     }
 
 
+@app.get("/metrics", response_class=PlainTextResponse)
+async def get_metrics():
+    """Prometheus metrics (latency histograms, pool stats, queue depth, cache hit ratios)."""
+    return PlainTextResponse(
+        metrics.registry.render(),
+        media_type="text/plain; version=0.0.4"
+    )
+
+
 @app.post("/api/budget/config", response_model=BudgetConfigResponse)
 async def create_budget_config(
     config: BudgetConfigCreate,
-    db: AsyncSession = Depends(get_db)
+    db: AsyncSession = Depends(get_config_db)
 ):
     """Create or update budget configuration."""
     try:
@@ -86,7 +198,7 @@ async def create_budget_config(
 @app.get("/api/budget/status/{user_address}", response_model=BudgetStatusResponse)
 async def get_budget_status(
     user_address: str,
-    db: AsyncSession = Depends(get_db)
+    db: AsyncSession = Depends(get_user_db)
 ):
     """Get current budget status."""
     try:
@@ -99,15 +211,124 @@ async def get_budget_status(
         raise HTTPException(status_code=500, detail=str(e))
 
 
+@app.post("/api/budget/rules", response_model=BudgetRuleResponse)
+async def create_budget_rule(
+    rule: BudgetRuleCreate,
+    db: AsyncSession = Depends(get_rule_db)
+):
+    """Create a budget rule: a per-user, per-provider or per-API limit per hour, day or month."""
+    try:
+        service = BudgetGuardianService(db)
+        return await service.create_budget_rule(rule)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+
+@app.get("/api/budget/rules/{user_address}", response_model=List[BudgetRuleResponse])
+async def list_budget_rules(
+    user_address: str,
+    db: AsyncSession = Depends(get_user_db)
+):
+    """List a user's budget rules with spend in each rule's current window."""
+    try:
+        service = BudgetGuardianService(db)
+        return RowsResponse(await service.list_budget_rules(user_address))
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+
+@app.delete("/api/budget/rules/{rule_id}")
+async def delete_budget_rule(
+    rule_id: int,
+    db: AsyncSession = Depends(get_user_db)
+):
+    """
+    Delete (deactivate) a budget rule.
+    
+    In sharded mode, pass `user_address` as a query parameter to route to the user's shard.
+    """
+    try:
+        service = BudgetGuardianService(db)
+        if not await service.delete_budget_rule(rule_id):
+            raise HTTPException(status_code=404, detail="Budget rule not found")
+        return {"ok": True, "message": "Budget rule deleted"}
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+
+@app.get("/api/budget/admit/{user_address}", response_model=AdmissionResponse)
+async def admit_payment(
+    user_address: str,
+    cost: float = 0.0,
+    provider: Optional[str] = None,
+    api_id: Optional[str] = None
+):
+    """
+    Pre-payment budget gate.
+    
+    Called by the backend's x402 middleware before it serves a paid request.
+    Answers from the in-memory budget ledger; the database is only read when
+    the user's entry is missing or stale. Pass `provider` and `api_id` to
+    apply provider and API budget rules.
+    """
+    try:
+        from .budget_cache import get_budget_ledger
+        from .sharding import ShardNotLocalError
+        from .money import to_micros
+        
+        return await get_budget_ledger(user_address).admit(user_address, to_micros(cost), provider, api_id)
+    except ShardNotLocalError as e:
+        raise HTTPException(status_code=421, detail=str(e))
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+
+@app.post("/api/budget/admit", response_model=List[AdmissionResponse])
+async def admit_payments(batch: AdmissionBatchRequest):
+    """
+    Batch form of the pre-payment budget gate, one decision per request.
+    
+    Users whose shard is not served by this node get `allowed: null` and
+    reason `shard_not_local`.
+    """
+    try:
+        from .budget_cache import get_budget_ledger
+        from .sharding import ShardNotLocalError
+        from .money import to_micros
+        
+        async def decide(request: AdmissionRequest):
+            try:
+                ledger = get_budget_ledger(request.user_address)
+            except ShardNotLocalError as e:
+                return {
+                    "user_address": request.user_address,
+                    "allowed": None,
+                    "reason": "shard_not_local",
+                    "cost": request.cost,
+                    "shard": e.shard
+                }
+            return await ledger.admit(request.user_address, to_micros(request.cost), request.provider, request.api_id)
+        
+        return await asyncio.gather(*(decide(r) for r in batch.requests))
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+
 @app.post("/api/usage/record")
 async def record_usage(
     usage: ApiUsageCreate,
     background_tasks: BackgroundTasks,
-    db: AsyncSession = Depends(get_db)
+    db: AsyncSession = Depends(get_usage_db)
 ):
     """
     Record API usage and trigger monitoring.
     This endpoint is called by the backend after each API call.
+    Retries with the same `idempotency_key` return `duplicate: true`
+    and the original `usage_id`.
     """
     try:
         service = BudgetGuardianService(db)
@@ -115,6 +336,8 @@ async def record_usage(
         
         # If alerts were triggered, notify user (background task)
         if result["alerts"]:
+            global pending_notifications
+            pending_notifications += 1
             background_tasks.add_task(
                 notify_user_alerts,
                 user_address=usage.user_address,
@@ -123,7 +346,8 @@ async def record_usage(
         
         return {
             "ok": True,
-            "usage_id": result["usage"].id,
+            "usage_id": result["usage_id"],
+            "duplicate": result["duplicate"],
             "alerts_triggered": len(result["alerts"]),
             "budget_status": result["budget_status"]
         }
@@ -131,19 +355,75 @@ async def record_usage(
         raise HTTPException(status_code=500, detail=str(e))
 
 
+@app.post("/api/usage/record/batch")
+async def record_usage_batch(
+    batch: ApiUsageBatch,
+    background_tasks: BackgroundTasks
+):
+    """
+    Record many usage events in one call (high-volume ingest).
+    
+    Events are acknowledged once durable: appended to the ingest log when
+    USAGE_WRITER_LOG_DIR is set, committed otherwise. Events for users whose
+    shard is not served by this node are returned in `rejected`.
+    """
+    try:
+        from .sharding import ShardNotLocalError
+        
+        router = get_shard_router()
+        groups = {}
+        rejected = []
+        for event in batch.events:
+            try:
+                shard = router.shard_for(event.user_address)
+            except ShardNotLocalError as e:
+                rejected.append({"user_address": event.user_address, "reason": "shard_not_local", "shard": e.shard})
+                continue
+            groups.setdefault(shard.index, (shard, []))[1].append(event)
+        
+        async def ingest(shard, events):
+            async with shard.session_maker() as db:
+                return await BudgetGuardianService(db).ingest_usage(events)
+        
+        shards = [shard for shard, _ in groups.values()]
+        results = await asyncio.gather(*(ingest(shard, events) for shard, events in groups.values()))
+        
+        global pending_notifications
+        alerts_triggered = 0
+        for shard, result in zip(shards, results):
+            background_tasks.add_task(check_usage_patterns, shard=shard, user_addresses=result["users"])
+            alerts_by_user = {}
+            for alert in result["alerts"]:
+                alerts_by_user.setdefault(alert.user_address, []).append(alert)
+            for user_address, alerts in alerts_by_user.items():
+                pending_notifications += 1
+                background_tasks.add_task(notify_user_alerts, user_address=user_address, alerts=alerts)
+            alerts_triggered += len(result["alerts"])
+        
+        return {
+            "ok": True,
+            "accepted": sum(r["accepted"] for r in results),
+            "duplicates": sum(r["duplicates"] for r in results),
+            "alerts_triggered": alerts_triggered,
+            "rejected": rejected
+        }
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+
 @app.get("/api/alerts/{user_address}", response_model=List[BudgetAlertResponse])
 async def get_alerts(
     user_address: str,
     limit: int = 20,
     unread_only: bool = False,
-    db: AsyncSession = Depends(get_db)
+    db: AsyncSession = Depends(get_user_db)
 ):
     """Get user alerts."""
     try:
         from sqlalchemy import select, and_
         from .database import BudgetAlert
         
-        stmt = select(BudgetAlert).where(
+        stmt = select(*columns_for(BudgetAlert, BudgetAlertResponse)).where(
             BudgetAlert.user_address == user_address
         )
         
@@ -152,10 +432,7 @@ async def get_alerts(
         
         stmt = stmt.order_by(BudgetAlert.created_at.desc()).limit(limit)
         
-        result = await db.execute(stmt)
-        alerts = result.scalars().all()
-        
-        return [BudgetAlertResponse.model_validate(a) for a in alerts]
+        return RowsResponse(await fetch_rows(db, stmt))
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
@@ -163,9 +440,13 @@ async def get_alerts(
 @app.post("/api/alerts/{alert_id}/mark-read")
 async def mark_alert_read(
     alert_id: int,
-    db: AsyncSession = Depends(get_db)
+    db: AsyncSession = Depends(get_user_db)
 ):
-    """Mark alert as read."""
+    """
+    Mark alert as read.
+    
+    In sharded mode, pass `user_address` as a query parameter to route to the user's shard.
+    """
     try:
         from sqlalchemy import select
         from .database import BudgetAlert
@@ -191,14 +472,14 @@ async def mark_alert_read(
 async def get_optimizations(
     user_address: str,
     applied_only: bool = False,
-    db: AsyncSession = Depends(get_db)
+    db: AsyncSession = Depends(get_user_db)
 ):
     """Get optimization suggestions."""
     try:
         from sqlalchemy import select, and_
         from .database import Optimization
         
-        stmt = select(Optimization).where(
+        stmt = select(*columns_for(Optimization, OptimizationResponse)).where(
             Optimization.user_address == user_address
         )
         
@@ -209,10 +490,7 @@ async def get_optimizations(
         
         stmt = stmt.order_by(Optimization.estimated_savings.desc())
         
-        result = await db.execute(stmt)
-        optimizations = result.scalars().all()
-        
-        return [OptimizationResponse.model_validate(o) for o in optimizations]
+        return RowsResponse(await fetch_rows(db, stmt))
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
@@ -220,9 +498,13 @@ async def get_optimizations(
 @app.post("/api/optimizations/{optimization_id}/apply")
 async def apply_optimization(
     optimization_id: int,
-    db: AsyncSession = Depends(get_db)
+    db: AsyncSession = Depends(get_user_db)
 ):
-    """Mark optimization as applied."""
+    """
+    Mark optimization as applied.
+    
+    In sharded mode, pass `user_address` as a query parameter to route to the user's shard.
+    """
     try:
         from datetime import datetime
         from sqlalchemy import select
@@ -250,10 +532,51 @@ async def apply_optimization(
         raise HTTPException(status_code=500, detail=str(e))
 
 
+@app.post("/api/optimizations/recommend")
+async def recommend_optimizations(user_address: Optional[str] = None, phrase: bool = False):
+    """
+    Compute cost recommendations (caching, batching, cheaper providers) from usage rollups.
+    
+    Runs for one user, or for every user on the local shards when
+    `user_address` is omitted. New suggestions are stored as optimizations;
+    ones already pending get their estimates refreshed. With `phrase=true`
+    the LLM rewrites the descriptions.
+    """
+    try:
+        router = get_shard_router()
+        
+        if user_address is not None:
+            from .sharding import ShardNotLocalError
+            try:
+                shard = router.shard_for(user_address)
+            except ShardNotLocalError as e:
+                raise HTTPException(status_code=421, detail=str(e))
+            async with shard.session_maker() as db:
+                result = await BudgetGuardianService(db).recommend_optimizations([user_address], phrase)
+            return {"ok": True, "data": result}
+        
+        from .recommender import run_recommender
+        
+        shards = await run_recommender(phrase)
+        return {
+            "ok": True,
+            "data": {
+                "shards": shards,
+                "users": sum(s["users"] for s in shards),
+                "created": sum(s["created"] for s in shards),
+                "refreshed": sum(s["refreshed"] for s in shards)
+            }
+        }
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+
 @app.post("/api/analyze", response_model=AnalysisResponse)
 async def analyze_spending(
     request: AnalysisRequest,
-    db: AsyncSession = Depends(get_db)
+    db: AsyncSession = Depends(get_analysis_db)
 ):
     """Perform AI analysis of spending patterns."""
     try:
@@ -270,7 +593,7 @@ async def analyze_spending(
 @app.get("/api/report/{user_address}/monthly", response_model=MonthlyReportResponse)
 async def get_monthly_report(
     user_address: str,
-    db: AsyncSession = Depends(get_db)
+    db: AsyncSession = Depends(get_user_db)
 ):
     """Get or generate monthly report."""
     try:
@@ -300,16 +623,187 @@ async def get_monthly_report(
         raise HTTPException(status_code=500, detail=str(e))
 
 
+# ═══════════════════════════════════════════════════════════════════════
+# 🧩 Admin Endpoints (fan out across local shards and merge)
+# ═══════════════════════════════════════════════════════════════════════
+
+@app.get("/api/admin/shards")
+async def get_shards_overview():
+    """Per-shard summary and fleet totals for the shards served by this node."""
+    try:
+        router = get_shard_router()
+        
+        async def summarize(db, shard):
+            summary = await BudgetGuardianService(db).get_summary()
+            return {"shard": shard.index, **summary}
+        
+        shards = await router.fan_out(summarize)
+        totals = {
+            key: sum(s[key] for s in shards)
+            for key in ("users", "usage_records_this_month", "current_month_spend", "alerts_this_month")
+        }
+        
+        return {
+            "ok": True,
+            "data": {
+                "shard_count": router.shard_count,
+                "local_shards": router.local_indexes,
+                "shards": shards,
+                "totals": totals
+            }
+        }
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+
+@app.get("/api/admin/shards/lookup/{user_address}")
+async def lookup_user_shard(user_address: str):
+    """Which shard holds a user's data, and whether this node serves it."""
+    router = get_shard_router()
+    index = router.index_for(user_address)
+    return {
+        "ok": True,
+        "data": {
+            "user_address": user_address,
+            "shard": index,
+            "is_local": index in router.local_indexes
+        }
+    }
+
+
+@app.get("/api/admin/budgets", response_model=List[BudgetConfigResponse])
+async def list_all_budget_configs(limit: int = 100):
+    """Budget configurations across local shards, ordered by user address."""
+    try:
+        router = get_shard_router()
+        
+        async def fetch(db, shard):
+            return await BudgetGuardianService(db).list_budget_configs(limit)
+        
+        results = await router.fan_out(fetch)
+        merged = heapq.merge(*results, key=itemgetter("user_address"))
+        return RowsResponse(list(islice(merged, limit)))
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+
+@app.get("/api/admin/alerts", response_model=List[BudgetAlertResponse])
+async def list_all_alerts(limit: int = 50):
+    """Most recent alerts across local shards, newest first."""
+    try:
+        router = get_shard_router()
+        
+        async def fetch(db, shard):
+            return await BudgetGuardianService(db).list_recent_alerts(limit)
+        
+        results = await router.fan_out(fetch)
+        merged = heapq.merge(*results, key=itemgetter("created_at"), reverse=True)
+        return RowsResponse(list(islice(merged, limit)))
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+
+@app.post("/api/admin/backtest")
+async def backtest_policies(request: BacktestRequest):
+    """
+    Replay historical usage through alert and anomaly policy variants.
+    
+    Runs for one user, or for every user on the local shards when
+    `user_address` is omitted. Reports, per policy, the alerts and pauses
+    it would have raised and how many alerts were false positives in
+    hindsight (see app.backtest). Nothing is stored or sent.
+    """
+    try:
+        from .backtest import run_backtest
+        
+        if request.user_address is not None:
+            from .sharding import ShardNotLocalError
+            try:
+                get_shard_router().shard_for(request.user_address)
+            except ShardNotLocalError as e:
+                raise HTTPException(status_code=421, detail=str(e))
+        
+        policies = await run_backtest(request.policies, request.days, request.user_address, request.incident_ratio)
+        return {"ok": True, "data": {"days": request.days, "policies": policies}}
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+
+@app.post("/api/admin/reports/run")
+async def run_monthly_reports_job(month: Optional[str] = None):
+    """
+    Start generating the monthly report of every budget on the local shards.
+    
+    Runs in the background (one run at a time per process). Poll
+    /api/admin/reports/progress for users done out of total.
+    `month` is "YYYY-MM" (default: the current month, to date).
+    """
+    from .reports import run_monthly_reports, get_report_progress, month_range
+    
+    progress = get_report_progress()
+    if progress is not None and progress.running:
+        raise HTTPException(status_code=409, detail=f"Reports for {progress.month} are already running")
+    try:
+        month_range(month)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    
+    global report_task
+    report_task = asyncio.create_task(run_monthly_reports(month))
+    await asyncio.sleep(0)  # Let the run register its progress
+    return {"ok": True, "data": get_report_progress().snapshot()}
+
+
+@app.get("/api/admin/reports/progress")
+async def get_monthly_reports_progress():
+    """Progress of the current (or last) batch report run on this process."""
+    from .reports import get_report_progress
+    
+    progress = get_report_progress()
+    return {"ok": True, "data": progress.snapshot() if progress else None}
+
+
+@app.post("/api/admin/retention/run")
+async def run_usage_retention():
+    """Roll up completed days and archive raw usage older than the retention period (local shards)."""
+    try:
+        from .retention import run_retention
+        
+        return {"ok": True, "data": await run_retention()}
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+
+async def check_usage_patterns(shard, user_addresses: List[str]):
+    """Background task: unusual-pattern checks for the users of an ingested batch."""
+    try:
+        async with shard.session_maker() as db:
+            await BudgetGuardianService(db).check_unusual_patterns(user_addresses)
+    except Exception:
+        log.exception("pattern_check_failed", shard=shard.index, users=len(user_addresses))
+
+
 async def notify_user_alerts(user_address: str, alerts: List):
     """
     Background task to notify user about alerts.
     Can be extended to send webhooks, emails, etc.
     """
+    global pending_notifications
     # TODO: Implement webhook notifications to backend
     # TODO: Implement email notifications
-    print(f"📬 Alerts for {user_address}: {len(alerts)} new alerts")
-    for alert in alerts:
-        print(f"  - {alert.severity.upper()}: {alert.message}")
+    try:
+        for alert in alerts:
+            log.warning(
+                "budget_alert",
+                user=user_address,
+                alert_type=alert.alert_type,
+                severity=alert.severity,
+                message=alert.message
+            )
+    finally:
+        pending_notifications -= 1
 
 
 # ═══════════════════════════════════════════════════════════════════════
@@ -351,7 +845,7 @@ async def agent_autonomous_payment(
     user_address: str,
     api_id: str,
     cost_cro: float,
-    db: AsyncSession = Depends(get_db)
+    db: AsyncSession = Depends(get_user_db)
 ):
     """
     Execute autonomous payment for API usage.
@@ -377,7 +871,7 @@ async def agent_autonomous_payment(
     """
     try:
         from .agent_wallet import get_agent_wallet
-        from decimal import Decimal
+        from .money import to_micros
         
         wallet = get_agent_wallet()
         
@@ -385,7 +879,7 @@ async def agent_autonomous_payment(
         success, tx_hash, error = await wallet.pay_for_api_usage(
             user_address=user_address,
             api_id=api_id,
-            cost_cro=Decimal(str(cost_cro)),
+            cost_micros=to_micros(cost_cro),
             db=db
         )
         
@@ -395,14 +889,16 @@ async def agent_autonomous_payment(
                 "error": error
             }
         
-        # Record usage
+        # Record usage (keyed on the transaction hash, so a retried call is not counted twice)
         service = BudgetGuardianService(db)
         usage = await service.record_api_usage(ApiUsageCreate(
             user_address=user_address,
             api_id=api_id,
+            api_name=api_id,
+            provider="x402",
             cost=cost_cro,
-            payment_method="agent_auto",
-            transaction_hash=tx_hash
+            metadata={"payment_method": "agent_auto", "transaction_hash": tx_hash},
+            idempotency_key=tx_hash
         ))
         
         return {
@@ -410,7 +906,7 @@ async def agent_autonomous_payment(
             "data": {
                 "transaction_hash": tx_hash,
                 "cost_cro": cost_cro,
-                "usage_id": usage.id,
+                "usage_id": usage["usage_id"],
                 "message": "Payment executed autonomously by agent"
             }
         }
@@ -433,6 +929,7 @@ async def get_agent_balance():
     """
     try:
         from .agent_wallet import get_agent_wallet
+        from .money import from_micros, to_micros
         
         wallet = get_agent_wallet()
         balance = await wallet.get_balance()
@@ -441,8 +938,8 @@ async def get_agent_balance():
             "ok": True,
             "data": {
                 "address": wallet.account.address,
-                "balance_cro": float(balance),
-                "needs_funding": balance < 2.0,
+                "balance_cro": from_micros(balance),
+                "needs_funding": balance < to_micros(2.0),
                 "blockchain_url": f"https://cronoscan.com/address/{wallet.account.address}"
             }
         }
@@ -0,0 +1,201 @@
+"""
+Low-overhead latency metrics with a Prometheus text endpoint.
+
+Timings are recorded into fixed-bucket histograms keyed by (operation, stage).
+The `timed` decorator resolves its histogram once at decoration time, so the
+per-call cost is two perf_counter() calls and a bisect. With
+METRICS_ENABLED=false the decorator returns the function unchanged.
+"""
+
+from bisect import bisect_left
+from functools import wraps
+from inspect import iscoroutinefunction
+from time import perf_counter
+from typing import Callable, Dict, List, Tuple, Union
+
+from .config import settings
+
+
+# Latency buckets in seconds (upper bounds, +Inf implied)
+DEFAULT_BUCKETS = (
+    0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025,
+    0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0
+)
+
+GaugeValue = Union[float, List[Tuple[Dict[str, str], float]]]
+
+
+class Histogram:
+    """Cumulative-bucket histogram for one label set."""
+
+    __slots__ = ("buckets", "counts", "sum", "count")
+
+    def __init__(self, buckets: Tuple[float, ...] = DEFAULT_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float):
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+
+class Stage:
+    """Context manager that records elapsed time into a histogram."""
+
+    __slots__ = ("histogram", "start")
+
+    def __init__(self, histogram: Histogram):
+        self.histogram = histogram
+
+    def __enter__(self):
+        self.start = perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.histogram.observe(perf_counter() - self.start)
+        return False
+
+
+class _NullStage:
+    """No-op stage used when metrics are disabled."""
+
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+
+_NULL_STAGE = _NullStage()
+
+
+class MetricsRegistry:
+    """Holds duration histograms, cache counters and scrape-time gauges."""
+
+    def __init__(self):
+        self.durations: Dict[Tuple[str, str], Histogram] = {}
+        self.cache_hits: Dict[str, int] = {}
+        self.cache_misses: Dict[str, int] = {}
+        self.gauges: Dict[str, Tuple[str, Callable[[], GaugeValue]]] = {}
+
+    def histogram(self, operation: str, stage: str = "total") -> Histogram:
+        """Get or create the duration histogram for (operation, stage)."""
+        key = (operation, stage)
+        hist = self.durations.get(key)
+        if hist is None:
+            hist = self.durations[key] = Histogram()
+        return hist
+
+    def register_gauge(self, name: str, help_text: str, fn: Callable[[], GaugeValue]):
+        """
+        Register a gauge evaluated at scrape time.
+
+        Args:
+            name: Metric name
+            help_text: HELP line text
+            fn: Returns a value, or a list of (labels, value) pairs
+        """
+        self.gauges[name] = (help_text, fn)
+
+    def render(self) -> str:
+        """Render all metrics in Prometheus text exposition format."""
+        lines = [
+            "# HELP guardian_duration_seconds Time spent per operation and stage",
+            "# TYPE guardian_duration_seconds histogram",
+        ]
+        for (operation, stage), hist in sorted(self.durations.items()):
+            labels = f'operation="{operation}",stage="{stage}"'
+            cumulative = 0
+            for bound, count in zip(hist.buckets, hist.counts):
+                cumulative += count
+                lines.append(f'guardian_duration_seconds_bucket{{{labels},le="{bound}"}} {cumulative}')
+            lines.append(f'guardian_duration_seconds_bucket{{{labels},le="+Inf"}} {hist.count}')
+            lines.append(f"guardian_duration_seconds_sum{{{labels}}} {hist.sum}")
+            lines.append(f"guardian_duration_seconds_count{{{labels}}} {hist.count}")
+
+        caches = sorted(set(self.cache_hits) | set(self.cache_misses))
+        if caches:
+            lines.append("# HELP guardian_cache_requests_total Cache lookups by result")
+            lines.append("# TYPE guardian_cache_requests_total counter")
+            for cache in caches:
+                lines.append(f'guardian_cache_requests_total{{cache="{cache}",result="hit"}} {self.cache_hits.get(cache, 0)}')
+                lines.append(f'guardian_cache_requests_total{{cache="{cache}",result="miss"}} {self.cache_misses.get(cache, 0)}')
+            lines.append("# HELP guardian_cache_hit_ratio Cache hit ratio since start")
+            lines.append("# TYPE guardian_cache_hit_ratio gauge")
+            for cache in caches:
+                hits = self.cache_hits.get(cache, 0)
+                total = hits + self.cache_misses.get(cache, 0)
+                lines.append(f'guardian_cache_hit_ratio{{cache="{cache}"}} {hits / total if total else 0.0}')
+
+        for name, (help_text, fn) in sorted(self.gauges.items()):
+            lines.append(f"# HELP {name} {help_text}")
+            lines.append(f"# TYPE {name} gauge")
+            value = fn()
+            if isinstance(value, list):
+                for labels, v in value:
+                    label_str = ",".join(f'{k}="{lv}"' for k, lv in labels.items())
+                    lines.append(f"{name}{{{label_str}}} {v}")
+            else:
+                lines.append(f"{name} {value}")
+
+        return "\n".join(lines) + "\n"
+
+
+registry = MetricsRegistry()
+
+
+def timed(operation: str, stage: str = "total"):
+    """
+    Decorator recording a function's wall time (sync or async).
+
+    Args:
+        operation: Operation label (e.g. "record_api_usage")
+        stage: Stage label (default: "total")
+    """
+    def decorator(fn):
+        if not settings.METRICS_ENABLED:
+            return fn
+        hist = registry.histogram(operation, stage)
+
+        if iscoroutinefunction(fn):
+            @wraps(fn)
+            async def async_wrapper(*args, **kwargs):
+                start = perf_counter()
+                try:
+                    return await fn(*args, **kwargs)
+                finally:
+                    hist.observe(perf_counter() - start)
+            return async_wrapper
+
+        @wraps(fn)
+        def wrapper(*args, **kwargs):
+            start = perf_counter()
+            try:
+                return fn(*args, **kwargs)
+            finally:
+                hist.observe(perf_counter() - start)
+        return wrapper
+
+    return decorator
+
+
+def stage(operation: str, name: str):
+    """Context manager timing one stage of an operation."""
+    if not settings.METRICS_ENABLED:
+        return _NULL_STAGE
+    return Stage(registry.histogram(operation, name))
+
+
+def cache_hit(cache: str):
+    """Count a cache hit."""
+    registry.cache_hits[cache] = registry.cache_hits.get(cache, 0) + 1
+
+
+def cache_miss(cache: str):
+    """Count a cache miss."""
+    registry.cache_misses[cache] = registry.cache_misses.get(cache, 0) + 1
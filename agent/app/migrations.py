@@ -0,0 +1,193 @@
+"""
+Database schema migrations.
+
+Schema creation runs from an explicit command rather than on every boot:
+
+    python main.py migrate
+
+Set AUTO_MIGRATE=true to also run it at startup (convenient in development).
+
+Missing tables are created from the models. Columns added to an existing
+table later are listed in ADDED_COLUMNS and added with ALTER TABLE (plus
+their indexes), so databases created by an older version are upgraded in
+place. Migrations are additive, except for DROPPED_COLUMNS: columns whose
+values a backfill has moved elsewhere are dropped (with their indexes) in
+the same transaction, after the backfill.
+
+Columns that replace an older one are filled from it by BACKFILLS, for rows
+where the new column is still NULL (so re-running is a no-op). The integer
+micro-unit amounts (see money.py) are backfilled from the float columns this
+way (as BIGINT: amounts above ~2147 units overflow a 32-bit INTEGER on
+PostgreSQL); the float columns are kept for older readers, and derived from
+the micro-unit columns on every write (see database.py).
+Dictionary tables are first filled from existing rows by SEEDS, so that
+backfills can look keys up in them (see dimensions); api_usage and
+usage_rollups then only keep the key, and their provider and API name
+columns are dropped. SQLite cannot drop a column that a table constraint
+uses (the rollups' former unique key), so such a table is rebuilt from its
+model instead, copying the remaining columns. Indexes the model has and the
+table lacks are created after the drops. Seeds and
+backfills reading a table that has lost its dropped columns are skipped on
+later runs (its rows were filled by the first one). Rows that a new unique
+index would reject are removed by DEDUPLICATES before their key is
+backfilled (pending optimizations repeating a suggestion keep the newest).
+"""
+
+from typing import List, Set
+
+from sqlalchemy import inspect, text
+
+from .database import Base
+from .sharding import get_shard_router
+
+# Columns added after their table was first released: (table, column)
+ADDED_COLUMNS = [
+    ("api_usage", "idempotency_key"),
+    ("usage_rollups", "repeat_calls"),
+    ("api_usage", "cost_micros"),
+    ("usage_rollups", "cost_micros"),
+    ("budget_configs", "monthly_limit_micros"),
+    ("budget_rules", "limit_micros"),
+    ("api_usage", "api_dim_id"),
+    ("usage_rollups", "api_dim_id"),
+    ("optimizations", "fingerprint"),
+    ("optimizations", "updated_at"),
+]
+
+# Rows added to dictionary tables from existing data, before BACKFILLS: (source table, SQL)
+SEEDS = [
+    (table, """INSERT INTO api_dimensions (provider, api_id, api_name)
+       SELECT provider, api_id, MIN(api_name) FROM {table} t
+       WHERE api_dim_id IS NULL AND NOT EXISTS (
+           SELECT 1 FROM api_dimensions d WHERE d.provider = t.provider AND d.api_id = t.api_id
+       )
+       GROUP BY provider, api_id""".format(table=table))
+    for table in ("api_usage", "usage_rollups")
+]
+
+# Rows removed before BACKFILLS fill a uniquely indexed column
+DEDUPLICATES = [
+    """DELETE FROM optimizations
+       WHERE fingerprint IS NULL AND NOT is_applied AND id NOT IN (
+           SELECT MAX(id) FROM optimizations WHERE fingerprint IS NULL AND NOT is_applied
+           GROUP BY user_address, optimization_type, current_api, COALESCE(suggested_api, '')
+       )""",
+]
+
+# Columns filled from an older column: (table, column, SQL expression)
+BACKFILLS = [
+    ("api_usage", "cost_micros", "CAST(ROUND(cost * 1000000) AS BIGINT)"),
+    ("usage_rollups", "cost_micros", "CAST(ROUND(cost * 1000000) AS BIGINT)"),
+    ("budget_configs", "monthly_limit_micros", "CAST(ROUND(monthly_limit * 1000000) AS BIGINT)"),
+    ("budget_rules", "limit_micros", "CAST(ROUND(limit_amount * 1000000) AS BIGINT)"),
+    ("optimizations", "fingerprint", "optimization_type || '|' || current_api || '|' || COALESCE(suggested_api, '')"),
+    ("optimizations", "updated_at", "COALESCE(created_at, CURRENT_TIMESTAMP)"),
+] + [
+    (table, "api_dim_id", f"(SELECT d.id FROM api_dimensions d WHERE d.provider = {table}.provider AND d.api_id = {table}.api_id)")
+    for table in ("api_usage", "usage_rollups")
+]
+
+# Columns dropped once BACKFILLS have moved their values: (table, column)
+DROPPED_COLUMNS = [
+    (table, column)
+    for table in ("api_usage", "usage_rollups")
+    for column in ("provider", "api_id", "api_name")
+]
+
+
+def _columns(conn, table_name: str) -> Set[str]:
+    return {c["name"] for c in inspect(conn).get_columns(table_name)}
+
+
+def _add_columns(conn) -> List[str]:
+    """Add missing ADDED_COLUMNS and their indexes (sync, run via run_sync)."""
+    added = []
+    for table_name, column_name in ADDED_COLUMNS:
+        if column_name in _columns(conn, table_name):
+            continue
+        table = Base.metadata.tables[table_name]
+        column_type = table.c[column_name].type.compile(dialect=conn.dialect)
+        conn.execute(text(f"ALTER TABLE {table_name} ADD COLUMN {column_name} {column_type}"))
+        for index in table.indexes:
+            if column_name in index.columns:
+                index.create(conn, checkfirst=True)
+        added.append(f"{table_name}.{column_name}")
+    return added
+
+
+def _backfill(conn) -> List[str]:
+    """Run SEEDS and DEDUPLICATES, then fill BACKFILLS columns that are still NULL (sync, run via run_sync)."""
+    migrated = {table for table, column in DROPPED_COLUMNS if column not in _columns(conn, table)}
+    for table_name, statement in SEEDS:
+        if table_name not in migrated:
+            conn.execute(text(statement))
+    for statement in DEDUPLICATES:
+        conn.execute(text(statement))
+    filled = []
+    for table_name, column_name, expression in BACKFILLS:
+        if table_name in migrated:
+            continue
+        result = conn.execute(text(
+            f"UPDATE {table_name} SET {column_name} = {expression} WHERE {column_name} IS NULL"
+        ))
+        if result.rowcount:
+            filled.append(f"{table_name}.{column_name} ({result.rowcount} rows)")
+    return filled
+
+
+def _rebuild_table(conn, table_name: str):
+    """Recreate a table from its model, copying the columns both have (SQLite)."""
+    table = Base.metadata.tables[table_name]
+    kept = ", ".join(c.name for c in table.columns if c.name in _columns(conn, table_name))
+    for index in inspect(conn).get_indexes(table_name):
+        conn.execute(text(f"DROP INDEX {index['name']}"))
+    conn.execute(text(f"ALTER TABLE {table_name} RENAME TO {table_name}_old"))
+    table.create(conn)
+    conn.execute(text(f"INSERT INTO {table_name} ({kept}) SELECT {kept} FROM {table_name}_old"))
+    conn.execute(text(f"DROP TABLE {table_name}_old"))
+
+
+def _drop_columns(conn) -> List[str]:
+    """Drop DROPPED_COLUMNS that still exist, and their indexes (sync, run via run_sync)."""
+    dropped = []
+    tables = set()
+    for table_name, column_name in DROPPED_COLUMNS:
+        if column_name not in _columns(conn, table_name):
+            continue
+        tables.add(table_name)
+        constrained = {
+            column for constraint in inspect(conn).get_unique_constraints(table_name)
+            for column in constraint["column_names"]
+        }
+        if conn.dialect.name == "sqlite" and column_name in constrained:
+            gone = _columns(conn, table_name) - set(Base.metadata.tables[table_name].c.keys())
+            _rebuild_table(conn, table_name)
+            dropped.extend(f"{table_name}.{column}" for column in sorted(gone))
+            continue
+        for index in inspect(conn).get_indexes(table_name):
+            if column_name in index["column_names"]:
+                conn.execute(text(f"DROP INDEX {index['name']}"))
+        conn.execute(text(f"ALTER TABLE {table_name} DROP COLUMN {column_name}"))
+        dropped.append(f"{table_name}.{column_name}")
+    for table_name in tables:
+        for index in Base.metadata.tables[table_name].indexes:
+            index.create(conn, checkfirst=True)
+    return dropped
+
+
+async def migrate():
+    """Create missing tables and columns on every local shard."""
+    router = get_shard_router()
+    for shard in router.local_shards:
+        await shard.init_db()
+        async with shard.engine.begin() as conn:
+            added = await conn.run_sync(_add_columns)
+            filled = await conn.run_sync(_backfill)
+            dropped = await conn.run_sync(_drop_columns)
+        for column in added:
+            print(f"➕ Added column {column} on shard {shard.index}")
+        for column in filled:
+            print(f"🔁 Backfilled {column} on shard {shard.index}")
+        for column in dropped:
+            print(f"➖ Dropped column {column} on shard {shard.index}")
+        print(f"✅ Migrated shard {shard.index}: {shard.database_url}")
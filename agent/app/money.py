@@ -0,0 +1,33 @@
+"""
+Integer micro-unit amounts.
+
+Costs, spend and limits are stored and aggregated as integer micro-units
+(1 unit = 1,000,000 micros) in 64-bit columns and counters, so sums and limit
+comparisons are exact and do not depend on the order rows are added in.
+Float amounts only exist at the API boundary: requests are converted with
+`to_micros` when they come in, and responses with `from_micros` on the way
+out. One micro is 10^12 wei, so on-chain amounts convert without rounding.
+"""
+
+MICROS = 1_000_000
+WEI_PER_MICRO = 10 ** 12
+
+
+def to_micros(amount) -> int:
+    """Micro-units of an amount (float, int, Decimal or numeric string), rounded to the nearest micro."""
+    return round(float(amount) * MICROS)
+
+
+def from_micros(micros) -> float:
+    """Amount of an integer number of micro-units (0.0 for None)."""
+    return (micros or 0) / MICROS
+
+
+def micros_to_wei(micros: int) -> int:
+    """Wei (10^-18) of an amount in micro-units."""
+    return micros * WEI_PER_MICRO
+
+
+def wei_to_micros(wei: int) -> int:
+    """Micro-units of an amount in wei (truncated)."""
+    return wei // WEI_PER_MICRO
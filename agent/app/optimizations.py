@@ -0,0 +1,105 @@
+"""
+Stored optimization suggestions: fingerprints, upsert and expiry.
+
+A suggestion is identified by its fingerprint, "type|current_api|suggested_api".
+A user has at most one pending (not applied) optimization per fingerprint,
+enforced by a partial unique index on (user_address, fingerprint). Suggestions
+from the recommender and the LLM analysis are written with one bulk
+INSERT ... ON CONFLICT DO UPDATE per chunk: a new fingerprint inserts a row,
+a pending one gets its savings estimate, description and details refreshed
+(keeping its id and created_at). Applying an optimization takes it out of
+the index, so the same change can be suggested again later.
+
+Pending suggestions that have not been suggested again for
+OPTIMIZATION_TTL_DAYS are deleted on each upsert, so the pending set (which
+list endpoints and the status query sort) stays small. Applied optimizations
+are kept for the monthly reports.
+"""
+
+from datetime import datetime, timedelta
+from typing import Any, Dict, Iterable, Optional, Tuple
+
+from sqlalchemy import delete, and_
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from .database import Optimization, conflict_insert
+from .config import settings
+from .logs import get_logger
+
+log = get_logger("optimizations")
+
+# Rows per INSERT ... ON CONFLICT statement (12 parameters each)
+UPSERT_CHUNK = 500
+
+# Columns overwritten when a pending suggestion is suggested again
+REFRESHED = ("estimated_savings", "description", "extra_data", "updated_at")
+
+
+def fingerprint(optimization_type: str, current_api: str, suggested_api: Optional[str]) -> str:
+    """Identity of a suggestion (same as the migration backfill in SQL)."""
+    return f"{optimization_type}|{current_api}|{suggested_api or ''}"
+
+
+async def expire_optimizations(db: AsyncSession, now: Optional[datetime] = None) -> int:
+    """Delete pending suggestions not refreshed within OPTIMIZATION_TTL_DAYS (not committed)."""
+    cutoff = (now or datetime.utcnow()) - timedelta(days=settings.OPTIMIZATION_TTL_DAYS)
+    result = await db.execute(delete(Optimization).where(
+        and_(Optimization.is_applied == False, Optimization.updated_at < cutoff)
+    ))
+    return result.rowcount or 0
+
+
+async def upsert_optimizations(db: AsyncSession, suggestions: Iterable[Dict[str, Any]]) -> Tuple[int, int]:
+    """
+    Insert new suggestions and refresh pending ones (not committed).
+
+    Args:
+        db: Database session (one shard)
+        suggestions: Dicts with user_address, optimization_type, current_api,
+            suggested_api, estimated_savings, description and extra_data. For
+            a repeated fingerprint of a user, the largest saving is kept.
+
+    Returns:
+        (suggestions created, pending suggestions refreshed)
+    """
+    now = datetime.utcnow()
+    rows: Dict[Tuple[str, str], Dict[str, Any]] = {}
+    for suggestion in suggestions:
+        current_api = suggestion["current_api"] or ""
+        key = (
+            suggestion["user_address"],
+            fingerprint(suggestion["optimization_type"], current_api, suggestion["suggested_api"])
+        )
+        if key in rows and rows[key]["estimated_savings"] >= suggestion["estimated_savings"]:
+            continue
+        rows[key] = {
+            "user_address": key[0],
+            "optimization_type": suggestion["optimization_type"],
+            "current_api": current_api,
+            "suggested_api": suggestion["suggested_api"],
+            "fingerprint": key[1],
+            "estimated_savings": suggestion["estimated_savings"],
+            "description": suggestion["description"],
+            "is_applied": False,
+            "extra_data": suggestion.get("extra_data"),
+            "created_at": now,
+            "updated_at": now
+        }
+
+    insert = conflict_insert(db.get_bind().dialect)
+    values = list(rows.values())
+    created = 0
+    for i in range(0, len(values), UPSERT_CHUNK):
+        stmt = insert(Optimization).values(values[i:i + UPSERT_CHUNK])
+        stmt = stmt.on_conflict_do_update(
+            index_elements=[Optimization.user_address, Optimization.fingerprint],
+            index_where=Optimization.is_applied == False,
+            set_={column: stmt.excluded[column] for column in REFRESHED}
+        ).returning(Optimization.created_at)
+        # A refreshed row keeps its original created_at
+        created += sum(1 for (created_at,) in (await db.execute(stmt)).all() if created_at == now)
+
+    expired = await expire_optimizations(db, now)
+    if expired:
+        log.info("optimizations_expired", rows=expired)
+    return created, len(values) - created
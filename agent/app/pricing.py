@@ -0,0 +1,132 @@
+"""
+Price catalog for comparing providers of interchangeable APIs.
+
+Each entry prices one API per unit ("1k_tokens" or "request") and belongs to
+a class of APIs that can replace each other (e.g. frontier chat models,
+transactional email). Prices are in the currency usage costs are recorded
+in. The built-in entries are public list prices; PRICE_CATALOG_PATH names a
+JSON file with a list of entries ({"class", "provider", "api_name", "unit",
+"price", "batch_discount"}) that replace built-in entries with the same
+provider and API name, or add new ones.
+
+`batch_discount` is the fraction saved by sending requests through the
+provider's batch interface (0 when there is none).
+"""
+
+import json
+from typing import Dict, List, Optional, Tuple
+
+from .config import settings
+
+UNITS = ("1k_tokens", "request")
+
+# (class, provider, api_name, unit, price, batch_discount)
+DEFAULT_CATALOG = [
+    ("chat-frontier", "openai", "gpt-4", "1k_tokens", 0.045, 0.5),
+    ("chat-frontier", "openai", "gpt-4-turbo", "1k_tokens", 0.02, 0.5),
+    ("chat-frontier", "openai", "gpt-4o", "1k_tokens", 0.0075, 0.5),
+    ("chat-frontier", "anthropic", "claude-3-opus", "1k_tokens", 0.045, 0.5),
+    ("chat-frontier", "anthropic", "claude-3-5-sonnet", "1k_tokens", 0.009, 0.5),
+    ("chat-standard", "openai", "gpt-3.5-turbo", "1k_tokens", 0.001, 0.5),
+    ("chat-standard", "openai", "gpt-4o-mini", "1k_tokens", 0.0004, 0.5),
+    ("chat-standard", "deepseek", "deepseek-chat", "1k_tokens", 0.0006, 0.0),
+    ("chat-standard", "anthropic", "claude-3-haiku", "1k_tokens", 0.0008, 0.5),
+    ("embeddings", "openai", "text-embedding-ada-002", "1k_tokens", 0.0001, 0.5),
+    ("embeddings", "openai", "text-embedding-3-small", "1k_tokens", 0.00002, 0.5),
+    ("embeddings", "cohere", "embed-english-v3.0", "1k_tokens", 0.0001, 0.0),
+    ("email", "sendgrid", "send", "request", 0.001, 0.0),
+    ("email", "mailgun", "send", "request", 0.0008, 0.0),
+    ("email", "aws", "ses-send", "request", 0.0001, 0.0),
+    ("sms", "twilio", "sms", "request", 0.0079, 0.0),
+    ("sms", "vonage", "sms", "request", 0.0068, 0.0),
+    ("geocoding", "google", "geocode", "request", 0.005, 0.0),
+    ("geocoding", "mapbox", "geocode", "request", 0.00075, 0.0),
+]
+
+
+class PriceEntry:
+    """Unit price of one API."""
+
+    __slots__ = ("api_class", "provider", "api_name", "unit", "price", "batch_discount")
+
+    def __init__(
+        self,
+        api_class: str,
+        provider: str,
+        api_name: str,
+        unit: str,
+        price: float,
+        batch_discount: float = 0.0
+    ):
+        if unit not in UNITS:
+            raise ValueError(f"Unknown price unit: {unit}")
+        self.api_class = api_class
+        self.provider = provider
+        self.api_name = api_name
+        self.unit = unit
+        self.price = price
+        self.batch_discount = batch_discount
+
+    @property
+    def label(self) -> str:
+        return f"{self.provider}:{self.api_name}"
+
+
+def _key(provider: str, api_name: str) -> Tuple[str, str]:
+    return provider.strip().lower(), api_name.strip().lower()
+
+
+class PriceCatalog:
+    """Price entries indexed by (provider, api_name) and by class."""
+
+    def __init__(self, entries: List[PriceEntry]):
+        self._entries: Dict[Tuple[str, str], PriceEntry] = {}
+        for entry in entries:
+            self._entries[_key(entry.provider, entry.api_name)] = entry
+        self._by_class: Dict[str, List[PriceEntry]] = {}
+        for entry in self._entries.values():
+            self._by_class.setdefault(entry.api_class, []).append(entry)
+        for members in self._by_class.values():
+            members.sort(key=lambda e: e.price)
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def lookup(self, provider: str, api_name: str) -> Optional[PriceEntry]:
+        """Entry for an API as recorded in usage (case-insensitive), or None."""
+        return self._entries.get(_key(provider, api_name))
+
+    def alternatives(self, entry: PriceEntry) -> List[PriceEntry]:
+        """Cheaper entries of the same class and unit, cheapest first."""
+        return [
+            other for other in self._by_class.get(entry.api_class, [])
+            if other.unit == entry.unit and other.price < entry.price and other is not entry
+        ]
+
+    @classmethod
+    def load(cls, path: str = "") -> "PriceCatalog":
+        """Built-in catalog, overlaid with the entries of a JSON file if given."""
+        entries = [PriceEntry(*row) for row in DEFAULT_CATALOG]
+        if path:
+            with open(path) as f:
+                for item in json.load(f):
+                    entries.append(PriceEntry(
+                        api_class=item["class"],
+                        provider=item["provider"],
+                        api_name=item["api_name"],
+                        unit=item["unit"],
+                        price=float(item["price"]),
+                        batch_discount=float(item.get("batch_discount", 0.0))
+                    ))
+        return cls(entries)
+
+
+# Singleton instance
+price_catalog = None
+
+def get_price_catalog() -> PriceCatalog:
+    """Get or load the price catalog (PRICE_CATALOG_PATH)."""
+    global price_catalog
+    if price_catalog is None:
+        price_catalog = PriceCatalog.load(settings.PRICE_CATALOG_PATH)
+    return price_catalog
@@ -0,0 +1,89 @@
+"""
+Timestamp-aware call and cost rate estimation.
+
+A RateEstimator keeps an exponentially weighted moving average (EWMA) of the
+time between calls and of the cost per call. Rate is 1 / mean gap, and cost
+rate is rate * mean cost. When no call has arrived for longer than the mean
+gap, the time since the last call is used instead, so an idle user's rate
+decays instead of staying at its last burst value.
+
+The same estimator serves both sides of unusual-pattern detection. A fast
+one (large alpha) tracks recent traffic. A slow one (small alpha), seeded
+from the historical average, is the baseline.
+"""
+
+import calendar
+from datetime import datetime
+from typing import Dict, Any, List, Optional
+
+# Calls within the same instant still count as a (very short) gap
+MIN_GAP_SECONDS = 0.001
+
+RECENT_ALPHA = 0.2
+BASELINE_ALPHA = 0.01
+
+
+def epoch_seconds(timestamp: datetime) -> float:
+    """Epoch seconds (with microseconds) of a naive UTC datetime."""
+    return calendar.timegm(timestamp.utctimetuple()) + timestamp.microsecond / 1e6
+
+
+class RateEstimator:
+    """
+    EWMA of inter-arrival time and cost per call.
+
+    Args:
+        alpha: Weight of each new observation (0-1)
+        mean_gap: Initial mean seconds between calls (None = no estimate yet)
+        mean_cost: Initial mean cost per call
+    """
+
+    __slots__ = ("alpha", "mean_gap", "mean_cost", "last")
+
+    def __init__(self, alpha: float, mean_gap: Optional[float] = None, mean_cost: float = 0.0):
+        self.alpha = alpha
+        self.mean_gap = mean_gap
+        self.mean_cost = mean_cost
+        self.last: Optional[float] = None
+
+    @classmethod
+    def from_average(cls, alpha: float, calls: int, cost: float, seconds: float) -> "RateEstimator":
+        """Estimator seeded with an average rate (`calls` costing `cost` over `seconds`)."""
+        if not calls:
+            return cls(alpha)
+        return cls(alpha, mean_gap=seconds / calls, mean_cost=cost / calls)
+
+    @classmethod
+    def from_usage(cls, usage: List[Dict[str, Any]], alpha: float = RECENT_ALPHA) -> "RateEstimator":
+        """Estimator fed with usage dicts (ISO `timestamp` and `cost`), oldest first."""
+        estimator = cls(alpha)
+        for u in sorted(usage, key=lambda u: u["timestamp"]):
+            estimator.observe(epoch_seconds(datetime.fromisoformat(u["timestamp"])), u.get("cost", 0))
+        return estimator
+
+    def observe(self, t: float, cost: float):
+        """Record a call at epoch time `t` (seconds)."""
+        if self.last is None:
+            self.mean_cost = cost if self.mean_gap is None else self.mean_cost + self.alpha * (cost - self.mean_cost)
+        else:
+            gap = max(t - self.last, MIN_GAP_SECONDS)
+            if self.mean_gap is None:
+                self.mean_gap = gap
+            else:
+                self.mean_gap += self.alpha * (gap - self.mean_gap)
+            self.mean_cost += self.alpha * (cost - self.mean_cost)
+        if self.last is None or t > self.last:
+            self.last = t
+
+    def rate(self, now: Optional[float] = None) -> float:
+        """Calls per minute."""
+        if self.mean_gap is None:
+            return 0.0
+        gap = self.mean_gap
+        if now is not None and self.last is not None:
+            gap = max(gap, now - self.last)
+        return 60.0 / gap
+
+    def cost_rate(self, now: Optional[float] = None) -> float:
+        """Cost per minute."""
+        return self.rate(now) * self.mean_cost
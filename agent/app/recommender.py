@@ -0,0 +1,316 @@
+"""
+Deterministic cost recommendations computed from usage rollups.
+
+Usage over the last RECOMMENDER_LOOKBACK_DAYS is read as totals per user and
+API: `usage_rollups` for rolled-up days, plus the same daily aggregation
+(retention.rollup_select) over raw rows for the days after them, grouped by
+`api_dim_id` with the API's names joined once per group. Three
+detectors run over each API's totals:
+
+- caching: calls that repeated an identical request the same day. Savings
+  are the repeated share of the cost.
+- batching: APIs called at least RECOMMENDER_BATCH_MIN_CALLS_PER_DAY times a
+  day with one request per call, whose catalog entry has a batch discount.
+  Savings are the discount on their cost.
+- provider_switch / model_switch: the cheapest entry of the same class in
+  the price catalog. Savings are the units used priced at the difference.
+
+Savings are projected to 30 days from the lookback period. Suggestions
+under RECOMMENDER_MIN_SAVINGS are dropped. The rest are upserted as
+Optimization rows in bulk, refreshing the estimates of ones already pending
+(see optimizations.py). The LLM can optionally rewrite the descriptions;
+the numbers never come from it.
+"""
+
+from datetime import datetime, timedelta
+from typing import Any, Dict, List, Optional, Tuple
+
+from sqlalchemy import select, func, and_
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from .database import ApiDimension, UsageRollup
+from .optimizations import upsert_optimizations
+from .pricing import PriceCatalog, get_price_catalog
+from .money import from_micros
+from .retention import rollup_select
+from .config import settings
+from .logs import get_logger
+
+log = get_logger("recommender")
+
+ProfileKey = Tuple[str, str, str]  # (user_address, provider, api_id)
+
+
+class ApiProfile:
+    """Usage totals of one user's API over the lookback period."""
+
+    __slots__ = ("user_address", "provider", "api_id", "api_name", "calls", "request_count",
+                 "tokens_used", "cost_micros", "repeat_calls", "days")
+
+    def __init__(self, user_address: str, provider: str, api_id: str, api_name: str):
+        self.user_address = user_address
+        self.provider = provider
+        self.api_id = api_id
+        self.api_name = api_name
+        self.calls = 0
+        self.request_count = 0
+        self.tokens_used = 0
+        self.cost_micros = 0
+        self.repeat_calls = 0
+        self.days = 0
+
+    def add(self, calls: int, request_count: int, tokens_used: int, cost_micros: int, repeat_calls: int, days: int):
+        self.calls += calls or 0
+        self.request_count += request_count or 0
+        self.tokens_used += tokens_used or 0
+        self.cost_micros += cost_micros or 0
+        self.repeat_calls += repeat_calls or 0
+        self.days += days or 0
+
+    @property
+    def cost(self) -> float:
+        return from_micros(self.cost_micros)
+
+    @property
+    def label(self) -> str:
+        return f"{self.provider}:{self.api_name}"
+
+
+def _labelled(totals):
+    """Per-API totals with the API's names joined from api_dimensions."""
+    totals = totals.subquery()
+    return select(
+        totals.c.user_address,
+        ApiDimension.provider,
+        ApiDimension.api_id,
+        ApiDimension.api_name,
+        totals.c.calls,
+        totals.c.request_count,
+        totals.c.tokens_used,
+        totals.c.cost_micros,
+        totals.c.repeat_calls,
+        totals.c.days
+    ).join(ApiDimension, ApiDimension.id == totals.c.api_dim_id)
+
+
+async def load_profiles(
+    db: AsyncSession,
+    user_addresses: Optional[List[str]] = None,
+    now: Optional[datetime] = None,
+    days: Optional[int] = None
+) -> Dict[ProfileKey, ApiProfile]:
+    """
+    Per-API usage totals over the lookback period, from rollups plus raw rows not yet rolled up.
+
+    Args:
+        db: Database session (one shard)
+        user_addresses: Users to load (default: all users on the shard)
+        now: End of the period (default: now, UTC)
+        days: Lookback in days (default: RECOMMENDER_LOOKBACK_DAYS)
+    """
+    now = now or datetime.utcnow()
+    since = (now - timedelta(days=days or settings.RECOMMENDER_LOOKBACK_DAYS)).replace(
+        hour=0, minute=0, second=0, microsecond=0
+    )
+
+    # Rollups cover every user of a day at once, so raw rows are read from the day after the last one
+    last_day = (await db.execute(select(func.max(UsageRollup.day)))).scalar()
+    conditions = [UsageRollup.day >= since]
+    if user_addresses is not None:
+        conditions.append(UsageRollup.user_address.in_(user_addresses))
+    raw_since = max(since, last_day + timedelta(days=1)) if last_day is not None else since
+
+    rolled = select(
+        UsageRollup.user_address,
+        UsageRollup.api_dim_id,
+        func.sum(UsageRollup.calls).label("calls"),
+        func.sum(UsageRollup.request_count).label("request_count"),
+        func.sum(UsageRollup.tokens_used).label("tokens_used"),
+        func.sum(UsageRollup.cost_micros).label("cost_micros"),
+        func.sum(func.coalesce(UsageRollup.repeat_calls, 0)).label("repeat_calls"),
+        func.count(UsageRollup.day).label("days")
+    ).where(and_(*conditions)).group_by(UsageRollup.user_address, UsageRollup.api_dim_id)
+
+    daily = rollup_select(raw_since, now, user_addresses).subquery()
+    raw = select(
+        daily.c.user_address,
+        daily.c.api_dim_id,
+        func.sum(daily.c.calls).label("calls"),
+        func.sum(daily.c.request_count).label("request_count"),
+        func.sum(daily.c.tokens_used).label("tokens_used"),
+        func.sum(daily.c.cost_micros).label("cost_micros"),
+        func.sum(daily.c.repeat_calls).label("repeat_calls"),
+        func.count(daily.c.day).label("days")
+    ).group_by(daily.c.user_address, daily.c.api_dim_id)
+
+    profiles: Dict[ProfileKey, ApiProfile] = {}
+    for stmt in (_labelled(rolled), _labelled(raw)):
+        for user_address, provider, api_id, api_name, *totals in (await db.execute(stmt)).all():
+            key = (user_address, provider, api_id)
+            profile = profiles.get(key)
+            if profile is None:
+                profile = profiles[key] = ApiProfile(user_address, provider, api_id, api_name)
+            profile.add(*totals)
+    return profiles
+
+
+def _units(profile: ApiProfile, unit: str) -> float:
+    """Usage of an API in catalog units."""
+    return profile.tokens_used / 1000 if unit == "1k_tokens" else float(profile.request_count)
+
+
+def recommend(
+    profiles: Dict[ProfileKey, ApiProfile],
+    catalog: Optional[PriceCatalog] = None,
+    days: Optional[int] = None
+) -> Dict[str, List[Dict[str, Any]]]:
+    """
+    Recommendations per user, highest estimated monthly savings first.
+
+    Each recommendation has the shape the LLM analysis uses (type,
+    current_api, suggested_api, description, estimated_monthly_savings,
+    implementation_difficulty, priority) plus the `evidence` behind it.
+    """
+    catalog = catalog or get_price_catalog()
+    days = days or settings.RECOMMENDER_LOOKBACK_DAYS
+    monthly = 30.0 / days
+    min_savings = settings.RECOMMENDER_MIN_SAVINGS
+
+    user_spend: Dict[str, float] = {}
+    for profile in profiles.values():
+        user_spend[profile.user_address] = user_spend.get(profile.user_address, 0.0) + profile.cost * monthly
+
+    results: Dict[str, List[Dict[str, Any]]] = {}
+
+    def suggest(profile: ApiProfile, rec_type: str, suggested_api: Optional[str], savings: float,
+                description: str, difficulty: str, evidence: Dict[str, Any]):
+        savings = round(savings, 2)
+        if savings < min_savings:
+            return
+        share = savings / user_spend[profile.user_address] if user_spend[profile.user_address] else 0.0
+        results.setdefault(profile.user_address, []).append({
+            "type": rec_type,
+            "current_api": profile.label,
+            "suggested_api": suggested_api,
+            "description": description,
+            "estimated_monthly_savings": savings,
+            "implementation_difficulty": difficulty,
+            "priority": "high" if share >= 0.1 else "medium" if share >= 0.02 else "low",
+            "source": "recommender",
+            "evidence": evidence
+        })
+
+    for profile in profiles.values():
+        if profile.calls == 0 or profile.cost <= 0:
+            continue
+        monthly_cost = profile.cost * monthly
+        entry = catalog.lookup(profile.provider, profile.api_name)
+
+        # Caching: repeated identical requests
+        repeat_ratio = profile.repeat_calls / profile.calls
+        if repeat_ratio >= settings.RECOMMENDER_MIN_REPEAT_RATIO:
+            suggest(
+                profile, "caching", None, monthly_cost * repeat_ratio,
+                f"{repeat_ratio:.0%} of {profile.label} calls repeat an identical request made earlier "
+                f"the same day. Caching responses would avoid them.",
+                "easy",
+                {
+                    "calls": profile.calls,
+                    "repeat_calls": profile.repeat_calls,
+                    "monthly_cost": round(monthly_cost, 4)
+                }
+            )
+
+        # Batching: frequent single-request calls to an API with a batch discount
+        calls_per_day = profile.calls / max(profile.days, 1)
+        if (
+            entry is not None
+            and entry.batch_discount > 0
+            and profile.request_count <= profile.calls
+            and calls_per_day >= settings.RECOMMENDER_BATCH_MIN_CALLS_PER_DAY
+        ):
+            batchable_cost = monthly_cost * (1 - repeat_ratio)  # Repeats are counted under caching
+            suggest(
+                profile, "batching", f"{profile.label} (batch)", batchable_cost * entry.batch_discount,
+                f"{profile.label} is called {calls_per_day:.0f} times a day, one request per call. "
+                f"Its batch interface costs {entry.batch_discount:.0%} less for requests that can wait.",
+                "medium",
+                {
+                    "calls_per_day": round(calls_per_day, 1),
+                    "batch_discount": entry.batch_discount,
+                    "monthly_cost": round(monthly_cost, 4)
+                }
+            )
+
+        # Cheaper provider or model of the same class
+        if entry is not None:
+            units = _units(profile, entry.unit) * monthly
+            alternatives = catalog.alternatives(entry)
+            if units > 0 and alternatives:
+                cheapest = alternatives[0]
+                alt_cost = units * cheapest.price
+                rec_type = "model_switch" if cheapest.provider == entry.provider else "provider_switch"
+                suggest(
+                    profile, rec_type, cheapest.label, monthly_cost - alt_cost,
+                    f"{cheapest.label} is in the same class ({entry.api_class}) as {profile.label} and lists "
+                    f"at {cheapest.price:g} per {entry.unit.replace('_', ' ')}. Your usage would cost about "
+                    f"{alt_cost:.2f} a month instead of {monthly_cost:.2f}.",
+                    "medium" if rec_type == "model_switch" else "hard",
+                    {
+                        "monthly_units": round(units, 2),
+                        "unit": entry.unit,
+                        "current_unit_price": round(monthly_cost / units, 6),
+                        "suggested_unit_price": cheapest.price,
+                        "monthly_cost": round(monthly_cost, 4)
+                    }
+                )
+
+    for recs in results.values():
+        recs.sort(key=lambda r: r["estimated_monthly_savings"], reverse=True)
+    return results
+
+
+async def save_recommendations(
+    db: AsyncSession,
+    recommendations: Dict[str, List[Dict[str, Any]]]
+) -> Tuple[int, int]:
+    """
+    Upsert recommendations as Optimization rows (see optimizations.py).
+
+    A suggestion with the same type, current API and suggested API as a
+    pending optimization of the user refreshes it instead of adding a row.
+
+    Returns:
+        (optimizations created, pending optimizations refreshed)
+    """
+    counts = await upsert_optimizations(db, (
+        {
+            "user_address": user_address,
+            "optimization_type": rec["type"],
+            "current_api": rec["current_api"],
+            "suggested_api": rec["suggested_api"],
+            "estimated_savings": rec["estimated_monthly_savings"],
+            "description": rec["description"],
+            "extra_data": rec
+        }
+        for user_address, recs in recommendations.items()
+        for rec in recs
+    ))
+    await db.commit()
+    return counts
+
+
+async def run_recommender(phrase: bool = False) -> List[Dict[str, Any]]:
+    """Compute and store recommendations for every user on the local shards."""
+    from .guardian_service import BudgetGuardianService
+    from .sharding import get_shard_router
+
+    async def run(db: AsyncSession, shard) -> Dict[str, Any]:
+        result = await BudgetGuardianService(db).recommend_optimizations(None, phrase)
+        log.info(
+            "recommender_completed",
+            shard=shard.index, users=result["users"], created=result["created"], refreshed=result["refreshed"]
+        )
+        return {"shard": shard.index, "users": result["users"], "created": result["created"], "refreshed": result["refreshed"]}
+
+    return await get_shard_router().fan_out(run)
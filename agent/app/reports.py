@@ -0,0 +1,261 @@
+"""
+Monthly reports for every budget, computed in batches.
+
+A report per user used to take five queries (config, usage, alerts,
+optimizations, insert). At month close, every BudgetConfig gets its report
+from a few grouped queries per chunk of REPORT_CHUNK_USERS users instead:
+
+- spend per (user, API): `usage_rollups` for rolled-up days plus raw rows
+  after them, grouped by `api_dim_id` (names are looked up once per API)
+- alert counts per user
+- applied optimizations and their savings per user
+
+A chunk's reports replace any earlier ones for the same month (e.g. an
+on-demand report from mid-month) and are written in one bulk insert.
+Chunks from all local shards are handed to REPORT_WORKERS workers, and
+progress (users done out of total) is logged and can be polled while a run
+is in progress.
+"""
+
+import asyncio
+import time
+from collections import defaultdict
+from datetime import datetime, timedelta
+from typing import Any, Callable, Dict, List, Optional, Sequence, Tuple
+
+from sqlalchemy import select, func, and_, delete, insert
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from .database import BudgetConfig, BudgetAlert, Optimization, UsageRollup, ApiUsage, MonthlyReport
+from .dimensions import shard_dimensions
+from .forecast import next_month
+from .money import from_micros
+from .sharding import Shard, get_shard_router
+from .config import settings
+from .logs import get_logger
+
+log = get_logger("reports")
+
+Budget = Tuple[str, int]  # (user_address, monthly_limit_micros)
+
+
+def month_range(month: Optional[str] = None) -> Tuple[str, datetime, datetime]:
+    """("YYYY-MM", start, end) of a month (default: the current one)."""
+    if month:
+        try:
+            start = datetime.strptime(month, "%Y-%m")
+        except ValueError:
+            raise ValueError(f"Invalid month {month!r} (expected YYYY-MM)")
+    else:
+        start = datetime.utcnow().replace(day=1, hour=0, minute=0, second=0, microsecond=0)
+    return start.strftime("%Y-%m"), start, next_month(start)
+
+
+async def _spend_by_api(
+    db: AsyncSession,
+    shard: Shard,
+    users: Sequence[str],
+    start: datetime,
+    end: datetime
+) -> Dict[str, Dict[str, int]]:
+    """Spend in micro-units per user and "provider:api_name" over [start, end)."""
+    # Rollups cover every user of a day at once, so raw rows are read from the day after the last one
+    last_day = (await db.execute(select(func.max(UsageRollup.day)))).scalar()
+    raw_since = max(start, last_day + timedelta(days=1)) if last_day is not None else start
+
+    rolled = select(
+        UsageRollup.user_address, UsageRollup.api_dim_id, func.sum(UsageRollup.cost_micros)
+    ).where(
+        and_(UsageRollup.user_address.in_(users), UsageRollup.day >= start, UsageRollup.day < end)
+    ).group_by(UsageRollup.user_address, UsageRollup.api_dim_id)
+    raw = select(
+        ApiUsage.user_address, ApiUsage.api_dim_id, func.sum(ApiUsage.cost_micros)
+    ).where(
+        and_(ApiUsage.user_address.in_(users), ApiUsage.timestamp >= raw_since, ApiUsage.timestamp < end)
+    ).group_by(ApiUsage.user_address, ApiUsage.api_dim_id)
+
+    totals: Dict[Tuple[str, int], int] = defaultdict(int)
+    for stmt in ((rolled, raw) if raw_since < end else (rolled,)):
+        for user_address, dim_id, cost_micros in (await db.execute(stmt)).all():
+            totals[(user_address, dim_id)] += cost_micros or 0
+
+    labels = await shard_dimensions(shard).labels(db, {dim_id for _, dim_id in totals})
+    spend: Dict[str, Dict[str, int]] = defaultdict(lambda: defaultdict(int))
+    for (user_address, dim_id), cost_micros in totals.items():
+        provider, _, api_name = labels[dim_id]
+        spend[user_address][f"{provider}:{api_name}"] += cost_micros
+    return spend
+
+
+async def build_reports(
+    db: AsyncSession,
+    shard: Shard,
+    budgets: Sequence[Budget],
+    month: str,
+    start: datetime,
+    end: datetime
+) -> List[Dict[str, Any]]:
+    """
+    monthly_reports rows for a chunk of users (not written).
+
+    Args:
+        db: Session of the users' shard
+        shard: The users' shard
+        budgets: (user_address, monthly_limit_micros) per user
+        month: "YYYY-MM"
+        start: Start of the month
+        end: Start of the next month
+    """
+    users = [user_address for user_address, _ in budgets]
+    spend = await _spend_by_api(db, shard, users, start, end)
+
+    alerts_stmt = select(BudgetAlert.user_address, func.count(BudgetAlert.id)).where(
+        and_(BudgetAlert.user_address.in_(users), BudgetAlert.created_at >= start, BudgetAlert.created_at < end)
+    ).group_by(BudgetAlert.user_address)
+    alerts = dict((await db.execute(alerts_stmt)).all())
+
+    opt_stmt = select(
+        Optimization.user_address, func.count(Optimization.id), func.sum(Optimization.estimated_savings)
+    ).where(
+        and_(
+            Optimization.user_address.in_(users),
+            Optimization.is_applied == True,
+            Optimization.applied_at >= start,
+            Optimization.applied_at < end
+        )
+    ).group_by(Optimization.user_address)
+    optimizations = {user_address: (count, saved) for user_address, count, saved in (await db.execute(opt_stmt)).all()}
+
+    created_at = datetime.utcnow()
+    rows = []
+    for user_address, limit_micros in budgets:
+        by_api = spend.get(user_address, {})
+        total_spent = from_micros(sum(by_api.values()))
+        applied, saved = optimizations.get(user_address, (0, None))
+        rows.append({
+            "user_address": user_address,
+            "month": month,
+            "total_spent": total_spent,
+            "budget_limit": from_micros(limit_micros),
+            "api_breakdown": {key: from_micros(cost_micros) for key, cost_micros in by_api.items()},
+            "alerts_triggered": alerts.get(user_address, 0),
+            "optimizations_applied": applied,
+            "cost_saved": saved or 0,
+            "projected_cost_without_guardian": total_spent + (saved or 0),
+            "created_at": created_at
+        })
+    return rows
+
+
+async def save_reports(db: AsyncSession, rows: Sequence[Dict[str, Any]]):
+    """Replace the reports of the rows' users and month with the rows (one transaction)."""
+    if not rows:
+        return
+    await db.execute(delete(MonthlyReport).where(
+        and_(
+            MonthlyReport.month == rows[0]["month"],
+            MonthlyReport.user_address.in_([row["user_address"] for row in rows])
+        )
+    ))
+    await db.execute(insert(MonthlyReport), list(rows))
+    await db.commit()
+
+
+class ReportProgress:
+    """Progress of a batch report run (users done out of total)."""
+
+    def __init__(self, month: str):
+        self.month = month
+        self.total = 0
+        self.done = 0
+        self.failed = 0
+        self.started_at = time.time()
+        self.finished_at: Optional[float] = None
+
+    @property
+    def running(self) -> bool:
+        return self.finished_at is None
+
+    def snapshot(self) -> Dict[str, Any]:
+        elapsed = (self.finished_at or time.time()) - self.started_at
+        return {
+            "month": self.month,
+            "total": self.total,
+            "done": self.done,
+            "failed": self.failed,
+            "running": self.running,
+            "elapsed_s": round(elapsed, 3),
+            "users_per_s": round(self.done / elapsed, 1) if elapsed > 0 else None
+        }
+
+
+_progress: Optional[ReportProgress] = None
+
+
+def get_report_progress() -> Optional[ReportProgress]:
+    """Progress of the current (or last) batch report run in this process."""
+    return _progress
+
+
+async def run_monthly_reports(
+    month: Optional[str] = None,
+    workers: Optional[int] = None,
+    chunk_size: Optional[int] = None,
+    on_progress: Optional[Callable[[ReportProgress], None]] = None
+) -> Dict[str, Any]:
+    """
+    Generate the month's report for every budget on the local shards.
+
+    Args:
+        month: "YYYY-MM" (default: the current month, to date)
+        workers: Concurrent chunks (default: REPORT_WORKERS)
+        chunk_size: Users per chunk (default: REPORT_CHUNK_USERS)
+        on_progress: Called after each chunk
+
+    Returns:
+        Final progress snapshot with per-shard report counts
+    """
+    global _progress
+    month, start, end = month_range(month)
+    progress = _progress = ReportProgress(month)
+    chunk_size = chunk_size or settings.REPORT_CHUNK_USERS
+
+    queue: "asyncio.Queue[Tuple[Shard, List[Budget]]]" = asyncio.Queue()
+    shard_reports: Dict[int, int] = {}
+
+    async def worker():
+        while not queue.empty():
+            shard, budgets = queue.get_nowait()
+            try:
+                async with shard.session_maker() as db:
+                    rows = await build_reports(db, shard, budgets, month, start, end)
+                    await save_reports(db, rows)
+                shard_reports[shard.index] += len(rows)
+                progress.done += len(rows)
+            except Exception as e:
+                progress.failed += len(budgets)
+                log.error("reports_chunk_failed", shard=shard.index, users=len(budgets), error=str(e))
+            log.info("reports_progress", month=month, done=progress.done, total=progress.total)
+            if on_progress is not None:
+                on_progress(progress)
+
+    try:
+        for shard in get_shard_router().local_shards:
+            async with shard.session_maker() as db:
+                budgets = (await db.execute(
+                    select(BudgetConfig.user_address, BudgetConfig.monthly_limit_micros).order_by(
+                        BudgetConfig.user_address
+                    )
+                )).all()
+            shard_reports[shard.index] = 0
+            progress.total += len(budgets)
+            for i in range(0, len(budgets), chunk_size):
+                queue.put_nowait((shard, [tuple(b) for b in budgets[i:i + chunk_size]]))
+        log.info("reports_started", month=month, users=progress.total, chunks=queue.qsize())
+        await asyncio.gather(*(worker() for _ in range(workers or settings.REPORT_WORKERS)))
+    finally:
+        progress.finished_at = time.time()
+    result = progress.snapshot()
+    result["shards"] = [{"shard": index, "reports": count} for index, count in shard_reports.items()]
+    log.info("reports_completed", **{k: v for k, v in result.items() if k != "shards"})
+    return result
@@ -0,0 +1,52 @@
+"""
+JSON responses for rows read straight from the database.
+
+List endpoints used to load ORM objects, validate each one into its
+response model, and then have FastAPI validate the list again against
+`response_model` before encoding it. Rows of our own tables already have
+the response's shape and types, so these endpoints select the response
+model's columns as plain mappings and return them in a RowsResponse, which
+FastAPI sends as-is (`response_model` stays on the route for the OpenAPI
+schema). Encoding uses orjson when it is installed and the standard json
+module otherwise; both write datetimes as ISO 8601, like Pydantic.
+"""
+
+import json
+from datetime import date, datetime
+from typing import Any, Dict, List, Type
+
+from fastapi.responses import Response
+from pydantic import BaseModel
+from sqlalchemy.ext.asyncio import AsyncSession
+
+try:
+    import orjson
+except ImportError:  # Optional: pip install orjson
+    orjson = None
+
+
+def _default(value: Any) -> Any:
+    if isinstance(value, (datetime, date)):
+        return value.isoformat()
+    raise TypeError(f"Object of type {type(value).__name__} is not JSON serializable")
+
+
+class RowsResponse(Response):
+    """JSON response for trusted, already-shaped content (no validation)."""
+
+    media_type = "application/json"
+
+    def render(self, content: Any) -> bytes:
+        if orjson is not None:
+            return orjson.dumps(content, option=orjson.OPT_NON_STR_KEYS)
+        return json.dumps(content, default=_default, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+
+
+def columns_for(model, schema: Type[BaseModel]) -> List[Any]:
+    """The columns of an ORM model named by a response schema's fields, in field order."""
+    return [getattr(model, name) for name in schema.model_fields]
+
+
+async def fetch_rows(db: AsyncSession, stmt) -> List[Dict[str, Any]]:
+    """Rows of a Core select as dicts (no ORM objects or identity map)."""
+    return [dict(row) for row in (await db.execute(stmt)).mappings()]
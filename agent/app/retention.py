@@ -0,0 +1,382 @@
+"""
+Retention for the api_usage table: daily rollups and compressed archives.
+
+1. Rollup: completed days are aggregated into `usage_rollups` (per user
+   and `api_dim_id`, see dimensions), including how many calls repeated an identical
+   request (see `request_fingerprint`). Rows committed for a day after it
+   was rolled up are caught by comparing row counts (`reconcile_rollups`).
+2. Archive: raw rows older than USAGE_RETENTION_DAYS whose day has a rollup
+   (reconciled first) are written to a compressed NDJSON file under
+   ARCHIVE_DIR, one file per month per run, ARCHIVE_CHUNK rows at a time.
+   zstd is used when `zstandard` is installed, gzip otherwise. Each file is
+   recorded in `usage_archives`, and its rows are deleted from the hot table
+   in the same transaction.
+3. Read: `read_archived_usage` returns archived rows for a time range.
+
+Only readers that can look past the retention cutoff merge archives:
+analytics.fetch_usage_columns (analysis windows) and backtest.load_series
+(replays). Reports and recommendations read `usage_rollups`, which are never
+archived. Budget status, ledgers, rule counters, admission and the rate
+windows read at most the current month and the week before it.
+
+Each row lives either in the hot table or in one committed archive, never
+both. A file whose manifest row was never committed is ignored by readers.
+Rows from the current month (and the week before it) are never archived,
+so budget checks, rule counters and the rate baseline only read the hot table.
+"""
+
+import asyncio
+import gzip
+import json
+import os
+import uuid
+from datetime import datetime, timedelta
+from typing import Dict, Any, Iterator, List, Optional
+
+from sqlalchemy import select, delete, func, and_, cast, String, Select
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from .database import ApiUsage, ApiDimension, UsageRollup, UsageArchive
+from .money import to_micros
+from .config import settings
+from .logs import get_logger
+
+try:
+    import zstandard
+except ImportError:  # Optional: pip install zstandard
+    zstandard = None
+
+log = get_logger("retention")
+
+ARCHIVE_FIELDS = (
+    "id", "user_address", "api_id", "api_name", "provider", "api_dim_id", "cost", "cost_micros",
+    "request_count", "tokens_used", "endpoint", "status", "extra_data", "idempotency_key", "timestamp"
+)
+
+# Rows read, written and deleted per step when archiving
+ARCHIVE_CHUNK = 5000
+
+
+def retention_cutoff(now: Optional[datetime] = None) -> datetime:
+    """Rows older than this may be archived."""
+    now = now or datetime.utcnow()
+    month_start = now.replace(day=1, hour=0, minute=0, second=0, microsecond=0)
+    cutoff = now - timedelta(days=settings.USAGE_RETENTION_DAYS)
+    return min(cutoff, month_start - timedelta(days=7)).replace(hour=0, minute=0, second=0, microsecond=0)
+
+
+def request_fingerprint():
+    """
+    SQL expression identifying identical requests.
+
+    The `request_hash` from the usage metadata when the caller sends one,
+    otherwise endpoint, tokens and cost. NULL for rows with neither, so they
+    never count as repeats.
+    """
+    signature = (
+        ApiUsage.endpoint + "|"
+        + func.coalesce(cast(ApiUsage.tokens_used, String), "") + "|"
+        + cast(ApiUsage.cost_micros, String)
+    )
+    return func.coalesce(ApiUsage.extra_data["request_hash"].as_string(), signature)
+
+
+def rollup_select(start: datetime, until: datetime, user_addresses: Optional[List[str]] = None) -> Select:
+    """
+    Daily aggregates of raw usage in [start, until) per user and API (`api_dim_id`).
+
+    Columns: user_address, day, api_dim_id, calls, request_count,
+    tokens_used, cost_micros, repeat_calls.
+    """
+    day = func.date(ApiUsage.timestamp)
+    fingerprint = request_fingerprint()
+    conditions = [ApiUsage.timestamp >= start, ApiUsage.timestamp < until]
+    if user_addresses is not None:
+        conditions.append(ApiUsage.user_address.in_(user_addresses))
+    return select(
+        ApiUsage.user_address,
+        day.label("day"),
+        ApiUsage.api_dim_id,
+        func.count(ApiUsage.id).label("calls"),
+        func.sum(func.coalesce(ApiUsage.request_count, 1)).label("request_count"),
+        func.sum(func.coalesce(ApiUsage.tokens_used, 0)).label("tokens_used"),
+        func.sum(ApiUsage.cost_micros).label("cost_micros"),
+        (func.count(fingerprint) - func.count(fingerprint.distinct())).label("repeat_calls")
+    ).where(and_(*conditions)).group_by(ApiUsage.user_address, day, ApiUsage.api_dim_id)
+
+
+def _open_archive(path: str, mode: str):
+    """Open an archive file for text reading ("r") or writing ("w")."""
+    if path.endswith(".zst"):
+        if zstandard is None:
+            raise RuntimeError(f"zstandard is required to read {path}")
+        cctx = zstandard.ZstdCompressor(level=10) if mode == "w" else None
+        return zstandard.open(path, mode + "t", cctx=cctx, encoding="utf-8")
+    return gzip.open(path, mode + "t", encoding="utf-8")
+
+
+def _archive_dir(shard_index: int) -> str:
+    return os.path.join(settings.ARCHIVE_DIR, f"shard-{shard_index}")
+
+
+def _rollups(rows) -> List[UsageRollup]:
+    """UsageRollup objects for `rollup_select` rows."""
+    return [
+        UsageRollup(
+            user_address=user_address,
+            day=datetime.fromisoformat(str(day_value)),
+            api_dim_id=api_dim_id,
+            calls=calls,
+            request_count=request_count,
+            tokens_used=tokens_used,
+            cost_micros=cost_micros,
+            repeat_calls=repeat_calls
+        )
+        for (user_address, day_value, api_dim_id,
+             calls, request_count, tokens_used, cost_micros, repeat_calls) in rows
+    ]
+
+
+async def reconcile_rollups(db: AsyncSession, start: Optional[datetime], until: datetime) -> int:
+    """
+    Rebuild the rollups of days that gained raw rows after they were rolled up.
+
+    Rollups resume after the last rolled-up day, so a row committed later
+    for an earlier day (a batch timestamped just before midnight and
+    committed after the rollup ran, or an ingest log replayed after a crash)
+    would otherwise never be counted, and archiving would delete it. Each
+    (user, day) in [start, until) with more raw rows than its rollups'
+    `calls` has its rollups replaced from the raw rows. Days are archived
+    whole, so a day still in the hot table has all of its rows.
+
+    Args:
+        db: Database session (one shard)
+        start: First day to check (None = the oldest raw row)
+        until: Exclusive end day, at most the day after the last rollup
+
+    Returns:
+        Number of rollup rows written (not committed)
+    """
+    raw_day = func.date(ApiUsage.timestamp)
+    conditions = [ApiUsage.timestamp < until]
+    rollup_conditions = [UsageRollup.day < until]
+    if start is not None:
+        conditions.append(ApiUsage.timestamp >= start)
+        rollup_conditions.append(UsageRollup.day >= start)
+    raw = select(
+        ApiUsage.user_address, raw_day.label("day"), func.count(ApiUsage.id).label("calls")
+    ).where(and_(*conditions)).group_by(ApiUsage.user_address, raw_day).subquery()
+    rolled = select(
+        UsageRollup.user_address, func.date(UsageRollup.day).label("day"), func.sum(UsageRollup.calls).label("calls")
+    ).where(and_(*rollup_conditions)).group_by(UsageRollup.user_address, UsageRollup.day).subquery()
+    stale = select(raw.c.user_address, raw.c.day).outerjoin(
+        rolled, and_(rolled.c.user_address == raw.c.user_address, rolled.c.day == raw.c.day)
+    ).where(rolled.c.calls.is_(None) | (raw.c.calls > rolled.c.calls))
+
+    users_by_day: Dict[datetime, List[str]] = {}
+    for user_address, day_value in (await db.execute(stale)).all():
+        users_by_day.setdefault(datetime.fromisoformat(str(day_value)), []).append(user_address)
+
+    written = 0
+    for day, users in users_by_day.items():
+        await db.execute(delete(UsageRollup).where(
+            and_(UsageRollup.day == day, UsageRollup.user_address.in_(users))
+        ))
+        rollups = _rollups((await db.execute(rollup_select(day, day + timedelta(days=1), users))).all())
+        db.add_all(rollups)
+        written += len(rollups)
+    if users_by_day:
+        log.info("rollups_reconciled", days=len(users_by_day), users=sum(map(len, users_by_day.values())), rows=written)
+    return written
+
+
+async def rollup_usage(db: AsyncSession, until: Optional[datetime] = None) -> int:
+    """
+    Aggregate completed days that have no rollups yet, and rebuild rolled-up
+    days that gained rows since (except those archive_usage is about to
+    reconcile and archive).
+
+    Args:
+        db: Database session (one shard)
+        until: Exclusive end day (default: today, UTC)
+
+    Returns:
+        Number of rollup rows written
+    """
+    until = (until or datetime.utcnow()).replace(hour=0, minute=0, second=0, microsecond=0)
+    last_day = (await db.execute(select(func.max(UsageRollup.day)))).scalar()
+    written = 0
+    if last_day is None:
+        first = (await db.execute(select(func.min(ApiUsage.timestamp)))).scalar()
+        if first is None:
+            return 0
+        start = first.replace(hour=0, minute=0, second=0, microsecond=0)
+    else:
+        start = last_day + timedelta(days=1)
+        written = await reconcile_rollups(db, retention_cutoff(until), min(start, until))
+
+    if start < until:
+        rollups = _rollups((await db.execute(rollup_select(start, until))).all())
+        db.add_all(rollups)
+        written += len(rollups)
+    await db.commit()
+    return written
+
+
+async def archive_usage(db: AsyncSession, shard_index: int, now: Optional[datetime] = None) -> List[Dict[str, Any]]:
+    """
+    Move rolled-up raw rows older than the retention cutoff into archives.
+
+    Works one month at a time; each month's manifest row and deletes commit
+    together. A month is streamed in ARCHIVE_CHUNK rows, each deleted once
+    it is in the file, so memory does not grow with the month's size.
+
+    Returns:
+        One entry per archive file written (month, path, rows)
+    """
+    cutoff = retention_cutoff(now)
+    last_day = (await db.execute(select(func.max(UsageRollup.day)))).scalar()
+    if last_day is None:
+        return []
+    cutoff = min(cutoff, last_day + timedelta(days=1))
+    if await reconcile_rollups(db, None, cutoff):
+        await db.commit()
+
+    directory = _archive_dir(shard_index)
+    suffix = ".ndjson.zst" if zstandard is not None else ".ndjson.gz"
+    # Archives keep the API's names, so they can be read without api_dimensions
+    columns = [
+        getattr(ApiDimension if field in ("provider", "api_id", "api_name") else ApiUsage, field)
+        for field in ARCHIVE_FIELDS
+    ]
+
+    written = []
+    while True:
+        oldest = (await db.execute(
+            select(func.min(ApiUsage.timestamp)).where(ApiUsage.timestamp < cutoff)
+        )).scalar()
+        if oldest is None:
+            break
+        month_start = oldest.replace(day=1, hour=0, minute=0, second=0, microsecond=0)
+        next_month = (month_start + timedelta(days=32)).replace(day=1)
+        month_end = min(next_month, cutoff)
+        month = month_start.strftime("%Y-%m")
+
+        stmt = select(*columns).select_from(ApiUsage).join(
+            ApiDimension, ApiDimension.id == ApiUsage.api_dim_id
+        ).where(
+            and_(
+                ApiUsage.timestamp >= month_start,
+                ApiUsage.timestamp < month_end
+            )
+        ).order_by(ApiUsage.timestamp, ApiUsage.id).limit(ARCHIVE_CHUNK)
+
+        os.makedirs(directory, exist_ok=True)
+        name = f"usage-{month}-{uuid.uuid4().hex[:8]}{suffix}"
+        path = os.path.join(directory, name)
+        tmp_path = os.path.join(directory, f".tmp-{name}")
+        rows, min_timestamp, max_timestamp = 0, None, None
+        with _open_archive(tmp_path, "w") as f:
+            while True:
+                # Rows already written are deleted, so each chunk starts after the last
+                chunk = (await db.execute(stmt)).all()
+                if not chunk:
+                    break
+                for row in chunk:
+                    record = dict(zip(ARCHIVE_FIELDS, row))
+                    record["timestamp"] = row.timestamp.isoformat()
+                    f.write(json.dumps(record) + "\n")
+                await db.execute(delete(ApiUsage).where(ApiUsage.id.in_([row.id for row in chunk])))
+                rows += len(chunk)
+                min_timestamp = min_timestamp or chunk[0].timestamp
+                max_timestamp = chunk[-1].timestamp
+        os.replace(tmp_path, path)
+
+        db.add(UsageArchive(
+            month=month,
+            path=path,
+            rows=rows,
+            min_timestamp=min_timestamp,
+            max_timestamp=max_timestamp
+        ))
+        await db.commit()
+        written.append({"month": month, "path": path, "rows": rows})
+
+    return written
+
+
+def _iter_archive(path: str) -> Iterator[Dict[str, Any]]:
+    with _open_archive(path, "r") as f:
+        for line in f:
+            if line.strip():
+                record = json.loads(line)
+                if record.get("cost_micros") is None:  # Archived before costs were kept in micro-units
+                    record["cost_micros"] = to_micros(record["cost"])
+                yield record
+
+
+async def read_archived_usage(
+    db: AsyncSession,
+    user_address: Optional[str],
+    since: datetime,
+    until: Optional[datetime] = None
+) -> List[Dict[str, Any]]:
+    """
+    Archived usage rows for a user (None = all users) in [since, until), as dicts (ISO timestamps).
+
+    Only archives overlapping the range are opened, and each is scanned in
+    full. Archives are not indexed by user: their readers (see the module
+    docstring) are analysis windows and backtests, which are rare and
+    already scan their range, so the files are kept one per month.
+    """
+    conditions = [UsageArchive.max_timestamp >= since]
+    if until is not None:
+        conditions.append(UsageArchive.min_timestamp < until)
+    stmt = select(UsageArchive.path).where(and_(*conditions)).order_by(UsageArchive.min_timestamp)
+    paths = (await db.execute(stmt)).scalars().all()
+    if not paths:
+        return []
+
+    since_iso = since.isoformat()
+    until_iso = until.isoformat() if until is not None else None
+
+    def scan() -> List[Dict[str, Any]]:
+        return [
+            record
+            for path in paths
+            for record in _iter_archive(path)
+            if (user_address is None or record["user_address"] == user_address)
+            and record["timestamp"] >= since_iso
+            and (until_iso is None or record["timestamp"] < until_iso)
+        ]
+
+    return await asyncio.to_thread(scan)
+
+
+async def run_retention(now: Optional[datetime] = None) -> List[Dict[str, Any]]:
+    """Roll up and archive usage on every local shard."""
+    from .sharding import get_shard_router
+
+    results = []
+    for shard in get_shard_router().local_shards:
+        async with shard.session_maker() as db:
+            rollups = await rollup_usage(db, until=now)
+            archives = await archive_usage(db, shard.index, now)
+        results.append({
+            "shard": shard.index,
+            "rollup_rows": rollups,
+            "archived_rows": sum(a["rows"] for a in archives),
+            "archives": archives
+        })
+        log.info("retention_completed", shard=shard.index, rollup_rows=rollups, archived_rows=results[-1]["archived_rows"])
+    return results
+
+
+async def retention_loop():
+    """Run retention every USAGE_RETENTION_INTERVAL_HOURS (started by the app if enabled)."""
+    while True:
+        await asyncio.sleep(settings.USAGE_RETENTION_INTERVAL_HOURS * 3600)
+        try:
+            await run_retention()
+        except Exception:
+            log.exception("retention_failed")
@@ -32,6 +32,32 @@ class BudgetConfigResponse(BaseModel):
         from_attributes = True
 
 
+class BudgetRuleCreate(BaseModel):
+    """Create a budget rule (sub-limit)."""
+    user_address: str
+    scope: str = Field(default="user", pattern="^(user|provider|api)$")
+    scope_value: Optional[str] = None  # provider name or api_id
+    window: str = Field(default="day", pattern="^(hour|day|month)$")
+    limit_amount: float = Field(gt=0)
+
+
+class BudgetRuleResponse(BaseModel):
+    """Budget rule with spend in its current window."""
+    id: int
+    user_address: str
+    scope: str
+    scope_value: Optional[str]
+    window: str
+    limit_amount: float
+    is_active: bool
+    created_at: datetime
+    current_spend: float = 0.0
+    window_start: Optional[datetime] = None
+    
+    class Config:
+        from_attributes = True
+
+
 class ApiUsageCreate(BaseModel):
     """Record API usage."""
     user_address: str
@@ -44,6 +70,12 @@ class ApiUsageCreate(BaseModel):
     endpoint: Optional[str] = None
     status: str = "success"
     metadata: Optional[Dict[str, Any]] = None
+    idempotency_key: Optional[str] = None  # Transaction hash or x402 payment ID; retries with the same key are dropped
+
+
+class ApiUsageBatch(BaseModel):
+    """Record many API usage events at once."""
+    events: List[ApiUsageCreate]
 
 
 class ApiUsageResponse(BaseModel):
@@ -110,10 +142,38 @@ class BudgetStatusResponse(BaseModel):
     percentage_used: float
     days_remaining: int
     is_paused: bool
+    projected_month_spend: Optional[float] = None  # Month-end spend at the current burn rate
+    projected_exhaustion_at: Optional[datetime] = None  # When the limit is reached at that rate (None = not this month)
     recent_alerts: List[BudgetAlertResponse]
     optimizations_available: List[OptimizationResponse]
 
 
+class AdmissionRequest(BaseModel):
+    """Pre-payment admission check for one call."""
+    user_address: str
+    cost: float = Field(default=0.0, ge=0)
+    provider: Optional[str] = None
+    api_id: Optional[str] = None
+
+
+class AdmissionBatchRequest(BaseModel):
+    """Admission checks for many calls at once."""
+    requests: List[AdmissionRequest]
+
+
+class AdmissionResponse(BaseModel):
+    """Admission decision (allow or deny) for one call."""
+    user_address: str
+    allowed: Optional[bool]
+    reason: str  # ok, no_budget, paused, would_exceed, rule_exceeded, shard_not_local
+    rule_id: Optional[int] = None
+    cost: float
+    current_spend: Optional[float] = None
+    monthly_limit: Optional[float] = None
+    remaining_budget: Optional[float] = None
+    shard: Optional[int] = None
+
+
 class MonthlyReportResponse(BaseModel):
     """Monthly report response."""
     id: int
@@ -150,3 +210,20 @@ class AnalysisResponse(BaseModel):
     recommendations: List[Dict[str, Any]]
     estimated_savings: float
     summary: str
+
+
+class BacktestPolicy(BaseModel):
+    """Alert and anomaly settings to replay (unset fields keep the current values)."""
+    name: str = "current"
+    warning_threshold: Optional[float] = Field(default=None, gt=0)  # Default: each user's config
+    critical_threshold: Optional[float] = Field(default=None, gt=0)  # Default: CRITICAL_THRESHOLD
+    pause_threshold: Optional[float] = Field(default=None, gt=0)  # Default: each user's config
+    unusual_pattern_multiplier: Optional[float] = Field(default=None, gt=0)  # Default: UNUSUAL_PATTERN_MULTIPLIER
+
+
+class BacktestRequest(BaseModel):
+    """Replay of historical usage through alert and anomaly policies."""
+    user_address: Optional[str] = None  # None = every user on the local shards
+    days: int = Field(default=30, ge=1, le=366)
+    policies: List[BacktestPolicy] = Field(default_factory=lambda: [BacktestPolicy()])
+    incident_ratio: float = Field(default=2.0, gt=0)  # Next-day spend vs. baseline that makes a flag a real incident
@@ -0,0 +1,206 @@
+"""
+Sharded guardian deployment keyed by user address.
+
+With SHARD_COUNT > 1, guardian state is split across N shards. Each shard has
+its own database (SHARD_DATABASE_URL with "{shard}" substituted) and its own
+in-memory caches. A user's data always lives on shard
+``shard_index(user_address)``. A node can serve a subset of the shards
+(SHARD_LOCAL), so shards can be spread over processes and machines. The
+backend routes each user to the right node using the same hash.
+"""
+
+import asyncio
+import hashlib
+from typing import Any, Awaitable, Callable, Dict, List, Optional, TypeVar
+
+from fastapi import HTTPException
+from sqlalchemy.ext.asyncio import create_async_engine, AsyncEngine, AsyncSession, async_sessionmaker
+
+from .config import settings
+from .database import Base, get_engine
+from .schemas import BudgetConfigCreate, BudgetRuleCreate, ApiUsageCreate, AnalysisRequest
+
+T = TypeVar("T")
+
+
+class ShardNotLocalError(Exception):
+    """Raised when a user's shard is not served by this node."""
+
+    def __init__(self, user_address: str, shard: int):
+        self.user_address = user_address
+        self.shard = shard
+        super().__init__(f"Shard {shard} for {user_address} is not served by this node")
+
+
+def shard_index(user_address: str, shard_count: int) -> int:
+    """
+    Stable shard index for a user address.
+
+    Uses the first 8 bytes of sha256(lower-cased address), big-endian, modulo
+    the shard count. The backend's GuardianService uses the same function.
+    """
+    if shard_count <= 1:
+        return 0
+    digest = hashlib.sha256(user_address.lower().encode()).digest()
+    return int.from_bytes(digest[:8], "big") % shard_count
+
+
+class Shard:
+    """A single guardian shard: database engine, session factory and in-memory caches."""
+
+    def __init__(self, index: int, database_url: str, engine: Optional[AsyncEngine] = None):
+        self.index = index
+        self.database_url = database_url
+        self.engine = engine or create_async_engine(database_url, echo=settings.DATABASE_ECHO)
+        self.session_maker = async_sessionmaker(self.engine, class_=AsyncSession, expire_on_commit=False)
+        self._caches: Dict[str, Any] = {}
+
+    def cache(self, name: str, factory: Callable[[], T]) -> T:
+        """Get or create a named in-memory cache owned by this shard."""
+        if name not in self._caches:
+            self._caches[name] = factory()
+        return self._caches[name]
+
+    def cached(self, name: str) -> Optional[Any]:
+        """A named cache if it has been created, else None."""
+        return self._caches.get(name)
+
+    async def init_db(self):
+        """Create tables for this shard."""
+        async with self.engine.begin() as conn:
+            await conn.run_sync(Base.metadata.create_all)
+
+
+class ShardRouter:
+    """
+    Routes users to shards and fans out cross-shard queries.
+
+    Shards are created lazily and only for the shards served by this node.
+    """
+
+    def __init__(
+        self,
+        shard_count: int = 1,
+        database_url_template: str = "",
+        local_shards: Optional[List[int]] = None
+    ):
+        if shard_count < 1:
+            raise ValueError("SHARD_COUNT must be at least 1")
+        self.shard_count = shard_count
+        self.database_url_template = database_url_template
+        self.local_indexes = sorted(local_shards) if local_shards else list(range(shard_count))
+        self._shards: Dict[int, Shard] = {}
+
+    @property
+    def is_sharded(self) -> bool:
+        return self.shard_count > 1
+
+    def index_for(self, user_address: str) -> int:
+        """Shard index for a user address."""
+        return shard_index(user_address, self.shard_count)
+
+    def get_shard(self, index: int) -> Shard:
+        """Get (or create) a local shard by index."""
+        if index not in self.local_indexes:
+            raise ValueError(f"Shard {index} is not served by this node")
+        if index not in self._shards:
+            if self.is_sharded:
+                url = self.database_url_template.format(shard=index)
+                self._shards[index] = Shard(index, url)
+            else:
+                # Unsharded mode: the single shard is the default database
+                self._shards[index] = Shard(index, settings.DATABASE_URL, engine=get_engine())
+        return self._shards[index]
+
+    def shard_for(self, user_address: str) -> Shard:
+        """Local shard holding a user's data."""
+        index = self.index_for(user_address)
+        if index not in self.local_indexes:
+            raise ShardNotLocalError(user_address, index)
+        return self.get_shard(index)
+
+    @property
+    def local_shards(self) -> List[Shard]:
+        return [self.get_shard(i) for i in self.local_indexes]
+
+    async def init_db(self):
+        """Create tables on every local shard."""
+        for shard in self.local_shards:
+            await shard.init_db()
+
+    async def fan_out(self, fn: Callable[[AsyncSession, Shard], Awaitable[T]]) -> List[T]:
+        """
+        Run `fn` concurrently against every local shard.
+
+        Args:
+            fn: Coroutine function taking (session, shard)
+
+        Returns:
+            Results in shard order
+        """
+        async def run(shard: Shard) -> T:
+            async with shard.session_maker() as session:
+                return await fn(session, shard)
+
+        return list(await asyncio.gather(*(run(s) for s in self.local_shards)))
+
+
+# Singleton instance
+shard_router = None
+
+def get_shard_router() -> ShardRouter:
+    """Get or create the singleton shard router from settings."""
+    global shard_router
+    if shard_router is None:
+        local = [int(i) for i in settings.SHARD_LOCAL.split(",") if i.strip()]
+        shard_router = ShardRouter(
+            shard_count=settings.SHARD_COUNT,
+            database_url_template=settings.SHARD_DATABASE_URL,
+            local_shards=local or None
+        )
+    return shard_router
+
+
+async def _session_for(user_address: Optional[str]) -> AsyncSession:
+    router = get_shard_router()
+    if user_address is None:
+        if router.is_sharded:
+            raise HTTPException(status_code=400, detail="user_address is required when sharding is enabled")
+        shard = router.get_shard(0)
+    else:
+        try:
+            shard = router.shard_for(user_address)
+        except ShardNotLocalError as e:
+            raise HTTPException(status_code=421, detail=str(e))
+    async with shard.session_maker() as session:
+        yield session
+
+
+async def get_user_db(user_address: Optional[str] = None) -> AsyncSession:
+    """Database session on the shard for a path or query `user_address`."""
+    async for session in _session_for(user_address):
+        yield session
+
+
+async def get_config_db(config: BudgetConfigCreate) -> AsyncSession:
+    """Database session on the shard for a budget config request body."""
+    async for session in _session_for(config.user_address):
+        yield session
+
+
+async def get_rule_db(rule: BudgetRuleCreate) -> AsyncSession:
+    """Database session on the shard for a budget rule request body."""
+    async for session in _session_for(rule.user_address):
+        yield session
+
+
+async def get_usage_db(usage: ApiUsageCreate) -> AsyncSession:
+    """Database session on the shard for a usage record request body."""
+    async for session in _session_for(usage.user_address):
+        yield session
+
+
+async def get_analysis_db(request: AnalysisRequest) -> AsyncSession:
+    """Database session on the shard for an analysis request body."""
+    async for session in _session_for(request.user_address):
+        yield session
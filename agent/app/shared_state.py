@@ -0,0 +1,187 @@
+"""
+Shared state for counters and flags that must agree across worker processes.
+
+With `uvicorn --workers N`, in-process dicts diverge between workers. State
+that decides admission or triggers side effects is kept in a SharedStore
+instead: month-to-date spend, budget rule counters, per-user config versions
+and the unusual-pattern cooldown. A store has a few primitives: get/mget,
+set (optionally only-if-absent) with expiry, atomic integer increments
+and delete. Amounts are integer micro-units (see money.py), so increments
+are exact in every backend.
+
+Backends (SHARED_STATE_URL):
+- "" (default): MemoryStore, in-process. Correct for a single worker.
+- "redis://host:port/db": RedisStore (`pip install .[redis]`), shared by all
+  workers and nodes.
+- "fakeredis://": RedisStore over an in-process fakeredis server, for tests.
+
+Per-user call and cost buckets and hourly spend are also counted here
+(sliding_window.SharedUsageCounts), so unusual-pattern checks and spend
+forecasts see the traffic of every worker, not only the share one served.
+"""
+
+import time
+from abc import ABC, abstractmethod
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+from .config import settings
+
+try:
+    import redis.asyncio as aioredis
+except ImportError:  # Optional: pip install redis
+    aioredis = None
+
+KEY_PREFIX = "guardian:"
+
+# Expired keys are swept from a MemoryStore once per this many writes
+SWEEP_EVERY = 10000
+
+
+class SharedStore(ABC):
+    """Interface of a shared key-value store. Values come back as strings or numbers."""
+
+    async def get(self, key: str) -> Optional[Any]:
+        return (await self.mget([key]))[0]
+
+    @abstractmethod
+    async def mget(self, keys: Sequence[str]) -> List[Optional[Any]]:
+        """Values of several keys in one round trip (None for missing keys)."""
+
+    @abstractmethod
+    async def set(self, key: str, value: Any, ttl: Optional[float] = None, nx: bool = False) -> bool:
+        """
+        Set a key, with an expiry in seconds.
+
+        Returns:
+            False if `nx` is set and the key already exists
+        """
+
+    async def incr(self, key: str, amount: int = 1, ttl: Optional[float] = None) -> int:
+        """Atomically add to an integer key (missing = 0) and return the new value."""
+        return (await self.incr_many([(key, amount, ttl)]))[0]
+
+    @abstractmethod
+    async def incr_many(self, items: Sequence[Tuple[str, int, Optional[float]]]) -> List[int]:
+        """Several increments (key, amount, ttl) in one round trip."""
+
+    @abstractmethod
+    async def delete(self, *keys: str):
+        """Remove keys (missing ones are ignored)."""
+
+
+class MemoryStore(SharedStore):
+    """In-process store (single worker)."""
+
+    def __init__(self):
+        self._data: Dict[str, Tuple[Any, Optional[float]]] = {}
+        self._writes = 0
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+    def _get(self, key: str, now: float) -> Optional[Any]:
+        item = self._data.get(key)
+        if item is None:
+            return None
+        value, expires_at = item
+        if expires_at is not None and expires_at <= now:
+            del self._data[key]
+            return None
+        return value
+
+    def _put(self, key: str, value: Any, ttl: Optional[float], now: float):
+        self._data[key] = (value, now + ttl if ttl is not None else None)
+        self._writes += 1
+        if self._writes % SWEEP_EVERY == 0:
+            expired = [k for k, (_, exp) in self._data.items() if exp is not None and exp <= now]
+            for k in expired:
+                del self._data[k]
+
+    async def mget(self, keys: Sequence[str]) -> List[Optional[Any]]:
+        now = time.monotonic()
+        return [self._get(key, now) for key in keys]
+
+    async def set(self, key: str, value: Any, ttl: Optional[float] = None, nx: bool = False) -> bool:
+        now = time.monotonic()
+        if nx and self._get(key, now) is not None:
+            return False
+        self._put(key, value, ttl, now)
+        return True
+
+    async def incr_many(self, items: Sequence[Tuple[str, int, Optional[float]]]) -> List[int]:
+        now = time.monotonic()
+        results = []
+        for key, amount, ttl in items:
+            value = int(self._get(key, now) or 0) + amount
+            self._put(key, value, ttl, now)
+            results.append(value)
+        return results
+
+    async def delete(self, *keys: str):
+        for key in keys:
+            self._data.pop(key, None)
+
+
+class RedisStore(SharedStore):
+    """
+    Store backed by a Redis server (or an in-process fakeredis).
+
+    Args:
+        client: redis.asyncio client created with decode_responses=True
+    """
+
+    def __init__(self, client):
+        self.client = client
+
+    @classmethod
+    def from_url(cls, url: str) -> "RedisStore":
+        if url.startswith("fakeredis://"):
+            import fakeredis
+            return cls(fakeredis.FakeAsyncRedis(decode_responses=True))
+        if aioredis is None:
+            raise RuntimeError("redis is required for SHARED_STATE_URL=redis://... (pip install redis)")
+        return cls(aioredis.from_url(url, decode_responses=True))
+
+    async def mget(self, keys: Sequence[str]) -> List[Optional[Any]]:
+        return await self.client.mget(keys) if keys else []
+
+    async def set(self, key: str, value: Any, ttl: Optional[float] = None, nx: bool = False) -> bool:
+        px = int(ttl * 1000) if ttl is not None else None
+        return bool(await self.client.set(key, value, px=px, nx=nx))
+
+    async def incr_many(self, items: Sequence[Tuple[str, int, Optional[float]]]) -> List[int]:
+        if not items:
+            return []
+        pipe = self.client.pipeline(transaction=True)
+        for key, amount, ttl in items:
+            pipe.incrby(key, amount)
+            if ttl is not None:
+                pipe.pexpire(key, int(ttl * 1000))
+        results = await pipe.execute()
+        values = []
+        i = 0
+        for _, _, ttl in items:
+            values.append(int(results[i]))
+            i += 2 if ttl is not None else 1
+        return values
+
+    async def delete(self, *keys: str):
+        if keys:
+            await self.client.delete(*keys)
+
+
+def state_key(*parts: Any) -> str:
+    """Namespaced store key, e.g. state_key("spend", user, "2026-01")."""
+    return KEY_PREFIX + ":".join(str(p) for p in parts)
+
+
+# Singleton instance
+shared_store = None
+
+def get_shared_store() -> SharedStore:
+    """Get or create the shared store from SHARED_STATE_URL."""
+    global shared_store
+    if shared_store is None:
+        url = settings.SHARED_STATE_URL
+        shared_store = RedisStore.from_url(url) if url else MemoryStore()
+    return shared_store
@@ -0,0 +1,346 @@
+"""
+Per-user sliding-window counters for calls and cost.
+
+Each user has a ring buffer of per-second buckets covering the analysis
+window (ANALYSIS_WINDOW_MINUTES), held in `array`s, plus running totals.
+Cost buckets hold integer micro-units (see money.py), so the running total
+never drifts as buckets expire.
+"Calls and cost in the window" is O(1), and memory per user is bounded by
+the window length rather than by call volume. Windows are seeded from the
+database the first time a user is seen (or after eviction), then updated at
+ingest.
+
+Each window also carries a fast RateEstimator of the recent rate, a slow
+baseline from the 7-day average (re-read from the database every
+BASELINE_REFRESH_MINUTES rather than fed live calls), a SpendForecast of
+hourly spend (see forecast.py) starting from the same 7-day average, and
+the last few UsageEvents as a sample for AI prompts.
+
+A window only sees the calls its worker ingested. With `--workers N`, the
+calls of every worker are also counted in the shared store
+(SharedUsageCounts): calls and cost per WINDOW_BUCKET_SECONDS bucket, and
+spend per hour. Unusual-pattern checks read the shared buckets and
+forecasts close each hour with its shared spend. Both counts only miss
+calls (the window those from other workers, the store those from before
+it started), so readers take the larger of the two.
+"""
+
+import time
+from array import array
+from collections import OrderedDict, deque
+from datetime import datetime, timedelta
+from typing import Dict, Iterable, List, Optional, Sequence, Tuple
+
+from sqlalchemy import select, func, and_
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from .database import ApiUsage
+from .dimensions import get_api_dimensions
+from .money import from_micros
+from .usage_event import UsageEvent
+from .config import settings
+from .forecast import SpendForecast, HOUR
+from .rate_estimator import RateEstimator, epoch_seconds, RECENT_ALPHA, BASELINE_ALPHA
+from .sharding import get_shard_router
+from .shared_state import get_shared_store, state_key
+from . import metrics
+
+
+class SlidingWindowCounter:
+    """
+    Ring buffer of per-second call and cost buckets with running totals.
+
+    Args:
+        window_seconds: Window length (number of buckets)
+        baseline: Slow rate estimator seeded from history (default: empty)
+        forecast: Hourly spend forecast (default: no history)
+        sample_size: Number of most recent calls kept for AI prompts
+    """
+
+    __slots__ = (
+        "window_seconds", "_calls", "_cost", "_latest", "calls_total", "cost_total", "recent",
+        "rate", "baseline", "baseline_at", "forecast"
+    )
+
+    def __init__(
+        self,
+        window_seconds: int,
+        baseline: Optional[RateEstimator] = None,
+        forecast: Optional[SpendForecast] = None,
+        sample_size: int = 10
+    ):
+        self.window_seconds = window_seconds
+        self._calls = array("I", [0]) * window_seconds
+        self._cost = array("q", [0]) * window_seconds  # Micro-units
+        self._latest = 0  # Newest second covered by the buffer
+        self.calls_total = 0
+        self.cost_total = 0
+        self.recent = deque(maxlen=sample_size)
+        self.rate = RateEstimator(RECENT_ALPHA)
+        self.baseline = baseline or RateEstimator(BASELINE_ALPHA)
+        self.baseline_at = time.monotonic()  # When the baseline was read
+        self.forecast = forecast or new_forecast()
+
+    def _advance(self, now: int):
+        """Expire buckets older than the window ending at `now`."""
+        if now <= self._latest:
+            return
+        if now - self._latest >= self.window_seconds:
+            for i in range(self.window_seconds):
+                self._calls[i] = 0
+                self._cost[i] = 0
+            self.calls_total = 0
+            self.cost_total = 0
+        else:
+            for second in range(self._latest + 1, now + 1):
+                i = second % self.window_seconds
+                self.calls_total -= self._calls[i]
+                self.cost_total -= self._cost[i]
+                self._calls[i] = 0
+                self._cost[i] = 0
+        self._latest = now
+
+    def add(self, second: int, cost_micros: int, calls: int = 1):
+        """Count `calls` costing `cost_micros` at epoch second `second`."""
+        self._advance(second)
+        if second <= self._latest - self.window_seconds:
+            return  # Older than the window
+        i = second % self.window_seconds
+        self._calls[i] += calls
+        self._cost[i] += cost_micros
+        self.calls_total += calls
+        self.cost_total += cost_micros
+
+    def observe(self, timestamp: datetime, cost_micros: int):
+        """Count a call and update the recent rate and spend forecast."""
+        t = epoch_seconds(timestamp)
+        self.add(int(t), cost_micros)
+        self.rate.observe(t, from_micros(cost_micros))
+        self.forecast.observe(t, cost_micros)
+
+    def record(self, event: UsageEvent):
+        """Count a stored usage event and keep it in the recent sample."""
+        self.observe(event.timestamp, event.cost_micros)
+        self.recent.append(event)
+
+    def totals(self, seconds: Optional[int] = None, now: Optional[int] = None) -> Tuple[int, float]:
+        """
+        Calls and cost in the last `seconds` (default: the whole window).
+
+        O(1) for the whole window, O(seconds) for a shorter span.
+        """
+        self._advance(int(time.time()) if now is None else now)
+        if seconds is None or seconds >= self.window_seconds:
+            return self.calls_total, from_micros(self.cost_total)
+        calls, cost = 0, 0
+        for second in range(self._latest - seconds + 1, self._latest + 1):
+            i = second % self.window_seconds
+            calls += self._calls[i]
+            cost += self._cost[i]
+        return calls, from_micros(cost)
+
+
+def new_forecast(level: float = 0.0) -> SpendForecast:
+    """Spend forecast with the configured smoothing, starting at `level` micro-units per hour."""
+    return SpendForecast(settings.FORECAST_ALPHA, settings.FORECAST_BETA, settings.FORECAST_DAMPING, level)
+
+
+class UsageWindows:
+    """Per-shard LRU of user sliding windows, bounded to `max_users` entries."""
+
+    def __init__(self, window_seconds: int, max_users: int):
+        self.window_seconds = window_seconds
+        self.max_users = max_users
+        self._windows: "OrderedDict[str, SlidingWindowCounter]" = OrderedDict()
+
+    def __len__(self) -> int:
+        return len(self._windows)
+
+    def peek(self, user_address: str) -> Optional[SlidingWindowCounter]:
+        """Cached window for a user, or None."""
+        window = self._windows.get(user_address)
+        if window is not None:
+            self._windows.move_to_end(user_address)
+        return window
+
+    async def _baseline(self, db: AsyncSession, user_address: str, since: datetime) -> Tuple[RateEstimator, float]:
+        """Baseline estimator and spend per hour (micro-units) over the 7 days before `since`."""
+        hist_since = since - timedelta(days=7)
+        hist_stmt = select(
+            func.count(ApiUsage.id),
+            func.sum(ApiUsage.cost_micros)
+        ).where(
+            and_(
+                ApiUsage.user_address == user_address,
+                ApiUsage.timestamp >= hist_since,
+                ApiUsage.timestamp < since
+            )
+        )
+        hist_calls, hist_cost = (await db.execute(hist_stmt)).one()
+        seconds = (since - hist_since).total_seconds()
+        baseline = RateEstimator.from_average(BASELINE_ALPHA, hist_calls or 0, from_micros(hist_cost), seconds)
+        return baseline, (hist_cost or 0) / (seconds / HOUR)
+
+    async def get(self, db: AsyncSession, user_address: str) -> SlidingWindowCounter:
+        """Window for a user, seeded from the database on a miss (baseline re-read when stale)."""
+        window = self.peek(user_address)
+        if window is not None:
+            metrics.cache_hit("usage_window")
+            if time.monotonic() - window.baseline_at > settings.BASELINE_REFRESH_MINUTES * 60:
+                since = datetime.utcnow() - timedelta(seconds=self.window_seconds)
+                window.baseline_at = time.monotonic()
+                window.baseline, _ = await self._baseline(db, user_address, since)
+            return window
+        metrics.cache_miss("usage_window")
+
+        # Baseline: average rate over the 7 days before the window
+        since = datetime.utcnow() - timedelta(seconds=self.window_seconds)
+        baseline, hourly_spend = await self._baseline(db, user_address, since)
+
+        window = SlidingWindowCounter(self.window_seconds, baseline, new_forecast(hourly_spend))
+        stmt = select(ApiUsage.timestamp, ApiUsage.cost_micros, ApiUsage.api_dim_id).where(
+            and_(
+                ApiUsage.user_address == user_address,
+                ApiUsage.timestamp >= since
+            )
+        ).order_by(ApiUsage.timestamp)
+        rows = (await db.execute(stmt)).all()
+        for timestamp, cost_micros, _ in rows:
+            window.observe(timestamp, cost_micros)
+        recent = rows[-window.recent.maxlen:]
+        labels = await get_api_dimensions(user_address).labels(db, {dim_id for _, _, dim_id in recent})
+        for timestamp, cost_micros, dim_id in recent:
+            provider, api_id, api_name = labels[dim_id]
+            window.recent.append(UsageEvent(user_address, api_id, api_name, provider, cost_micros, timestamp))
+
+        existing = self._windows.get(user_address)
+        if existing is not None:
+            return existing  # Seeded concurrently by another request
+        self._windows[user_address] = window
+        if len(self._windows) > self.max_users:
+            self._windows.popitem(last=False)
+        return window
+
+
+def get_usage_windows(user_address: str) -> UsageWindows:
+    """Sliding windows of the local shard holding a user's data."""
+    shard = get_shard_router().shard_for(user_address)
+    return shard.cache(
+        "usage_windows",
+        lambda: UsageWindows(settings.ANALYSIS_WINDOW_MINUTES * 60, settings.USAGE_WINDOW_MAX_USERS)
+    )
+
+
+class SharedUsageCounts:
+    """
+    Calls and cost per user in fixed buckets of the shared store, and spend per hour.
+
+    Every worker adds the calls it ingests, so the counts cover all workers.
+    Keys expire once their bucket has left the window (hours after
+    `forecast_hours`), so nothing needs cleaning up.
+
+    Args:
+        window_seconds: Length of the window the buckets cover
+        bucket_seconds: Bucket length
+        forecast_hours: Closed hours whose spend is kept for forecasts
+    """
+
+    def __init__(self, window_seconds: int, bucket_seconds: int, forecast_hours: int = 24):
+        self.window_seconds = window_seconds
+        self.bucket_seconds = bucket_seconds
+        self.forecast_hours = forecast_hours
+
+    def _bucket_keys(self, user_address: str, bucket: int) -> Tuple[str, str]:
+        return state_key("window_calls", user_address, bucket), state_key("window_cost", user_address, bucket)
+
+    async def record(self, windows: Dict[str, SlidingWindowCounter], events: Sequence[UsageEvent]):
+        """
+        Count stored events in the users' windows and in the shared store.
+
+        Forecasts are brought up to the current hour first, so hours are
+        closed with their shared spend rather than this worker's share.
+        """
+        await self.sync_forecasts(windows)
+        counts: Dict[Tuple[str, int], List[int]] = {}
+        spend: Dict[Tuple[str, int], int] = {}
+        for event in events:
+            windows[event.user_address].record(event)
+            t = epoch_seconds(event.timestamp)
+            bucket = counts.setdefault((event.user_address, int(t // self.bucket_seconds)), [0, 0])
+            bucket[0] += 1
+            bucket[1] += event.cost_micros
+            hour = (event.user_address, int(t // HOUR))
+            spend[hour] = spend.get(hour, 0) + event.cost_micros
+
+        bucket_ttl = self.window_seconds + self.bucket_seconds
+        hour_ttl = (self.forecast_hours + 1) * HOUR
+        items = []
+        for (user_address, bucket), (calls, cost_micros) in counts.items():
+            calls_key, cost_key = self._bucket_keys(user_address, bucket)
+            items.append((calls_key, calls, bucket_ttl))
+            items.append((cost_key, cost_micros, bucket_ttl))
+        for (user_address, hour), cost_micros in spend.items():
+            items.append((state_key("hour_spend", user_address, hour), cost_micros, hour_ttl))
+        await get_shared_store().incr_many(items)
+
+    async def sync_forecasts(self, windows: Dict[str, SlidingWindowCounter], now: Optional[float] = None):
+        """Close the hours before `now` in each user's forecast with the spend of all workers."""
+        hour = int((time.time() if now is None else now) // HOUR)
+        pending = [
+            (user_address, h)
+            for user_address, window in windows.items()
+            if window.forecast.hour is not None and window.forecast.hour < hour
+            for h in range(max(window.forecast.hour, hour - self.forecast_hours), hour)
+        ]
+        if not pending:
+            return
+        values = await get_shared_store().mget([state_key("hour_spend", u, h) for u, h in pending])
+        closed: Dict[str, Dict[int, int]] = {}
+        for (user_address, h), value in zip(pending, values):
+            if value is not None:
+                closed.setdefault(user_address, {})[h] = int(value)
+        for user_address, window in windows.items():
+            window.forecast.advance(hour, closed.get(user_address))
+
+    async def totals(
+        self,
+        user_address: str,
+        spans: Iterable[int],
+        now: Optional[float] = None
+    ) -> List[Tuple[int, int]]:
+        """
+        Calls and cost (micro-units) in the buckets ending within each span, in one read.
+
+        Args:
+            user_address: User to count
+            spans: Seconds back from `now` (at most the window length)
+            now: Epoch seconds (default: now)
+        """
+        spans = [min(span, self.window_seconds) for span in spans]
+        last = int((time.time() if now is None else now) // self.bucket_seconds)
+        buckets = range(last - max(spans) // self.bucket_seconds + 1, last + 1)
+        keys = [key for bucket in buckets for key in self._bucket_keys(user_address, bucket)]
+        values = [int(v or 0) for v in await get_shared_store().mget(keys)]
+        results = []
+        for span in spans:
+            first = last - span // self.bucket_seconds + 1
+            calls = cost = 0
+            for i, bucket in enumerate(buckets):
+                if bucket >= first:
+                    calls += values[2 * i]
+                    cost += values[2 * i + 1]
+            results.append((calls, cost))
+        return results
+
+
+# Singleton instance
+shared_usage_counts = None
+
+def get_shared_usage_counts() -> SharedUsageCounts:
+    """Shared per-user call and cost buckets (see SharedUsageCounts)."""
+    global shared_usage_counts
+    if shared_usage_counts is None:
+        shared_usage_counts = SharedUsageCounts(
+            settings.ANALYSIS_WINDOW_MINUTES * 60, settings.WINDOW_BUCKET_SECONDS
+        )
+    return shared_usage_counts
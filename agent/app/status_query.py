@@ -0,0 +1,114 @@
+"""
+Budget status in one database round trip.
+
+A status needs the user's config, month-to-date spend, the 5 most recent
+alerts and the top 5 pending optimizations. Instead of four queries, the
+four parts are combined with UNION ALL into one statement. Each part fills
+the columns it needs from a fixed set of typed slots (strings, an integer
+for micro-unit amounts, floats, a boolean, timestamps, JSON) and leaves the
+others NULL; a `kind` column says which part a row came from. Rows are read
+as plain tuples and mapped to dicts, with no ORM objects or identity map
+involved. The caller's forecast (see guardian_service.get_budget_status)
+is read from the cached usage window, which costs extra queries only when
+the window has to be seeded.
+"""
+
+from datetime import datetime
+from typing import Any, Dict, List, Optional, Tuple
+
+from sqlalchemy import select, func, and_, literal, null, type_coerce, union_all
+from sqlalchemy import BigInteger, Boolean, DateTime, Float, Integer, JSON, String
+
+from .database import BudgetConfig, ApiUsage, BudgetAlert, Optimization
+
+RECENT_ALERTS = 5
+TOP_OPTIMIZATIONS = 5
+
+# Typed column slots shared by every part of the union
+SLOTS: Tuple[Tuple[str, Any], ...] = (
+    ("id", Integer),
+    ("s1", String), ("s2", String), ("s3", String), ("s4", String), ("s5", String),
+    ("n1", BigInteger),
+    ("f1", Float), ("f2", Float),
+    ("b1", Boolean),
+    ("t1", DateTime), ("t2", DateTime),
+    ("j", JSON)
+)
+
+# Field -> slot, per part
+CONFIG_FIELDS = {"monthly_limit_micros": "n1", "pause_threshold": "f2", "is_active": "b1"}
+SPEND_FIELDS = {"spend_micros": "n1"}
+ALERT_FIELDS = {
+    "id": "id", "user_address": "s1", "alert_type": "s2", "severity": "s3", "message": "s4",
+    "recommendation": "s5", "current_spend": "f1", "budget_limit": "f2", "is_read": "b1",
+    "created_at": "t1", "extra_data": "j"
+}
+OPTIMIZATION_FIELDS = {
+    "id": "id", "user_address": "s1", "optimization_type": "s2", "current_api": "s3",
+    "suggested_api": "s4", "description": "s5", "estimated_savings": "f1", "is_applied": "b1",
+    "applied_at": "t1", "created_at": "t2", "extra_data": "j"
+}
+
+
+def _part(kind: str, columns, fields: Dict[str, str]):
+    """SELECT of one part: `kind`, then every slot (the part's fields, NULL elsewhere)."""
+    by_slot = {slot: getattr(columns, field) for field, slot in fields.items()}
+    return [literal(kind).label("kind")] + [
+        type_coerce(by_slot.get(slot, null()), type_).label(slot) for slot, type_ in SLOTS
+    ]
+
+
+def budget_status_query(user_address: str, start_of_month: datetime):
+    """The combined status statement for one user."""
+    config = select(*_part("config", BudgetConfig, CONFIG_FIELDS)).where(
+        BudgetConfig.user_address == user_address
+    )
+
+    spend_total = select(func.sum(ApiUsage.cost_micros).label("spend_micros")).where(
+        and_(
+            ApiUsage.user_address == user_address,
+            ApiUsage.timestamp >= start_of_month
+        )
+    ).subquery()
+    spend = select(*_part("spend", spend_total.c, SPEND_FIELDS))
+
+    recent = select(BudgetAlert).where(
+        BudgetAlert.user_address == user_address
+    ).order_by(BudgetAlert.created_at.desc()).limit(RECENT_ALERTS).subquery()
+    alerts = select(*_part("alert", recent.c, ALERT_FIELDS))
+
+    top = select(Optimization).where(
+        and_(
+            Optimization.user_address == user_address,
+            Optimization.is_applied == False
+        )
+    ).order_by(Optimization.estimated_savings.desc()).limit(TOP_OPTIMIZATIONS).subquery()
+    optimizations = select(*_part("optimization", top.c, OPTIMIZATION_FIELDS))
+
+    return union_all(config, spend, alerts, optimizations)
+
+
+class StatusParts:
+    """Rows of the combined status query, split by part."""
+
+    __slots__ = ("config", "spend_micros", "alerts", "optimizations")
+
+    def __init__(self, rows):
+        self.config: Optional[Dict[str, Any]] = None
+        self.spend_micros = 0
+        self.alerts: List[Dict[str, Any]] = []
+        self.optimizations: List[Dict[str, Any]] = []
+        for row in rows:
+            values = row._mapping
+            kind = values["kind"]
+            if kind == "config":
+                self.config = {field: values[slot] for field, slot in CONFIG_FIELDS.items()}
+            elif kind == "spend":
+                self.spend_micros = values["n1"] or 0
+            elif kind == "alert":
+                self.alerts.append({field: values[slot] for field, slot in ALERT_FIELDS.items()})
+            elif kind == "optimization":
+                self.optimizations.append({field: values[slot] for field, slot in OPTIMIZATION_FIELDS.items()})
+        # UNION ALL does not keep each part's order
+        self.alerts.sort(key=lambda a: a["created_at"], reverse=True)
+        self.optimizations.sort(key=lambda o: o["estimated_savings"], reverse=True)
@@ -0,0 +1,141 @@
+"""
+Compact in-memory representation of a usage event.
+
+On the ingest path an event used to exist as the request model, a column
+dict, an ORM `ApiUsage` object and a sample dict for the analyzer. Inside
+the service it is now one UsageEvent: a `__slots__` object (no per-instance
+`__dict__`) holding the cost as integer micro-units, whose repeated strings
+(user, provider, API, endpoint, status) are interned so events of the same
+API share them. The ingest queue and the sliding windows keep UsageEvents.
+The request model is only read at the API edge, and dicts are only built
+at the others: column values for the INSERT and the ingest log, and the
+few recent calls quoted to the LLM.
+"""
+
+import sys
+from datetime import datetime
+from typing import Any, Dict, Optional
+
+from .money import to_micros, from_micros
+from .schemas import ApiUsageCreate
+
+
+def _intern(value: Optional[str]) -> Optional[str]:
+    return sys.intern(value) if value is not None else None
+
+
+class UsageEvent:
+    """One API usage event (an api_usage row, once `id` is set)."""
+
+    __slots__ = (
+        "user_address", "api_id", "api_name", "provider", "cost_micros", "request_count", "tokens_used",
+        "endpoint", "status", "metadata", "idempotency_key", "timestamp", "api_dim_id", "id"
+    )
+
+    def __init__(
+        self,
+        user_address: str,
+        api_id: str,
+        api_name: str,
+        provider: str,
+        cost_micros: int,
+        timestamp: datetime,
+        request_count: int = 1,
+        tokens_used: Optional[int] = None,
+        endpoint: Optional[str] = None,
+        status: Optional[str] = "success",
+        metadata: Optional[Dict[str, Any]] = None,
+        idempotency_key: Optional[str] = None,
+        api_dim_id: Optional[int] = None,
+        id: Optional[int] = None
+    ):
+        self.user_address = _intern(user_address)
+        self.api_id = _intern(api_id)
+        self.api_name = _intern(api_name)
+        self.provider = _intern(provider)
+        self.cost_micros = cost_micros
+        self.request_count = request_count
+        self.tokens_used = tokens_used
+        self.endpoint = _intern(endpoint)
+        self.status = _intern(status)
+        self.metadata = metadata
+        self.idempotency_key = idempotency_key
+        self.timestamp = timestamp
+        self.api_dim_id = api_dim_id
+        self.id = id
+
+    @classmethod
+    def from_create(cls, usage: ApiUsageCreate, timestamp: Optional[datetime] = None) -> "UsageEvent":
+        """Event for a usage request (timestamped now by default)."""
+        return cls(
+            user_address=usage.user_address,
+            api_id=usage.api_id,
+            api_name=usage.api_name,
+            provider=usage.provider,
+            cost_micros=to_micros(usage.cost),
+            timestamp=timestamp or datetime.utcnow(),
+            request_count=usage.request_count,
+            tokens_used=usage.tokens_used,
+            endpoint=usage.endpoint,
+            status=usage.status,
+            metadata=usage.metadata,
+            idempotency_key=usage.idempotency_key
+        )
+
+    @classmethod
+    def from_row(cls, row: Dict[str, Any]) -> "UsageEvent":
+        """Event for api_usage column values plus the API's names, as written by `record`."""
+        timestamp = row["timestamp"]
+        cost_micros = row.get("cost_micros")
+        return cls(
+            user_address=row["user_address"],
+            api_id=row["api_id"],
+            api_name=row["api_name"],
+            provider=row["provider"],
+            cost_micros=to_micros(row["cost"]) if cost_micros is None else cost_micros,  # Older log entries
+            timestamp=datetime.fromisoformat(timestamp) if isinstance(timestamp, str) else timestamp,
+            request_count=row.get("request_count", 1),
+            tokens_used=row.get("tokens_used"),
+            endpoint=row.get("endpoint"),
+            status=row.get("status"),
+            metadata=row.get("extra_data"),
+            idempotency_key=row.get("idempotency_key"),
+            api_dim_id=row.get("api_dim_id")
+        )
+
+    @property
+    def cost(self) -> float:
+        return from_micros(self.cost_micros)
+
+    def row(self) -> Dict[str, Any]:
+        """api_usage column values (without the id). The API is stored as its `api_dim_id` only."""
+        return {
+            "user_address": self.user_address,
+            "api_dim_id": self.api_dim_id,
+            "cost_micros": self.cost_micros,
+            "request_count": self.request_count,
+            "tokens_used": self.tokens_used,
+            "endpoint": self.endpoint,
+            "status": self.status,
+            "extra_data": self.metadata,
+            "idempotency_key": self.idempotency_key,
+            "timestamp": self.timestamp
+        }
+
+    def record(self) -> Dict[str, Any]:
+        """Column values and the API's names as JSON-ready values (ingest log)."""
+        record = self.row()
+        record["provider"] = self.provider
+        record["api_id"] = self.api_id
+        record["api_name"] = self.api_name
+        record["timestamp"] = self.timestamp.isoformat()
+        return record
+
+    def sample(self) -> Dict[str, Any]:
+        """The fields quoted to the LLM for a recent call."""
+        return {
+            "api_name": self.api_name,
+            "provider": self.provider,
+            "cost": self.cost,
+            "timestamp": self.timestamp.isoformat()
+        }
@@ -0,0 +1,634 @@
+"""
+Group-commit writer for api_usage rows.
+
+Inserting and committing each usage event on its own pays one transaction
+(and one fsync) per event. Each shard has a UsageWriter instead. Events are
+queued in memory, and a single flusher task writes them in batches: a batch
+is flushed when it reaches USAGE_WRITER_MAX_BATCH rows, or
+USAGE_WRITER_FLUSH_MS after its first event arrived. Each batch is one
+multi-row INSERT and one commit.
+
+With USAGE_WRITER_LOG_DIR set, each batch is first appended to an NDJSON log
+and fsynced. Callers of `append` are acknowledged at that point, before the
+database commit (unless their events carry idempotency keys, see below). The
+commit also stores the batch's last log sequence number in
+`ingest_checkpoints`, keyed by the log's name. Every writer (one per shard
+in each worker process) owns its own log, "<name>-<pid>-<random id>.log",
+and holds an exclusive flock on it from creation until the writer closes, so
+several `uvicorn --workers` never share sequence numbers or checkpoints. On
+startup a writer replays the logs of its shard that no live process holds
+locked (workers that crashed, or the single per-shard log of older
+versions): their entries after the checkpoint are committed exactly once,
+then the log and its checkpoint are deleted. Because a log has one flusher,
+everything in it is committed after each flush, so it is truncated once it
+passes USAGE_WRITER_LOG_MAX_BYTES, and deleted when the writer closes.
+
+A logged batch whose commit fails has already been acknowledged, so it is
+retried with exponential backoff (RETRY_SECONDS doubling up to
+MAX_RETRY_SECONDS). After USAGE_WRITER_MAX_RETRIES failed attempts it is
+moved to the writer's dead-letter file, "<log name>.dead" (NDJSON entries
+with the error, never replayed automatically), and its checkpoint is
+advanced, so one poison batch cannot hold up the rows queued behind it.
+
+Rows may carry an idempotency key (transaction hash or x402 payment ID),
+unique in api_usage. Each writer remembers recently committed keys in an
+LRU (IDEMPOTENCY_CACHE_SIZE), so a retried event is dropped with a dict
+lookup before it is queued. A key that is still queued is in flight: a
+repeat (including one within the same batch) waits for the original's
+commit and is then a duplicate, or, if that commit failed, is queued in its
+place, so a retry is never lost with the original. Keyed rows are
+inserted with INSERT ... ON CONFLICT (idempotency_key) DO NOTHING RETURNING,
+so a key that left the LRU (or predates a restart, or was committed by
+another worker in the meantime) is skipped without failing its batch. Keyed
+events are acknowledged at commit even with a log, so callers only count
+(in ledgers and rate windows) the rows that were actually inserted.
+
+Before each commit, the rows' APIs are interned to their `api_dim_id` (see
+dimensions) from the shard's in-memory cache.
+
+The queue holds UsageEvents (see usage_event); column dicts are only built
+for the INSERT and the log entry.
+"""
+
+import asyncio
+import glob
+import json
+import os
+import uuid
+from collections import OrderedDict, deque
+from datetime import datetime
+from typing import Any, Deque, Dict, List, Optional, Sequence, Tuple
+
+from sqlalchemy import delete, insert, select, update
+from sqlalchemy.ext.asyncio import AsyncEngine
+
+try:
+    import fcntl
+except ImportError:  # Optional: POSIX only, needed for the ingest log
+    fcntl = None
+
+from .database import ApiUsage, IngestCheckpoint, conflict_insert
+from .dimensions import ApiDimensions, shard_dimensions
+from .usage_event import UsageEvent
+from .config import settings
+from .sharding import get_shard_router
+from .logs import get_logger
+from . import metrics
+
+log = get_logger("usage_writer")
+
+RETRY_SECONDS = 1.0
+MAX_RETRY_SECONDS = 30.0
+
+# Idempotency keys per SELECT ... IN query
+KEY_CHUNK = 500
+
+# (usage id, inserted): inserted is False for a dropped duplicate, whose id
+# is the original row's
+WriteResult = Tuple[Optional[int], bool]
+
+
+class RecentKeys:
+    """LRU of committed idempotency keys mapped to usage ids."""
+
+    def __init__(self, max_size: int):
+        self.max_size = max_size
+        self._keys: "OrderedDict[str, int]" = OrderedDict()
+
+    def __len__(self) -> int:
+        return len(self._keys)
+
+    def __contains__(self, key: str) -> bool:
+        return key in self._keys
+
+    def get(self, key: str) -> Optional[int]:
+        return self._keys.get(key)
+
+    def add(self, key: str, usage_id: int):
+        self._keys[key] = usage_id
+        self._keys.move_to_end(key)
+        if len(self._keys) > self.max_size:
+            self._keys.popitem(last=False)
+
+    def discard(self, key: str):
+        self._keys.pop(key, None)
+
+
+class _Request:
+    """Events from one caller, with futures for durability and commit."""
+
+    __slots__ = ("events", "logged", "committed", "last_seq")
+
+    def __init__(self, events: List[UsageEvent], loop: asyncio.AbstractEventLoop):
+        self.events = events
+        self.logged = loop.create_future()
+        self.committed = loop.create_future()
+        self.last_seq: Optional[int] = None  # Set once the events are in the log
+
+
+class UsageWriter:
+    """
+    Per-shard usage ingest queue with group commit.
+
+    Args:
+        engine: Shard database engine
+        name: Writer name (prefix of its log files and checkpoint keys)
+        flush_ms: Longest time an event waits for its batch
+        max_batch: Rows per commit
+        log_dir: Directory of the append-only log (None = no log)
+        dimensions: API intern cache of the shard (default: a new one)
+    """
+
+    def __init__(
+        self,
+        engine: AsyncEngine,
+        name: str,
+        flush_ms: Optional[float] = None,
+        max_batch: Optional[int] = None,
+        log_dir: Optional[str] = None,
+        dimensions: Optional[ApiDimensions] = None
+    ):
+        self.engine = engine
+        self.name = name
+        self.dimensions = dimensions or ApiDimensions()
+        self.flush_seconds = (settings.USAGE_WRITER_FLUSH_MS if flush_ms is None else flush_ms) / 1000
+        self.max_batch = max_batch or settings.USAGE_WRITER_MAX_BATCH
+        log_dir = settings.USAGE_WRITER_LOG_DIR if log_dir is None else log_dir
+        self.log_dir = log_dir or None
+        self.log_name: Optional[str] = None  # Own log (and checkpoint key), set at start
+        self.log_path: Optional[str] = None
+        self.recent_keys = RecentKeys(settings.IDEMPOTENCY_CACHE_SIZE)
+        # Keys of queued events -> future of their usage id (None if the commit failed)
+        self._in_flight: Dict[str, asyncio.Future] = {}
+        self._failures = 0  # Consecutive failed commits of the batch at the head of the queue
+        self._queue: Deque[_Request] = deque()
+        self._queued_rows = 0
+        self._seq = 0
+        self._log = None
+        self._wakeup = asyncio.Event()
+        self._full = asyncio.Event()
+        self._start_lock = asyncio.Lock()
+        self._task: Optional[asyncio.Task] = None
+        self._closing = False
+
+    @property
+    def queue_depth(self) -> int:
+        """Rows queued and not yet committed."""
+        return self._queued_rows
+
+    def is_duplicate(self, key: Optional[str]) -> bool:
+        """Whether an idempotency key was committed recently (no I/O)."""
+        if key is None:
+            return False
+        if key in self.recent_keys:
+            metrics.cache_hit("idempotency_keys")
+            return True
+        metrics.cache_miss("idempotency_keys")
+        return False
+
+    def _dedupe(
+        self,
+        events: List[UsageEvent],
+        indexes: Sequence[int],
+        results: List[Optional[WriteResult]]
+    ) -> Tuple[List[int], List[Tuple[int, asyncio.Future]]]:
+        """
+        Sort events into new ones (claiming their keys), recent duplicates
+        (their result is filled in) and repeats of keys still in flight.
+
+        Returns:
+            Indexes of the events to queue, and (index, future of the
+            original's usage id) for the in-flight repeats
+        """
+        fresh, waiting = [], []
+        for i in indexes:
+            key = events[i].idempotency_key
+            if key is None:
+                fresh.append(i)
+            elif key in self._in_flight:
+                waiting.append((i, self._in_flight[key]))
+            elif self.is_duplicate(key):
+                results[i] = (self.recent_keys.get(key), False)
+            else:
+                self._in_flight[key] = asyncio.get_running_loop().create_future()
+                fresh.append(i)
+        return fresh, waiting
+
+    async def _wait_in_flight(
+        self,
+        waiting: List[Tuple[int, asyncio.Future]],
+        results: List[Optional[WriteResult]]
+    ) -> List[int]:
+        """
+        Wait for the originals of in-flight repeats and fill in their results.
+
+        Returns:
+            Indexes of the repeats whose original failed, to be queued again
+        """
+        retry = []
+        for i, original in waiting:
+            usage_id = await asyncio.shield(original)
+            if usage_id is None:
+                retry.append(i)
+            else:
+                results[i] = (usage_id, False)
+        return retry
+
+    def _release(self, events: List[UsageEvent], results: Optional[List[WriteResult]] = None):
+        """Resolve the in-flight keys of events: with their usage ids, or None (and forgotten) on failure."""
+        for i, event in enumerate(events):
+            key = event.idempotency_key
+            if key is None:
+                continue
+            if results is None:
+                self.recent_keys.discard(key)
+            original = self._in_flight.pop(key, None)
+            if original is not None and not original.done():
+                original.set_result(None if results is None else results[i][0])
+
+    async def write(self, events: List[UsageEvent]) -> List[WriteResult]:
+        """
+        Queue events and wait for their commit. Inserted events get their `id`.
+
+        Returns:
+            (id, inserted) per event, in order
+        """
+        results: List[Optional[WriteResult]] = [None] * len(events)
+        pending: Sequence[int] = range(len(events))
+        while pending:
+            fresh, waiting = self._dedupe(events, pending, results)
+            if fresh:
+                request = await self._submit([events[i] for i in fresh])
+                for i, result in zip(fresh, await request.committed):
+                    results[i] = result
+            pending = await self._wait_in_flight(waiting, results)
+        return results
+
+    async def append(self, events: List[UsageEvent]) -> List[bool]:
+        """
+        Queue events and wait until they are durable: written to the log, or
+        committed when there is no log. Events with an idempotency key always
+        wait for the commit, since only the insert knows whether the key is
+        already in the table.
+
+        Returns:
+            Per event, False if it was dropped as a duplicate
+        """
+        results: List[Optional[WriteResult]] = [None] * len(events)
+        accepted = [False] * len(events)
+        pending: Sequence[int] = range(len(events))
+        while pending:
+            fresh, waiting = self._dedupe(events, pending, results)
+            if fresh:
+                request = await self._submit([events[i] for i in fresh])
+                if self.log_dir and all(events[i].idempotency_key is None for i in fresh):
+                    await request.logged
+                    for i in fresh:
+                        accepted[i] = True
+                else:
+                    for i, (_, inserted) in zip(fresh, await request.committed):
+                        accepted[i] = inserted
+            pending = await self._wait_in_flight(waiting, results)
+        return accepted
+
+    async def _submit(self, events: List[UsageEvent]) -> _Request:
+        try:
+            if self._closing:
+                raise RuntimeError(f"Usage writer {self.name} is closed")
+            if self._task is None:
+                await self.start()
+        except BaseException:
+            self._release(events)
+            raise
+        request = _Request(events, asyncio.get_running_loop())
+        self._queue.append(request)
+        self._queued_rows += len(events)
+        self._wakeup.set()
+        if self._queued_rows >= self.max_batch:
+            self._full.set()
+        return request
+
+    async def start(self):
+        """Replay orphaned logs (if logging), create this writer's log and start the flusher task."""
+        async with self._start_lock:
+            if self._task is not None:
+                return
+            if self.log_dir:
+                if fcntl is None:
+                    raise RuntimeError("USAGE_WRITER_LOG_DIR needs POSIX file locks (fcntl)")
+                os.makedirs(self.log_dir, exist_ok=True)
+                await self._replay_orphans()
+                self._open_log()
+            self._task = asyncio.create_task(self._run())
+
+    async def close(self):
+        """Flush everything queued, stop the flusher and delete the (fully committed) log."""
+        if self._task is None:
+            return
+        self._closing = True
+        self._wakeup.set()
+        self._full.set()
+        await self._task
+        self._task = None
+        if self._log is not None:
+            await self._discard_log(self.log_path, self.log_name)
+            self._log.close()
+            self._log = None
+
+    def _open_log(self):
+        """Create this writer's log, locked before it is visible under its final name."""
+        self.log_name = f"{self.name}-{os.getpid()}-{uuid.uuid4().hex[:8]}"
+        self.log_path = os.path.join(self.log_dir, f"{self.log_name}.log")
+        tmp_path = f"{self.log_path}.tmp"
+        self._log = open(tmp_path, "ab")
+        fcntl.flock(self._log.fileno(), fcntl.LOCK_EX)
+        os.rename(tmp_path, self.log_path)
+        self._seq = 0
+
+    def _orphan_logs(self) -> List[str]:
+        """Logs of this writer's name, including the unsuffixed log of older versions."""
+        paths = sorted(glob.glob(os.path.join(glob.escape(self.log_dir), f"{glob.escape(self.name)}-*.log")))
+        legacy = os.path.join(self.log_dir, f"{self.name}.log")
+        if os.path.exists(legacy):
+            paths.append(legacy)
+        return paths
+
+    async def _replay_orphans(self):
+        """Commit and delete the logs of this shard that no live writer holds."""
+        for path in self._orphan_logs():
+            f = _lock_orphan(path)
+            if f is None:
+                continue
+            try:
+                await self._replay(path, os.path.basename(path)[:-len(".log")])
+            finally:
+                f.close()
+
+    async def _replay(self, path: str, log_name: str):
+        """Commit a log's entries newer than its checkpoint, then delete the log and checkpoint."""
+        async with self.engine.connect() as conn:
+            last_seq = (await conn.execute(
+                select(IngestCheckpoint.last_seq).where(IngestCheckpoint.name == log_name)
+            )).scalar() or 0
+
+        def read() -> List[Dict[str, Any]]:
+            entries = []
+            with open(path, "rb") as f:
+                for line in f:
+                    try:
+                        entries.append(json.loads(line))
+                    except ValueError:
+                        break  # Torn write: this batch was never acknowledged
+            return entries
+
+        entries = [entry for entry in await asyncio.to_thread(read) if entry["seq"] > last_seq]
+        if entries:
+            replay = [UsageEvent.from_row(entry["row"]) for entry in entries]
+            await self.dimensions.intern_events(self.engine, replay)
+            async with self.engine.begin() as conn:
+                await self._insert_new(conn, replay)
+                await self._checkpoint(conn, log_name, max(entry["seq"] for entry in entries))
+            log.info("ingest_log_replayed", writer=self.name, events=len(replay), path=path)
+        await self._discard_log(path, log_name)
+
+    async def _discard_log(self, path: str, log_name: str):
+        # File first: a checkpoint without its log is harmless, a log without
+        # its checkpoint would be replayed from the start
+        await asyncio.to_thread(os.remove, path)
+        async with self.engine.begin() as conn:
+            await conn.execute(delete(IngestCheckpoint).where(IngestCheckpoint.name == log_name))
+
+    async def _run(self):
+        while self._queue or not self._closing:
+            if not self._queue:
+                self._wakeup.clear()
+                await self._wakeup.wait()
+                continue
+            if self._queued_rows < self.max_batch and self.flush_seconds > 0 and not self._closing:
+                self._full.clear()
+                try:
+                    await asyncio.wait_for(self._full.wait(), self.flush_seconds)
+                except asyncio.TimeoutError:
+                    pass
+
+            batch = [self._queue.popleft()]
+            rows = len(batch[0].events)
+            while self._queue and rows + len(self._queue[0].events) <= self.max_batch:
+                request = self._queue.popleft()
+                batch.append(request)
+                rows += len(request.events)
+            error = await self._flush(batch)
+            if error is None:
+                self._failures = 0
+            else:
+                self._failures += 1
+                if self._failures <= settings.USAGE_WRITER_MAX_RETRIES:
+                    self._queue.extendleft(reversed(batch))
+                    await asyncio.sleep(min(RETRY_SECONDS * 2 ** (self._failures - 1), MAX_RETRY_SECONDS))
+                    continue
+                await self._dead_letter(batch, error)
+                self._failures = 0
+            self._queued_rows -= rows
+
+    async def _flush(self, batch: List[_Request]) -> Optional[Exception]:
+        """
+        Log and commit one batch.
+
+        Returns:
+            The commit's error if it failed and the batch (already
+            acknowledged from the log) must be retried, else None
+        """
+        events = [event for request in batch for event in request.events]
+        unlogged = [request for request in batch if request.last_seq is None]
+        if self._log is not None and unlogged:
+            with metrics.stage("usage_writer", "log"):
+                lines = []
+                for request in unlogged:
+                    for event in request.events:
+                        self._seq += 1
+                        lines.append(json.dumps({"seq": self._seq, "row": event.record()}))
+                    request.last_seq = self._seq
+                await asyncio.to_thread(self._append_log, ("\n".join(lines) + "\n").encode())
+            for request in unlogged:
+                request.logged.set_result(None)
+
+        try:
+            with metrics.stage("usage_writer", "commit"):
+                await self.dimensions.intern_events(self.engine, events)
+                async with self.engine.begin() as conn:
+                    results = await self._insert_new(conn, events)
+                    if self._log is not None:
+                        await self._checkpoint(conn, self.log_name, batch[-1].last_seq)
+        except Exception as e:
+            log.error("usage_commit_failed", writer=self.name, rows=len(events), error=str(e))
+            for event in events:
+                if event.idempotency_key is not None:
+                    self.recent_keys.discard(event.idempotency_key)  # Added by the rolled back insert
+            if self._log is not None:
+                return e  # Acknowledged from the log, so retry
+            self._release(events)
+            for request in batch:
+                request.logged.cancel()
+                request.committed.set_exception(e)
+            return None
+
+        offset = 0
+        for request in batch:
+            if not request.logged.done():
+                request.logged.set_result(None)
+            if not request.committed.done():
+                request.committed.set_result(results[offset:offset + len(request.events)])
+            offset += len(request.events)
+        self._release(events, results)
+
+        if self._log is not None and self._log.tell() > settings.USAGE_WRITER_LOG_MAX_BYTES:
+            self._log.truncate(0)  # Every entry of this writer's log is committed at this point
+            self._log.seek(0)
+        return None
+
+    async def _dead_letter(self, batch: List[_Request], error: Exception):
+        """Move a logged batch that kept failing to the dead-letter file and checkpoint past it."""
+        events = [event for request in batch for event in request.events]
+        path = os.path.join(self.log_dir, f"{self.log_name}.dead")
+        lines = []
+        for request in batch:
+            first_seq = request.last_seq - len(request.events) + 1
+            for seq, event in enumerate(request.events, first_seq):
+                lines.append(json.dumps({"seq": seq, "row": event.record(), "error": str(error)}))
+        await asyncio.to_thread(_append_fsync, path, ("\n".join(lines) + "\n").encode())
+        log.error(
+            "usage_batch_dead_lettered", writer=self.name, rows=len(events), path=path, error=str(error)
+        )
+        self._release(events)
+        for request in batch:
+            request.committed.set_exception(error)
+            request.committed.exception()  # Retrieved: callers acknowledged from the log don't wait for it
+        try:
+            async with self.engine.begin() as conn:
+                await self._checkpoint(conn, self.log_name, batch[-1].last_seq)
+        except Exception as e:
+            # The next committed batch checkpoints past these entries anyway
+            log.error("usage_checkpoint_failed", writer=self.name, error=str(e))
+
+    def _append_log(self, data: bytes):
+        self._log.write(data)
+        self._log.flush()
+        os.fsync(self._log.fileno())
+
+    async def _insert_new(self, conn, events: List[UsageEvent]) -> List[WriteResult]:
+        """
+        Insert events, skipping those whose idempotency key is in the table
+        (or earlier in the batch). Keyed rows use ON CONFLICT DO NOTHING, so a
+        key committed concurrently by another writer does not fail the batch.
+        """
+        results: List[Optional[WriteResult]] = [None] * len(events)
+        unkeyed, first = [], {}
+        for i, event in enumerate(events):
+            key = event.idempotency_key
+            if key is None:
+                unkeyed.append(i)
+            elif key not in first:
+                first[key] = i
+
+        ids = await self._insert(conn, [events[i] for i in unkeyed]) if unkeyed else []
+        for i, usage_id in zip(unkeyed, ids):
+            results[i] = (usage_id, True)
+            events[i].id = usage_id
+        if not first:
+            return results
+
+        inserted = await self._insert_keyed(conn, [events[i] for i in first.values()])
+        missing = [key for key in first if key not in inserted]
+        existing = {}
+        for i in range(0, len(missing), KEY_CHUNK):
+            stmt = select(ApiUsage.idempotency_key, ApiUsage.id).where(
+                ApiUsage.idempotency_key.in_(missing[i:i + KEY_CHUNK])
+            )
+            existing.update((await conn.execute(stmt)).all())
+
+        for i, event in enumerate(events):
+            key = event.idempotency_key
+            if key is None:
+                continue
+            if key in inserted and first[key] == i:
+                results[i] = (inserted[key], True)
+                event.id = inserted[key]
+            else:
+                results[i] = (inserted.get(key, existing.get(key)), False)
+            if results[i][0] is not None:
+                self.recent_keys.add(key, results[i][0])
+        return results
+
+    async def _insert(self, conn, events: List[UsageEvent]) -> List[int]:
+        stmt = insert(ApiUsage).returning(ApiUsage.id, sort_by_parameter_order=True)
+        return list((await conn.execute(stmt, [event.row() for event in events])).scalars())
+
+    async def _insert_keyed(self, conn, events: List[UsageEvent]) -> Dict[str, int]:
+        """Insert events with distinct idempotency keys; returns the ids of the rows inserted by key."""
+        stmt = conflict_insert(conn.dialect)(ApiUsage).on_conflict_do_nothing(
+            index_elements=[ApiUsage.idempotency_key]
+        ).returning(ApiUsage.idempotency_key, ApiUsage.id)
+        return dict((await conn.execute(stmt, [event.row() for event in events])).all())
+
+    async def _checkpoint(self, conn, log_name: str, last_seq: int):
+        values = {"last_seq": last_seq, "updated_at": datetime.utcnow()}
+        result = await conn.execute(
+            update(IngestCheckpoint).where(IngestCheckpoint.name == log_name).values(**values)
+        )
+        if result.rowcount == 0:
+            await conn.execute(insert(IngestCheckpoint).values(name=log_name, **values))
+
+
+def _append_fsync(path: str, data: bytes):
+    with open(path, "ab") as f:
+        f.write(data)
+        f.flush()
+        os.fsync(f.fileno())
+
+
+def _lock_orphan(path: str):
+    """
+    Open and exclusively lock a log no live writer holds.
+
+    Returns:
+        The open file (closing it releases the lock), or None if another
+        writer holds the log or it was replayed and deleted meanwhile
+    """
+    try:
+        f = open(path, "rb")
+    except FileNotFoundError:
+        return None
+    try:
+        fcntl.flock(f.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+        if os.path.samestat(os.fstat(f.fileno()), os.stat(path)):
+            return f
+    except (BlockingIOError, FileNotFoundError):
+        pass
+    f.close()
+    return None
+
+
+def get_usage_writer(user_address: str) -> UsageWriter:
+    """Usage writer of the local shard holding a user's data."""
+    shard = get_shard_router().shard_for(user_address)
+    return shard.cache(
+        "usage_writer",
+        lambda: UsageWriter(shard.engine, f"usage-shard-{shard.index}", dimensions=shard_dimensions(shard))
+    )
+
+
+def queue_depths():
+    """Queued usage rows per local shard (gauge values)."""
+    values = []
+    for shard in get_shard_router().local_shards:
+        writer = shard.cached("usage_writer")
+        values.append(({"shard": str(shard.index)}, writer.queue_depth if writer else 0))
+    return values
+
+
+async def close_usage_writers():
+    """Flush and stop every local shard's writer (app shutdown)."""
+    for shard in get_shard_router().local_shards:
+        writer = shard.cached("usage_writer")
+        if writer is not None:
+            await writer.close()
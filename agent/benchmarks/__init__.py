@@ -0,0 +1,3 @@
+"""
+Benchmarks for AI Budget Guardian.
+"""
@@ -0,0 +1,213 @@
+"""
+Benchmark: columnar analytics vs. per-row ORM loops.
+
+Compares the vectorized UsageColumns path against the original loops used by
+analyze_spending, generate_monthly_report and
+AIAnalyzer._prepare_analysis_context.
+
+Usage:
+    python -m benchmarks.bench_analytics
+    python -m benchmarks.bench_analytics --rows 100000 1000000 --with-db
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import tempfile
+import time
+from datetime import datetime, timedelta
+from types import SimpleNamespace
+from typing import Dict, Any, List, Callable, Tuple
+
+import numpy as np
+
+from app.analytics import UsageColumns, USAGE_COLUMNS
+
+
+def generate_rows(n: int, seed: int = 42) -> Tuple[List[tuple], Dict[int, Tuple[str, str]]]:
+    """
+    Generate synthetic (api_dim_id, cost_micros, request_count, tokens_used, timestamp) rows.
+
+    Returns:
+        Tuple of (rows, (provider, api_name) per api_dim_id)
+    """
+    rng = np.random.default_rng(seed)
+    providers = [f"provider-{i}" for i in range(8)]
+    api_names = [f"api-{i}" for i in range(50)]
+    start = datetime.utcnow() - timedelta(days=30)
+    offsets = rng.integers(0, 30 * 24 * 3600, size=n).tolist()
+    provider_idx = rng.integers(0, len(providers), size=n).tolist()
+    api_idx = rng.zipf(1.5, size=n) % len(api_names)
+    costs = np.round(rng.gamma(2.0, 0.01, size=n) * 1_000_000).astype(np.int64).tolist()
+    tokens = rng.integers(0, 4000, size=n).tolist()
+    labels = {
+        1 + p * len(api_names) + a: (provider, api_name)
+        for p, provider in enumerate(providers)
+        for a, api_name in enumerate(api_names)
+    }
+    rows = [
+        (
+            1 + provider_idx[i] * len(api_names) + int(api_idx[i]),
+            costs[i],
+            1,
+            tokens[i],
+            start + timedelta(seconds=offsets[i])
+        )
+        for i in range(n)
+    ]
+    return rows, labels
+
+
+def legacy_breakdown(records: List[Any]) -> Dict[str, Any]:
+    """Per-row loops as in analyze_spending / generate_monthly_report / _prepare_analysis_context."""
+    api_breakdown = {}
+    for u in records:
+        key = f"{u.provider}:{u.api_name}"
+        if key not in api_breakdown:
+            api_breakdown[key] = {
+                "provider": u.provider,
+                "api_name": u.api_name,
+                "total_cost": 0,
+                "request_count": 0,
+                "avg_cost_per_request": 0
+            }
+        api_breakdown[key]["total_cost"] += u.cost
+        api_breakdown[key]["request_count"] += u.request_count
+    for key in api_breakdown:
+        data = api_breakdown[key]
+        if data["request_count"] > 0:
+            data["avg_cost_per_request"] = data["total_cost"] / data["request_count"]
+
+    report_breakdown = {}
+    for u in records:
+        key = f"{u.provider}:{u.api_name}"
+        report_breakdown[key] = report_breakdown.get(key, 0) + u.cost
+
+    usage_data = [
+        {
+            "api_name": u.api_name,
+            "provider": u.provider,
+            "cost": u.cost,
+            "request_count": u.request_count,
+            "tokens_used": u.tokens_used,
+            "timestamp": u.timestamp.isoformat()
+        }
+        for u in records
+    ]
+    context = {}
+    for usage in usage_data:
+        api_key = f"{usage.get('provider')}:{usage.get('api_name')}"
+        if api_key not in context:
+            context[api_key] = {"total_cost": 0, "request_count": 0, "tokens_used": 0}
+        context[api_key]["total_cost"] += usage.get("cost", 0)
+        context[api_key]["request_count"] += usage.get("request_count", 1)
+        context[api_key]["tokens_used"] += usage.get("tokens_used", 0)
+
+    return {"analysis": api_breakdown, "report": report_breakdown, "context": context}
+
+
+def columnar_breakdown(rows: List[tuple], labels: Dict[int, Tuple[str, str]]) -> Dict[str, Any]:
+    """Vectorized equivalent of legacy_breakdown, including column packing."""
+    usage = UsageColumns.from_rows(rows, labels)
+    return {
+        "analysis": usage.breakdown(),
+        "report": usage.cost_by_key(),
+        "hourly": usage.hourly_histogram(),
+    }
+
+
+def best_of(fn: Callable[[], Any], repeat: int) -> float:
+    """Best wall-clock time of `repeat` runs, in seconds."""
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+async def bench_fetch(rows: List[tuple], labels: Dict[int, Tuple[str, str]], repeat: int) -> Dict[str, float]:
+    """Time ORM entity fetch vs. Core tuple fetch from SQLite."""
+    from sqlalchemy import select
+    from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker
+    from app.database import Base, ApiUsage, ApiDimension
+
+    with tempfile.TemporaryDirectory() as tmp:
+        engine = create_async_engine(f"sqlite+aiosqlite:///{os.path.join(tmp, 'bench.db')}")
+        async with engine.begin() as conn:
+            await conn.run_sync(Base.metadata.create_all)
+            await conn.execute(ApiDimension.__table__.insert(), [
+                {"id": dim_id, "provider": provider, "api_id": api_name, "api_name": api_name}
+                for dim_id, (provider, api_name) in labels.items()
+            ])
+            await conn.execute(ApiUsage.__table__.insert(), [
+                {
+                    "user_address": "0xbench", "api_dim_id": r[0], "cost": r[1] / 1_000_000,
+                    "cost_micros": r[1], "request_count": r[2], "tokens_used": r[3], "timestamp": r[4]
+                }
+                for r in rows
+            ])
+        session_maker = async_sessionmaker(engine, expire_on_commit=False)
+
+        async def fetch_orm():
+            async with session_maker() as db:
+                # Entities with their API names joined on (no longer api_usage columns)
+                records = []
+                stmt = select(ApiUsage, ApiDimension.provider, ApiDimension.api_name).join(
+                    ApiDimension, ApiDimension.id == ApiUsage.api_dim_id
+                )
+                for usage, provider, api_name in (await db.execute(stmt)).all():
+                    usage.provider, usage.api_name = provider, api_name
+                    records.append(usage)
+                legacy_breakdown(records)
+
+        async def fetch_core():
+            async with session_maker() as db:
+                result = await db.execute(select(*USAGE_COLUMNS))
+                usage = UsageColumns.from_rows(result.all(), labels)
+                usage.breakdown()
+                usage.cost_by_key()
+
+        timings = {}
+        for name, fn in (("orm_fetch_and_loop", fetch_orm), ("core_fetch_and_vectorized", fetch_core)):
+            best = float("inf")
+            for _ in range(repeat):
+                start = time.perf_counter()
+                await fn()
+                best = min(best, time.perf_counter() - start)
+            timings[name] = best
+        await engine.dispose()
+        return timings
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rows", type=int, nargs="+", default=[100_000, 1_000_000])
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--with-db", action="store_true", help="Also benchmark fetching from SQLite")
+    args = parser.parse_args()
+
+    for n in args.rows:
+        rows, labels = generate_rows(n)
+        records = [
+            SimpleNamespace(
+                provider=labels[r[0]][0], api_name=labels[r[0]][1], cost=r[1] / 1_000_000,
+                request_count=r[2], tokens_used=r[3], timestamp=r[4]
+            )
+            for r in rows
+        ]
+        result = {
+            "benchmark": "analytics",
+            "rows": n,
+            "legacy_loop_s": best_of(lambda: legacy_breakdown(records), args.repeat),
+            "columnar_s": best_of(lambda: columnar_breakdown(rows, labels), args.repeat),
+        }
+        result["speedup"] = result["legacy_loop_s"] / result["columnar_s"]
+        if args.with_db:
+            result.update(asyncio.run(bench_fetch(rows, labels, args.repeat)))
+        print(json.dumps(result))
+
+
+if __name__ == "__main__":
+    main()
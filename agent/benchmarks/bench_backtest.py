@@ -0,0 +1,182 @@
+"""
+Benchmark: vectorized policy backtest vs. a per-event replay.
+
+Generates a fleet's usage (steady traffic with occasional bursts, and a
+monthly limit per user near its expected spend), then replays it through a
+few policy variants twice: with app.backtest (NumPy passes, window sums
+computed once for all variants) and with a per-event loop applying the same
+rules call by call. Both must report the same counts.
+
+Usage:
+    python -m benchmarks.bench_backtest
+    python -m benchmarks.bench_backtest --users 200 --days 30
+"""
+
+import argparse
+import json
+import time
+from bisect import bisect_right
+from datetime import datetime, timedelta
+from typing import Any, Dict, List, Sequence, Tuple
+
+import numpy as np
+
+from app.backtest import UsageSeries, BASELINE_DAYS, DAY, MIN_RECENT_CALLS, epoch_micros, _month_ends
+from app.config import settings
+from app.money import MICROS
+from app.schemas import BacktestPolicy
+
+POLICIES = [
+    BacktestPolicy(),
+    BacktestPolicy(name="early_warning", warning_threshold=0.6, critical_threshold=0.85),
+    BacktestPolicy(name="strict_pause", pause_threshold=0.9),
+    BacktestPolicy(name="relaxed", unusual_pattern_multiplier=10.0),
+    BacktestPolicy(name="lenient", unusual_pattern_multiplier=30.0),
+]
+
+
+def generate(users: int, days: int, now: datetime, seed: int = 7) -> Tuple[List[tuple], Dict[str, Dict[str, Any]]]:
+    """Usage rows over `days` plus the baseline before them, and a budget config per user."""
+    rng = np.random.default_rng(seed)
+    span = (days + BASELINE_DAYS) * DAY
+    start = now - timedelta(seconds=span)
+    rows, configs = [], {}
+    for u in range(users):
+        address = f"0x{u:040x}"
+        calls_per_day = float(rng.uniform(50, 400))
+        unit_cost = int(rng.integers(500, 20_000))
+        n = rng.poisson(calls_per_day * span / DAY)
+        offsets = rng.uniform(0, span, n)
+        costs = rng.integers(unit_cost // 2, unit_cost * 2, n)
+        for _ in range(rng.poisson(days / 5)):  # Bursts: many expensive calls within a few minutes
+            at = rng.uniform(0, span)
+            k = int(rng.integers(20, 200))
+            offsets = np.concatenate((offsets, at + rng.uniform(0, 180, k)))
+            costs = np.concatenate((costs, rng.integers(unit_cost * 5, unit_cost * 20, k)))
+        offsets = np.minimum(offsets, span - 1)
+        rows.extend(
+            (address, start + timedelta(seconds=s), c) for s, c in zip(offsets.tolist(), costs.tolist())
+        )
+        configs[address] = {
+            "monthly_limit_micros": int(calls_per_day * 30 * unit_cost * 1.25 * rng.uniform(0.6, 1.4)),
+            "warning_threshold": 0.8,
+            "pause_threshold": 1.0
+        }
+    return rows, configs
+
+
+def replay_per_event(
+    rows: Sequence[tuple],
+    configs: Dict[str, Dict[str, Any]],
+    policy: BacktestPolicy,
+    since: float,
+    until: float,
+    incident_ratio: float
+) -> Dict[str, Dict[str, int]]:
+    """The same rules applied call by call (reference for the vectorized replay)."""
+    w = settings.ANALYSIS_WINDOW_MINUTES * 60
+    multiplier = policy.unusual_pattern_multiplier or settings.UNUSUAL_PATTERN_MULTIPLIER
+    per_user: Dict[str, List[Tuple[float, int, int]]] = {}
+    micros = epoch_micros(r[1] for r in rows)
+    stamps = (micros / 1e6).tolist()
+    month_ends = _month_ends(micros.astype("datetime64[us]").astype("datetime64[M]")).tolist()
+    for (address, _, cost), t, month_end in zip(rows, stamps, month_ends):
+        per_user.setdefault(address, []).append((t, cost, month_end))
+
+    alerts = {"warning": 0, "critical": 0, "pause": 0, "unusual_pattern": 0}
+    false_positives = {"warning": 0, "critical": 0, "unusual_pattern": 0}
+    for address, events in per_user.items():
+        events.sort()
+        times = [e[0] for e in events]
+        prefix = [0]
+        for _, cost, _ in events:
+            prefix.append(prefix[-1] + cost)
+        month_totals: Dict[float, int] = {}
+        for _, cost, month_end in events:
+            month_totals[month_end] = month_totals.get(month_end, 0) + cost
+
+        config = configs.get(address)
+        limit = config["monthly_limit_micros"] if config else 0
+        levels = {
+            "warning": policy.warning_threshold or (config or {}).get("warning_threshold") or 0.8,
+            "critical": policy.critical_threshold or settings.CRITICAL_THRESHOLD,
+            "pause": policy.pause_threshold or (config or {}).get("pause_threshold") or 1.0,
+        }
+        month_spend, current_month, crossed = 0, None, set()
+        last_slot = None
+        for i, (t, cost, month_end) in enumerate(events):
+            if month_end != current_month:
+                month_spend, current_month, crossed = 0, month_end, set()
+            month_spend += cost
+            in_range = since <= t < until
+            for alert_type, fraction in levels.items():
+                if limit > 0 and alert_type not in crossed and month_spend >= limit * fraction:
+                    crossed.add(alert_type)
+                    if not in_range:
+                        continue  # Crossed before the replayed period
+                    alerts[alert_type] += 1
+                    if alert_type != "pause" and month_end <= until and month_totals[month_end] < limit:
+                        false_positives[alert_type] += 1
+            if not in_range:
+                continue
+
+            def window(low: float, high: float) -> Tuple[int, int]:
+                lo, hi = bisect_right(times, t + low), bisect_right(times, t + high)
+                return hi - lo, prefix[hi] - prefix[lo]
+
+            recent_calls, recent_cost = window(-w, 0)
+            if recent_calls < MIN_RECENT_CALLS:
+                continue
+            baseline_calls, baseline_cost = window(-w - BASELINE_DAYS * DAY, -w)
+            avg_rate = baseline_calls / (BASELINE_DAYS * 1440)
+            avg_cost = baseline_cost / MICROS / (BASELINE_DAYS * 1440)
+            rate_mult = (recent_calls / (w / 60)) / max(0.01, avg_rate) if avg_rate > 0 else 1
+            cost_mult = (recent_cost / MICROS / (w / 60)) / max(0.01, avg_cost) if avg_cost > 0 else 1
+            slot = int(t // w)
+            if (rate_mult > multiplier or cost_mult > multiplier) and slot != last_slot:
+                last_slot = slot
+                alerts["unusual_pattern"] += 1
+                _, next_day = window(0, DAY)
+                if t + DAY <= until and next_day <= incident_ratio * baseline_cost / BASELINE_DAYS:
+                    false_positives["unusual_pattern"] += 1
+    return {"alerts": alerts, "false_positives": false_positives}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--users", type=int, default=50)
+    parser.add_argument("--days", type=int, default=30)
+    args = parser.parse_args()
+
+    now = datetime(2026, 3, 20, 12, 0)
+    rows, configs = generate(args.users, args.days, now)
+    since, until = (epoch_micros([now - timedelta(days=args.days), now]) / 1e6).tolist()
+
+    start = time.perf_counter()
+    series = UsageSeries(rows, configs, settings.ANALYSIS_WINDOW_MINUTES * 60)
+    vectorized = [series.replay(policy, since, until, 2.0) for policy in POLICIES]
+    vectorized_s = time.perf_counter() - start
+
+    start = time.perf_counter()
+    reference = [replay_per_event(rows, configs, policy, since, until, 2.0) for policy in POLICIES]
+    per_event_s = time.perf_counter() - start
+
+    for policy, v, r in zip(POLICIES, vectorized, reference):
+        for field in ("alerts", "false_positives"):
+            if v[field] != r[field]:
+                raise SystemExit(f"{policy.name} {field}: {v[field]} != {r[field]}")
+    print(json.dumps({
+        "benchmark": "backtest",
+        "rows": len(rows),
+        "users": args.users,
+        "policies": len(POLICIES),
+        "vectorized_s": vectorized_s,
+        "per_event_s": per_event_s,
+        "speedup": per_event_s / vectorized_s,
+        "alerts": {p.name: v["alerts"] for p, v in zip(POLICIES, vectorized)},
+        "false_positives": {p.name: v["false_positives"] for p, v in zip(POLICIES, vectorized)},
+    }))
+
+
+if __name__ == "__main__":
+    main()
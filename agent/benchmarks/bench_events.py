@@ -0,0 +1,106 @@
+"""
+Benchmark: UsageEvent vs. the dict/ORM representations it replaced.
+
+Measures, per event:
+- memory held while queued or cached: a column dict before, a UsageEvent now
+- the ingest path from request model to what the queue and windows keep:
+  before, a column dict, an ORM ApiUsage and a sample dict; now one UsageEvent
+
+Usage:
+    python -m benchmarks.bench_events
+    python -m benchmarks.bench_events --events 100000
+"""
+
+import argparse
+import gc
+import json
+import time
+import tracemalloc
+from datetime import datetime
+from typing import Any, Callable, Dict, List
+
+from app.database import ApiUsage
+from app.money import to_micros
+from app.schemas import ApiUsageCreate
+from app.usage_event import UsageEvent
+from benchmarks.generators import UsageGenerator
+
+
+def legacy_row(usage: ApiUsageCreate) -> Dict[str, Any]:
+    """Column dict as built by the former usage_writer.usage_row."""
+    return {
+        "user_address": usage.user_address,
+        "api_id": usage.api_id,
+        "api_name": usage.api_name,
+        "provider": usage.provider,
+        "cost": usage.cost,
+        "cost_micros": to_micros(usage.cost),
+        "request_count": usage.request_count,
+        "tokens_used": usage.tokens_used,
+        "endpoint": usage.endpoint,
+        "status": usage.status,
+        "extra_data": usage.metadata,
+        "idempotency_key": usage.idempotency_key,
+        "timestamp": datetime.utcnow()
+    }
+
+
+def legacy_ingest(usage: ApiUsageCreate):
+    """Former ingest path: column dict, ORM object for the window, sample dict for the analyzer."""
+    row = legacy_row(usage)
+    # The API names are no longer api_usage columns, so the ORM object gets the rest
+    orm = ApiUsage(**{k: v for k, v in row.items() if k not in ("provider", "api_id", "api_name")})
+    sample = {
+        "api_name": row["api_name"],
+        "provider": row["provider"],
+        "cost": orm.cost,
+        "timestamp": orm.timestamp.isoformat()
+    }
+    return row, sample
+
+
+def retained(build: Callable[[ApiUsageCreate], Any], requests: List[ApiUsageCreate]) -> float:
+    """Bytes allocated per event and still held once all events are built."""
+    gc.collect()
+    tracemalloc.start()
+    held = [build(r) for r in requests]
+    current, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    del held
+    return current / len(requests)
+
+
+def throughput(build: Callable[[ApiUsageCreate], Any], requests: List[ApiUsageCreate], repeat: int) -> float:
+    """Best events per second over `repeat` runs."""
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        for r in requests:
+            build(r)
+        best = min(best, time.perf_counter() - start)
+    return len(requests) / best
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--events", type=int, default=50_000)
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    gen = UsageGenerator(seed=1)
+    requests = [ApiUsageCreate(**event) for event in gen.usage_events(args.events)]
+    result = {
+        "benchmark": "usage_events",
+        "events": args.events,
+        "queued_bytes_per_event_dict": retained(legacy_row, requests),
+        "queued_bytes_per_event_slots": retained(UsageEvent.from_create, requests),
+        "ingest_bytes_per_event_legacy": retained(legacy_ingest, requests),
+        "ingest_bytes_per_event_slots": retained(UsageEvent.from_create, requests),
+        "ingest_events_per_s_legacy": throughput(legacy_ingest, requests, args.repeat),
+        "ingest_events_per_s_slots": throughput(UsageEvent.from_create, requests, args.repeat),
+    }
+    print(json.dumps(result))
+
+
+if __name__ == "__main__":
+    main()
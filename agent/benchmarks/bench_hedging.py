@@ -0,0 +1,125 @@
+"""
+Benchmark: hedged LLM requests across two providers vs. a single provider.
+
+Both providers are stubbed with heavy-tailed latencies: a lognormal body
+around `--median-ms`, plus `--stall-rate` of requests that take
+`--stall-ms`. The slower provider has a higher median and also fails
+`--error-rate` of its requests. `--requests` analyses run sequentially
+through AIAnalyzer with AI_PROVIDER=openai, then with AI_PROVIDER=hedged,
+and the latency percentiles, requests sent and fallbacks are compared.
+Hedge delays are scaled to the stub latencies.
+
+Usage:
+    python -m benchmarks.bench_hedging
+    python -m benchmarks.bench_hedging --requests 1000 --stall-rate 0.05
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import time
+from types import SimpleNamespace
+from typing import Any, Dict, List
+
+import numpy as np
+
+from benchmarks.stubs import ANALYSIS_RESPONSE
+
+
+class StubProvider:
+    """AsyncOpenAI stand-in with sampled latency and failures."""
+
+    def __init__(self, rng: np.random.Generator, median_s: float, stall_rate: float, stall_s: float, error_rate: float):
+        self.rng = rng
+        self.median_s = median_s
+        self.stall_rate = stall_rate
+        self.stall_s = stall_s
+        self.error_rate = error_rate
+        self.calls = 0
+        self.chat = SimpleNamespace(completions=self)
+
+    async def create(self, **kwargs) -> Any:
+        self.calls += 1
+        stalled = self.rng.random() < self.stall_rate
+        latency = self.stall_s if stalled else self.median_s * float(self.rng.lognormal(0, 0.3))
+        failed = self.rng.random() < self.error_rate
+        await asyncio.sleep(latency)
+        if failed:
+            raise RuntimeError("stub provider error")
+        message = SimpleNamespace(content=json.dumps(ANALYSIS_RESPONSE))
+        return SimpleNamespace(choices=[SimpleNamespace(message=message)])
+
+
+async def run_mode(mode: str, args: argparse.Namespace) -> Dict[str, Any]:
+    from app import ai_analyzer
+    from app.analytics import UsageColumns
+    from app.config import settings
+
+    settings.AI_PROVIDER = mode
+    rng = np.random.default_rng(11)
+    providers = {
+        "openai": StubProvider(rng, args.median_ms / 1000, args.stall_rate, args.stall_ms / 1000, 0.0),
+        "deepseek": StubProvider(rng, args.median_ms * 1.5 / 1000, args.stall_rate, args.stall_ms / 1000, args.error_rate),
+    }
+    ai_analyzer._clients.clear()
+    ai_analyzer._clients.update(providers)
+    ai_analyzer._stats.clear()
+
+    analyzer = ai_analyzer.AIAnalyzer()
+    usage = UsageColumns.from_records([])
+    budget = {"monthly_limit": 100.0, "current_spend": 10.0, "percentage_used": 10.0, "days_remaining": 20}
+    latencies: List[float] = []
+    fallbacks = 0
+    for _ in range(args.requests):
+        start = time.perf_counter()
+        analysis = await analyzer.analyze_spending_patterns(usage, budget)
+        latencies.append(time.perf_counter() - start)
+        fallbacks += analysis["summary"] != ANALYSIS_RESPONSE["summary"]
+    await asyncio.sleep(0)  # Let cancelled attempts finish
+
+    p50, p95, p99 = np.percentile(latencies, [50, 95, 99]) * 1000
+    return {
+        "p50_ms": round(float(p50), 1),
+        "p95_ms": round(float(p95), 1),
+        "p99_ms": round(float(p99), 1),
+        "max_ms": round(max(latencies) * 1000, 1),
+        "provider_calls": {name: p.calls for name, p in providers.items()},
+        "extra_requests": round(sum(p.calls for p in providers.values()) / args.requests - 1, 3),
+        "fallbacks": fallbacks
+    }
+
+
+async def run(args: argparse.Namespace) -> Dict[str, Any]:
+    single = await run_mode("openai", args)
+    hedged = await run_mode("hedged", args)
+    return {
+        "benchmark": "hedging",
+        "requests": args.requests,
+        "stall_rate": args.stall_rate,
+        "single": single,
+        "hedged": hedged,
+        "p99_speedup": single["p99_ms"] / hedged["p99_ms"]
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--requests", type=int, default=400)
+    parser.add_argument("--median-ms", type=float, default=20.0)
+    parser.add_argument("--stall-rate", type=float, default=0.03)
+    parser.add_argument("--stall-ms", type=float, default=400.0)
+    parser.add_argument("--error-rate", type=float, default=0.05)
+    args = parser.parse_args()
+
+    os.environ.setdefault("OPENAI_API_KEY", "sk-benchmark")
+    os.environ.setdefault("DEEPSEEK_API_KEY", "sk-benchmark")
+    os.environ.setdefault("LOG_LEVEL", "WARNING")
+    # Stub latencies are milliseconds rather than seconds, so scale the hedge delays down too
+    os.environ.setdefault("AI_HEDGE_MIN_DELAY_SECONDS", str(args.median_ms / 2000))
+    os.environ.setdefault("AI_HEDGE_DEFAULT_DELAY_SECONDS", str(args.median_ms * 5 / 1000))
+    print(json.dumps(asyncio.run(run(args))))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,186 @@
+"""
+Benchmark: batch monthly reports vs. one report per user.
+
+Seeds `--users` budgets with usage this month (some of it rolled up), alerts
+and applied optimizations, then generates every user's report twice: with
+the former per-user path (config, usage columns, alert count, optimization
+totals, insert: five queries and a commit per user) and with
+app.reports.run_monthly_reports (grouped queries and one insert per chunk).
+Both must produce the same figures.
+
+Usage:
+    python -m benchmarks.bench_reports
+    python -m benchmarks.bench_reports --users 5000 --rows-per-user 100
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import tempfile
+import time
+from datetime import datetime, timedelta
+from typing import Any, Dict, Tuple
+
+import numpy as np
+
+
+async def seed(users: int, rows_per_user: int) -> datetime:
+    """Budgets, usage, alerts and applied optimizations for `users` users; returns the month start."""
+    from sqlalchemy import insert
+    from app.database import ApiUsage, BudgetAlert, BudgetConfig, Optimization
+    from app.dimensions import shard_dimensions
+    from app.retention import rollup_usage
+    from app.sharding import get_shard_router
+
+    router = get_shard_router()
+    await router.init_db()
+    now = datetime.utcnow()
+    month_start = now.replace(day=1, hour=0, minute=0, second=0, microsecond=0)
+    span = max((now - month_start).total_seconds(), 3600)
+    rng = np.random.default_rng(3)
+    apis = [("openai", f"gpt-{i}", f"GPT {i}") for i in range(6)] + [("anthropic", f"claude-{i}", f"Claude {i}") for i in range(4)]
+
+    for shard in router.local_shards:
+        addresses = [f"0x{u:040x}" for u in range(users) if router.shard_for(f"0x{u:040x}") is shard]
+        usage = []
+        for address in addresses:
+            offsets = rng.uniform(0, span, rows_per_user).tolist()
+            picks = rng.integers(0, len(apis), rows_per_user).tolist()
+            costs = rng.integers(100, 50_000, rows_per_user).tolist()
+            for offset, pick, cost in zip(offsets, picks, costs):
+                provider, api_id, api_name = apis[pick]
+                usage.append({
+                    "user_address": address, "provider": provider, "api_id": api_id, "api_name": api_name,
+                    "cost": cost / 1e6, "cost_micros": cost, "request_count": 1,
+                    "timestamp": month_start + timedelta(seconds=offset)
+                })
+        await shard_dimensions(shard).intern_rows(shard.engine, usage)
+        async with shard.engine.begin() as conn:
+            await conn.execute(insert(BudgetConfig), [
+                {"user_address": a, "monthly_limit": 100.0, "monthly_limit_micros": 100_000_000} for a in addresses
+            ])
+            for i in range(0, len(usage), 10_000):
+                await conn.execute(insert(ApiUsage), usage[i:i + 10_000])
+            await conn.execute(insert(BudgetAlert), [
+                {
+                    "user_address": a, "alert_type": "warning", "severity": "warning", "message": "80%",
+                    "current_spend": 80.0, "budget_limit": 100.0, "created_at": now - timedelta(minutes=k)
+                }
+                for a in addresses[::3] for k in range(3)
+            ])
+            await conn.execute(insert(Optimization), [
+                {
+                    "user_address": a, "optimization_type": "caching", "current_api": "openai:gpt-0",
+                    "estimated_savings": 2.5, "description": "Cache", "is_applied": True, "applied_at": now
+                }
+                for a in addresses[::4]
+            ])
+        async with shard.session_maker() as db:
+            await rollup_usage(db, until=now.replace(hour=0, minute=0, second=0, microsecond=0))
+    return month_start
+
+
+async def legacy_report(db, user_address: str, start_of_month: datetime) -> Dict[str, Any]:
+    """The former generate_monthly_report: five queries and a commit per user."""
+    from sqlalchemy import select, func, and_
+    from app.analytics import fetch_usage_columns
+    from app.database import BudgetAlert, BudgetConfig, MonthlyReport, Optimization
+    from app.money import from_micros
+
+    config = (await db.execute(select(BudgetConfig).where(BudgetConfig.user_address == user_address))).scalar_one()
+    usage = await fetch_usage_columns(db, user_address, start_of_month)
+    alerts_count = (await db.execute(select(func.count(BudgetAlert.id)).where(
+        and_(BudgetAlert.user_address == user_address, BudgetAlert.created_at >= start_of_month)
+    ))).scalar() or 0
+    opt_data = (await db.execute(select(func.count(Optimization.id), func.sum(Optimization.estimated_savings)).where(
+        and_(
+            Optimization.user_address == user_address,
+            Optimization.is_applied == True,
+            Optimization.applied_at >= start_of_month
+        )
+    ))).one()
+    report = MonthlyReport(
+        user_address=user_address, month=start_of_month.strftime("%Y-%m"), total_spent=usage.total_cost(),
+        budget_limit=from_micros(config.monthly_limit_micros), api_breakdown=usage.cost_by_key(),
+        alerts_triggered=alerts_count, optimizations_applied=opt_data[0] or 0, cost_saved=opt_data[1] or 0,
+        projected_cost_without_guardian=usage.total_cost() + (opt_data[1] or 0)
+    )
+    db.add(report)
+    await db.commit()
+    return _figures(report.__dict__)
+
+
+def _figures(row: Dict[str, Any]) -> Tuple:
+    return (
+        round(row["total_spent"], 6),
+        tuple(sorted((k, round(v, 6)) for k, v in row["api_breakdown"].items())),
+        row["alerts_triggered"],
+        row["optimizations_applied"],
+        round(row["cost_saved"], 6)
+    )
+
+
+async def run(users: int, rows_per_user: int, workers: int) -> Dict[str, Any]:
+    from sqlalchemy import select, delete
+    from app.database import BudgetConfig, MonthlyReport
+    from app.reports import run_monthly_reports
+    from app.sharding import get_shard_router
+
+    month_start = await seed(users, rows_per_user)
+    router = get_shard_router()
+
+    legacy: Dict[str, Tuple] = {}
+    start = time.perf_counter()
+    for shard in router.local_shards:
+        async with shard.session_maker() as db:
+            for address in (await db.execute(select(BudgetConfig.user_address))).scalars().all():
+                legacy[address] = await legacy_report(db, address, month_start)
+    legacy_s = time.perf_counter() - start
+
+    for shard in router.local_shards:
+        async with shard.session_maker() as db:
+            await db.execute(delete(MonthlyReport))
+            await db.commit()
+
+    start = time.perf_counter()
+    result = await run_monthly_reports(workers=workers)
+    batch_s = time.perf_counter() - start
+
+    batch: Dict[str, Tuple] = {}
+    for shard in router.local_shards:
+        async with shard.session_maker() as db:
+            for report in (await db.execute(select(MonthlyReport))).scalars().all():
+                batch[report.user_address] = _figures(report.__dict__)
+    if batch != legacy:
+        different = [a for a in legacy if legacy[a] != batch.get(a)]
+        raise SystemExit(f"reports differ for {len(different)} users, e.g. {different[:1]}")
+
+    return {
+        "benchmark": "monthly_reports",
+        "users": users,
+        "rows": users * rows_per_user,
+        "workers": workers,
+        "per_user_s": legacy_s,
+        "batch_s": batch_s,
+        "speedup": legacy_s / batch_s,
+        "reports": result["done"]
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--users", type=int, default=2000)
+    parser.add_argument("--rows-per-user", type=int, default=50)
+    parser.add_argument("--workers", type=int, default=4)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        os.environ["DATABASE_URL"] = f"sqlite+aiosqlite:///{os.path.join(tmp, 'bench.db')}"
+        os.environ["ARCHIVE_DIR"] = os.path.join(tmp, "archive")
+        os.environ.setdefault("LOG_LEVEL", "WARNING")
+        print(json.dumps(asyncio.run(run(args.users, args.rows_per_user, args.workers))))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,125 @@
+"""
+Benchmark: list endpoints with direct row serialization vs. double validation.
+
+Serves /api/alerts/{user} and /api/optimizations/{user} for a user with
+`--rows` alerts and optimizations, in-process over ASGI, and compares the
+current endpoints (mappings encoded as-is, see app.responses) against the
+former ones (ORM objects, `model_validate` per row, then FastAPI's
+`response_model` validation). Both must return the same JSON.
+
+Usage:
+    python -m benchmarks.bench_responses
+    python -m benchmarks.bench_responses --rows 1000 --requests 200
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import tempfile
+import time
+from datetime import datetime, timedelta
+from typing import Any, Dict, List
+
+USER = "0x" + "be" * 20
+
+
+async def seed(n: int):
+    """Insert `n` alerts and `n` pending optimizations for USER."""
+    from sqlalchemy import insert
+    from app.database import BudgetAlert, Optimization
+    from app.sharding import get_shard_router
+
+    router = get_shard_router()
+    await router.init_db()
+    now = datetime.utcnow()
+    async with router.shard_for(USER).engine.begin() as conn:
+        await conn.execute(insert(BudgetAlert), [
+            {
+                "user_address": USER, "alert_type": "warning", "severity": "warning",
+                "message": f"⚠️ WARNING: {80 + i % 20}% of budget used", "current_spend": 80.0 + i / 7,
+                "budget_limit": 100.0, "recommendation": None if i % 2 else "Slow down",
+                "extra_data": {"i": i} if i % 3 else None, "is_read": bool(i % 5 == 0),
+                "created_at": now - timedelta(seconds=i)
+            }
+            for i in range(n)
+        ])
+        await conn.execute(insert(Optimization), [
+            {
+                "user_address": USER, "optimization_type": "caching", "current_api": f"openai:api-{i}",
+                "suggested_api": None, "estimated_savings": round(1000.0 / (i + 1), 2),
+                "description": "Caching responses would avoid repeated calls.", "is_applied": False,
+                "extra_data": {"type": "caching", "evidence": {"calls": i}}, "created_at": now - timedelta(seconds=i)
+            }
+            for i in range(n)
+        ])
+
+
+def add_legacy_routes(app):
+    """The former handlers: ORM rows validated per row, then against response_model."""
+    from typing import List as ListOf
+    from fastapi import Depends
+    from sqlalchemy import select
+    from app.database import BudgetAlert, Optimization
+    from app.schemas import BudgetAlertResponse, OptimizationResponse
+    from app.sharding import get_user_db
+
+    @app.get("/legacy/alerts/{user_address}", response_model=ListOf[BudgetAlertResponse])
+    async def legacy_alerts(user_address: str, limit: int = 20, db=Depends(get_user_db)):
+        stmt = select(BudgetAlert).where(BudgetAlert.user_address == user_address)
+        stmt = stmt.order_by(BudgetAlert.created_at.desc()).limit(limit)
+        alerts = (await db.execute(stmt)).scalars().all()
+        return [BudgetAlertResponse.model_validate(a) for a in alerts]
+
+    @app.get("/legacy/optimizations/{user_address}", response_model=ListOf[OptimizationResponse])
+    async def legacy_optimizations(user_address: str, db=Depends(get_user_db)):
+        stmt = select(Optimization).where(
+            Optimization.user_address == user_address, Optimization.is_applied == False
+        ).order_by(Optimization.estimated_savings.desc())
+        optimizations = (await db.execute(stmt)).scalars().all()
+        return [OptimizationResponse.model_validate(o) for o in optimizations]
+
+
+async def run(rows: int, requests: int) -> Dict[str, Any]:
+    import httpx
+    from app.main import app
+
+    await seed(rows)
+    add_legacy_routes(app)
+    paths = {
+        "alerts": (f"/api/alerts/{USER}?limit={rows}", f"/legacy/alerts/{USER}?limit={rows}"),
+        "optimizations": (f"/api/optimizations/{USER}", f"/legacy/optimizations/{USER}"),
+    }
+    result: Dict[str, Any] = {"benchmark": "responses", "rows": rows, "requests": requests}
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+        for name, (current, legacy) in paths.items():
+            bodies: List[Any] = []
+            for label, path in (("legacy", legacy), ("direct", current)):
+                response = await client.get(path)
+                response.raise_for_status()
+                bodies.append(response.json())
+                start = time.perf_counter()
+                for _ in range(requests):
+                    await client.get(path)
+                result[f"{name}_{label}_ms"] = (time.perf_counter() - start) / requests * 1000
+            if bodies[0] != bodies[1] or len(bodies[0]) != rows:
+                raise SystemExit(f"{name}: responses differ")
+            result[f"{name}_speedup"] = result[f"{name}_legacy_ms"] / result[f"{name}_direct_ms"]
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rows", type=int, default=1000)
+    parser.add_argument("--requests", type=int, default=100)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        os.environ["DATABASE_URL"] = f"sqlite+aiosqlite:///{os.path.join(tmp, 'bench.db')}"
+        os.environ.setdefault("LOG_LEVEL", "WARNING")
+        print(json.dumps(asyncio.run(run(args.rows, args.requests))))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,151 @@
+"""
+Benchmark: import time and time to first request.
+
+Measures, in fresh processes:
+- import time of app.main (from `python -X importtime`), with the slowest
+  top-level imports
+- time from spawning uvicorn to the first successful /health response
+- latency of the first database-backed request after that
+
+Exits non-zero if a budget is exceeded, so it can gate cold-start regressions
+(autoscaling, serverless) in CI.
+
+Usage:
+    python -m benchmarks.bench_startup
+    python -m benchmarks.bench_startup --import-budget-ms 800 --first-request-budget-ms 1500
+"""
+
+import argparse
+import json
+import os
+import re
+import socket
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import urllib.error
+import urllib.request
+from typing import Dict, Any, List, Tuple
+
+AGENT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+IMPORT_LINE = re.compile(r"import time:\s+(\d+) \|\s+(\d+) \|(\s+)(\S+)")
+
+
+def measure_import(env: Dict[str, str]) -> Tuple[float, List[Dict[str, Any]]]:
+    """Cumulative import time of app.main (ms) and its slowest direct imports."""
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", "import app.main"],
+        cwd=AGENT_DIR, env=env, capture_output=True, text=True, check=True
+    )
+    total_ms = 0.0
+    top_level = []
+    for line in result.stderr.splitlines():
+        match = IMPORT_LINE.match(line)
+        if not match:
+            continue
+        cumulative_us, indent, module = int(match.group(2)), len(match.group(3)), match.group(4)
+        if module == "app.main":
+            total_ms = cumulative_us / 1000
+        elif indent == 3:
+            # Direct imports of app.main (importtime indents two spaces per level)
+            top_level.append({"module": module, "cumulative_ms": cumulative_us / 1000})
+    top_level.sort(key=lambda m: m["cumulative_ms"], reverse=True)
+    return total_ms, top_level[:8]
+
+
+def free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def get(url: str) -> int:
+    try:
+        with urllib.request.urlopen(url, timeout=5) as response:
+            return response.status
+    except urllib.error.HTTPError as e:
+        return e.code
+
+
+def measure_first_request(env: Dict[str, str], timeout_s: float = 60) -> Dict[str, float]:
+    """Spawn uvicorn and time the first /health and first DB-backed request."""
+    port = free_port()
+    start = time.perf_counter()
+    process = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "app.main:app", "--port", str(port), "--log-level", "warning"],
+        cwd=AGENT_DIR, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL
+    )
+    try:
+        base = f"http://127.0.0.1:{port}"
+        while True:
+            try:
+                if get(f"{base}/health") == 200:
+                    break
+            except OSError:
+                pass
+            if time.perf_counter() - start > timeout_s:
+                raise TimeoutError("guardian did not become healthy")
+            time.sleep(0.01)
+        health_ms = (time.perf_counter() - start) * 1000
+
+        db_start = time.perf_counter()
+        status = get(f"{base}/api/budget/status/0x0000000000000000000000000000000000000001")
+        first_db_ms = (time.perf_counter() - db_start) * 1000
+        if status not in (200, 404):
+            raise RuntimeError(f"unexpected status {status} from first DB request")
+        return {"time_to_healthy_ms": health_ms, "first_db_request_ms": first_db_ms}
+    finally:
+        process.terminate()
+        process.wait()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--import-budget-ms", type=float, default=1000)
+    parser.add_argument("--first-request-budget-ms", type=float, default=2000)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        env = dict(os.environ)
+        env["DATABASE_URL"] = f"sqlite+aiosqlite:///{os.path.join(tmp, 'startup.db')}"
+        env.setdefault("OPENAI_API_KEY", "sk-benchmark")
+        subprocess.run(
+            [sys.executable, "main.py", "migrate"],
+            cwd=AGENT_DIR, env=env, capture_output=True, check=True
+        )
+
+        import_runs, top_level = [], []
+        first_request_runs = []
+        for _ in range(args.runs):
+            total_ms, top_level = measure_import(env)
+            import_runs.append(total_ms)
+            first_request_runs.append(measure_first_request(env))
+
+    time_to_first = [r["time_to_healthy_ms"] + r["first_db_request_ms"] for r in first_request_runs]
+    result = {
+        "benchmark": "startup",
+        "runs": args.runs,
+        "import_ms": statistics.median(import_runs),
+        "slowest_imports": top_level,
+        "time_to_healthy_ms": statistics.median(r["time_to_healthy_ms"] for r in first_request_runs),
+        "first_db_request_ms": statistics.median(r["first_db_request_ms"] for r in first_request_runs),
+        "time_to_first_request_ms": statistics.median(time_to_first),
+        "budgets": {
+            "import_ms": args.import_budget_ms,
+            "time_to_first_request_ms": args.first_request_budget_ms,
+        },
+    }
+    result["within_budget"] = (
+        result["import_ms"] <= args.import_budget_ms
+        and result["time_to_first_request_ms"] <= args.first_request_budget_ms
+    )
+    print(json.dumps(result, indent=2))
+    sys.exit(0 if result["within_budget"] else 1)
+
+
+if __name__ == "__main__":
+    main()
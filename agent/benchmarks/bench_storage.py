@@ -0,0 +1,140 @@
+"""
+Benchmark: on-disk size of usage rows and rollups, API names vs. api_dim_id.
+
+Loads the same generated usage into two SQLite databases: one with the
+former schema (provider, api_id and api_name strings on every api_usage and
+usage_rollups row, rollups unique on the strings) and one with the current
+models (an integer api_dim_id into api_dimensions). Both get the same daily
+rollups (retention.rollup_select). The databases are vacuumed and each
+table's size, indexes included, is read from SQLite's dbstat.
+
+Usage:
+    python -m benchmarks.bench_storage
+    python -m benchmarks.bench_storage --rows 1000000
+"""
+
+import argparse
+import json
+import os
+import tempfile
+from datetime import datetime
+from typing import Any, Dict, List
+
+from sqlalchemy import Column, MetaData, String, Table, UniqueConstraint, create_engine, insert, text
+
+from app.database import Base, ApiDimension, ApiUsage, UsageRollup
+from app.money import from_micros
+from app.retention import rollup_select
+from benchmarks.generators import UsageGenerator
+
+NAME_COLUMNS = ("provider", "api_id", "api_name")
+
+
+def _copy_columns(table: Table) -> List[Column]:
+    return [
+        Column(c.name, c.type, primary_key=c.primary_key, index=c.index, unique=c.unique, nullable=c.nullable)
+        for c in table.columns if c.name != "api_dim_id"
+    ]
+
+
+def legacy_metadata() -> MetaData:
+    """api_usage and usage_rollups as they were before dictionary encoding."""
+    metadata = MetaData()
+    Table(
+        "api_usage", metadata, *_copy_columns(ApiUsage.__table__),
+        Column("provider", String, nullable=False),
+        Column("api_id", String, index=True, nullable=False),
+        Column("api_name", String, nullable=False)
+    )
+    Table(
+        "usage_rollups", metadata, *_copy_columns(UsageRollup.__table__),
+        Column("provider", String, nullable=False),
+        Column("api_id", String, nullable=False),
+        Column("api_name", String, nullable=False),
+        UniqueConstraint("user_address", "day", "provider", "api_id")
+    )
+    return metadata
+
+
+def table_sizes(engine) -> Dict[str, int]:
+    """Bytes per table, its indexes included (after VACUUM)."""
+    with engine.connect() as conn:
+        conn.execute(text("VACUUM"))
+        owners = dict(conn.execute(text("SELECT name, tbl_name FROM sqlite_master")).all())
+        sizes: Dict[str, int] = {}
+        for name, size in conn.execute(text("SELECT name, SUM(pgsize) FROM dbstat GROUP BY name")).all():
+            table = owners.get(name, name)
+            sizes[table] = sizes.get(table, 0) + size
+    return sizes
+
+
+def load(rows: int, directory: str) -> Dict[str, Any]:
+    gen = UsageGenerator(seed=5)
+    current = create_engine(f"sqlite:///{directory}/dims.db")
+    legacy = create_engine(f"sqlite:///{directory}/names.db")
+    Base.metadata.create_all(current, tables=[ApiDimension.__table__, ApiUsage.__table__, UsageRollup.__table__])
+    legacy_tables = legacy_metadata()
+    legacy_tables.create_all(legacy)
+
+    dims: Dict[tuple, int] = {}
+    labels: Dict[int, Dict[str, str]] = {}
+    for chunk in gen.history_chunks(rows):
+        with current.begin() as conn:
+            new = {(r["provider"], r["api_id"]): r["api_name"] for r in chunk}
+            for (provider, api_id), api_name in new.items():
+                if (provider, api_id) in dims:
+                    continue
+                dim_id = conn.execute(insert(ApiDimension).values(
+                    provider=provider, api_id=api_id, api_name=api_name
+                )).inserted_primary_key[0]
+                dims[(provider, api_id)] = dim_id
+                labels[dim_id] = {"provider": provider, "api_id": api_id, "api_name": api_name}
+            conn.execute(insert(ApiUsage.__table__), [
+                {
+                    **{k: v for k, v in r.items() if k not in NAME_COLUMNS},
+                    "api_dim_id": dims[(r["provider"], r["api_id"])]
+                }
+                for r in chunk
+            ])
+        with legacy.begin() as conn:
+            conn.execute(insert(legacy_tables.tables["api_usage"]), chunk)
+
+    with current.begin() as conn:
+        rollups = [
+            {**row._asdict(), "day": datetime.fromisoformat(str(row.day)), "cost": from_micros(row.cost_micros)}
+            for row in conn.execute(rollup_select(datetime(1970, 1, 1), datetime.utcnow())).all()
+        ]
+        conn.execute(insert(UsageRollup.__table__), rollups)
+    with legacy.begin() as conn:
+        conn.execute(insert(legacy_tables.tables["usage_rollups"]), [
+            {**{k: v for k, v in r.items() if k != "api_dim_id"}, **labels[r["api_dim_id"]]} for r in rollups
+        ])
+
+    before, after = table_sizes(legacy), table_sizes(current)
+    current.dispose()
+    legacy.dispose()
+    return {
+        "benchmark": "storage",
+        "rows": rows,
+        "rollup_rows": len(rollups),
+        "apis": len(dims),
+        "api_usage_bytes_per_row_names": round(before["api_usage"] / rows, 1),
+        "api_usage_bytes_per_row_dims": round(after["api_usage"] / rows, 1),
+        "usage_rollups_bytes_per_row_names": round(before["usage_rollups"] / len(rollups), 1),
+        "usage_rollups_bytes_per_row_dims": round(after["usage_rollups"] / len(rollups), 1),
+        "api_dimensions_bytes": after["api_dimensions"],
+        "file_mb_names": round(os.path.getsize(f"{directory}/names.db") / 1e6, 2),
+        "file_mb_dims": round(os.path.getsize(f"{directory}/dims.db") / 1e6, 2),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rows", type=int, default=200_000)
+    args = parser.parse_args()
+    with tempfile.TemporaryDirectory() as directory:
+        print(json.dumps(load(args.rows, directory)))
+
+
+if __name__ == "__main__":
+    main()
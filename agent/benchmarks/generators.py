@@ -0,0 +1,123 @@
+"""
+Synthetic usage generators for benchmarks and load tests.
+
+Each user gets its own Zipf popularity ranking over the API catalog, and user
+activity itself is Zipf-distributed, so a few users and a few APIs dominate
+traffic the way they do in production. Everything is driven by a seeded
+NumPy generator, so runs are reproducible.
+"""
+
+from datetime import datetime, timedelta
+from typing import Dict, Any, Iterator, List
+
+import numpy as np
+
+
+PROVIDERS = ["openai", "deepseek", "anthropic", "sendgrid", "twilio", "mapbox", "stripe", "cohere"]
+
+
+def zipf_weights(n: int, a: float) -> np.ndarray:
+    """Truncated Zipf probabilities for ranks 1..n."""
+    weights = 1.0 / np.arange(1, n + 1) ** a
+    return weights / weights.sum()
+
+
+class UsageGenerator:
+    """Reproducible generator of users, API calls and usage history."""
+
+    def __init__(
+        self,
+        n_users: int = 100,
+        n_apis: int = 40,
+        n_providers: int = 6,
+        zipf_a: float = 1.2,
+        seed: int = 7
+    ):
+        self.rng = np.random.default_rng(seed)
+        self.users = [f"0x{i + 1:040x}" for i in range(n_users)]
+        providers = PROVIDERS[:n_providers]
+        self.api_ids = [f"api-{i}" for i in range(n_apis)]
+        self.api_names = [f"endpoint-{i}" for i in range(n_apis)]
+        self.api_providers = [providers[i % len(providers)] for i in range(n_apis)]
+        self.api_base_cost = self.rng.gamma(2.0, 0.005, size=n_apis)
+        self.user_weights = zipf_weights(n_users, zipf_a)
+        self.api_weights = zipf_weights(n_apis, zipf_a)
+        # Per-user API popularity: rank r of user u maps to API user_perm[u, r]
+        self.user_perm = np.stack([self.rng.permutation(n_apis) for _ in range(n_users)])
+
+    def _sample(self, n: int) -> Dict[str, np.ndarray]:
+        users = self.rng.choice(len(self.users), size=n, p=self.user_weights)
+        ranks = self.rng.choice(len(self.api_ids), size=n, p=self.api_weights)
+        apis = self.user_perm[users, ranks]
+        costs = self.api_base_cost[apis] * self.rng.lognormal(0.0, 0.25, size=n)
+        tokens = self.rng.integers(50, 4000, size=n)
+        return {"users": users, "apis": apis, "costs": costs, "tokens": tokens}
+
+    def usage_events(self, n: int) -> List[Dict[str, Any]]:
+        """`n` usage payloads for POST /api/usage/record."""
+        s = self._sample(n)
+        return [
+            self._payload(u, a, c, t)
+            for u, a, c, t in zip(s["users"].tolist(), s["apis"].tolist(), s["costs"].tolist(), s["tokens"].tolist())
+        ]
+
+    def burst(self, n: int, cost_multiplier: float = 10.0) -> List[Dict[str, Any]]:
+        """
+        Anomalous burst: one user hammering one API at elevated cost.
+
+        Models a runaway client loop, the case the unusual-pattern detector
+        should catch.
+        """
+        user = int(self.rng.integers(0, len(self.users)))
+        api = int(self.user_perm[user, 0])
+        costs = self.api_base_cost[api] * cost_multiplier * self.rng.lognormal(0.0, 0.1, size=n)
+        return [self._payload(user, api, c, 1000) for c in costs.tolist()]
+
+    def history_chunks(
+        self,
+        n: int,
+        days: int = 30,
+        chunk_size: int = 50_000
+    ) -> Iterator[List[Dict[str, Any]]]:
+        """
+        Historical api_usage rows (as insert dicts) spread over the last `days`.
+
+        Yields chunks so 10M-row preloads don't need to fit in memory.
+        """
+        end = datetime.utcnow() - timedelta(minutes=10)
+        span = days * 24 * 3600
+        for offset in range(0, n, chunk_size):
+            size = min(chunk_size, n - offset)
+            s = self._sample(size)
+            ages = self.rng.integers(0, span, size=size).tolist()
+            yield [
+                {
+                    "user_address": self.users[u],
+                    "api_id": self.api_ids[a],
+                    "api_name": self.api_names[a],
+                    "provider": self.api_providers[a],
+                    "cost": c,
+                    "cost_micros": round(c * 1_000_000),
+                    "request_count": 1,
+                    "tokens_used": t,
+                    "status": "success",
+                    "timestamp": end - timedelta(seconds=age),
+                }
+                for u, a, c, t, age in zip(
+                    s["users"].tolist(), s["apis"].tolist(), s["costs"].tolist(), s["tokens"].tolist(), ages
+                )
+            ]
+
+    def pick_user(self) -> str:
+        """A user address, weighted by activity."""
+        return self.users[int(self.rng.choice(len(self.users), p=self.user_weights))]
+
+    def _payload(self, user: int, api: int, cost: float, tokens: int) -> Dict[str, Any]:
+        return {
+            "user_address": self.users[user],
+            "api_id": self.api_ids[api],
+            "api_name": self.api_names[api],
+            "provider": self.api_providers[api],
+            "cost": round(cost, 6),
+            "tokens_used": tokens,
+        }
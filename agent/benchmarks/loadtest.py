@@ -0,0 +1,322 @@
+"""
+Reproducible load test for the guardian service.
+
+Drives the FastAPI app either in-process (httpx ASGI transport) or over HTTP
+(uvicorn started in-process, or an external --url) with a stubbed AI provider
+and a mocked Web3 connection. Traffic is generated from per-user Zipf
+distributions over APIs and providers, optionally with anomalous bursts, on
+top of a preloaded usage history. Results are printed as one JSON object
+(throughput and p50/p95/p99 per endpoint) for comparison between commits.
+
+Usage:
+    python -m benchmarks.loadtest
+    python -m benchmarks.loadtest --preload-rows 1000000 --requests 20000 --concurrency 32
+    python -m benchmarks.loadtest --mode http --scenario burst --output results.json
+    python -m benchmarks.loadtest --scenario ingest --batch-size 100
+    python -m benchmarks.loadtest --mode http --url http://localhost:8000 --no-preload
+"""
+
+import argparse
+import asyncio
+import contextlib
+import json
+import os
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+from collections import defaultdict
+from typing import Dict, Any, List, Tuple
+
+import numpy as np
+
+from .generators import UsageGenerator
+from .stubs import StubAIClient, configure_environment, install_stubs
+
+
+# Endpoint mix for steady traffic: (name, weight)
+ENDPOINT_MIX = [
+    ("POST /api/usage/record", 0.70),
+    ("GET /api/budget/status", 0.15),
+    ("GET /api/alerts", 0.05),
+    ("GET /api/optimizations", 0.04),
+    ("GET /api/report/monthly", 0.02),
+    ("POST /api/analyze", 0.01),
+    ("POST /api/agent/pay", 0.03),
+]
+
+Request = Tuple[str, str, str, Dict[str, Any], Dict[str, Any]]
+
+
+def build_requests(
+    gen: UsageGenerator, n: int, scenario: str, burst_size: int, batch_size: int = 100
+) -> List[Request]:
+    """
+    Build the request sequence for a run.
+
+    The ingest scenario sends `n` usage events only, `batch_size` per call
+    to the batch endpoint.
+
+    Returns:
+        List of (endpoint name, method, path, json body, query params)
+    """
+    if scenario == "ingest":
+        events = gen.usage_events(n)
+        return [
+            ("POST /api/usage/record/batch", "POST", "/api/usage/record/batch", {"events": events[i:i + batch_size]}, {})
+            for i in range(0, len(events), batch_size)
+        ]
+
+    names = [name for name, _ in ENDPOINT_MIX]
+    weights = np.array([w for _, w in ENDPOINT_MIX])
+    picks = gen.rng.choice(len(names), size=n, p=weights / weights.sum()).tolist()
+    events = iter(gen.usage_events(n))
+
+    requests: List[Request] = []
+    for pick in picks:
+        name = names[pick]
+        event = next(events)
+        user = event["user_address"]
+        if name == "POST /api/usage/record":
+            requests.append((name, "POST", "/api/usage/record", event, {}))
+        elif name == "GET /api/budget/status":
+            requests.append((name, "GET", f"/api/budget/status/{user}", None, {}))
+        elif name == "GET /api/alerts":
+            requests.append((name, "GET", f"/api/alerts/{user}", None, {}))
+        elif name == "GET /api/optimizations":
+            requests.append((name, "GET", f"/api/optimizations/{user}", None, {}))
+        elif name == "GET /api/report/monthly":
+            requests.append((name, "GET", f"/api/report/{user}/monthly", None, {}))
+        elif name == "POST /api/analyze":
+            requests.append((name, "POST", "/api/analyze", {"user_address": user, "time_window_hours": 24}, {}))
+        elif name == "POST /api/agent/pay":
+            params = {"user_address": user, "api_id": event["api_id"], "cost_cro": min(event["cost"], 0.5)}
+            requests.append((name, "POST", "/api/agent/pay", None, params))
+
+    if scenario == "burst":
+        # Splice anomalous bursts into the steady stream at fixed intervals
+        bursts = max(1, n // 2000)
+        for i in range(bursts):
+            position = (i + 1) * len(requests) // (bursts + 1)
+            burst = [
+                ("POST /api/usage/record (burst)", "POST", "/api/usage/record", e, {})
+                for e in gen.burst(burst_size)
+            ]
+            requests[position:position] = burst
+    return requests
+
+
+async def preload(gen: UsageGenerator, rows: int, days: int):
+    """Create budget configs for all users and insert `rows` of usage history."""
+    from sqlalchemy import insert
+    from app.database import BudgetConfig, ApiUsage
+    from app.dimensions import shard_dimensions
+    from app.sharding import get_shard_router
+
+    router = get_shard_router()
+    await router.init_db()
+
+    by_shard: Dict[int, List[Dict[str, Any]]] = defaultdict(list)
+    for user in gen.users:
+        monthly_limit = float(gen.rng.uniform(50, 500))
+        by_shard[router.index_for(user)].append({
+            "user_address": user,
+            "monthly_limit": monthly_limit,
+            "monthly_limit_micros": round(monthly_limit * 1_000_000),
+            "warning_threshold": 0.8,
+            "pause_threshold": 1.0,
+            "is_active": True,
+        })
+    for index, configs in by_shard.items():
+        async with router.get_shard(index).engine.begin() as conn:
+            await conn.execute(insert(BudgetConfig), configs)
+
+    inserted = 0
+    for chunk in gen.history_chunks(rows, days=days):
+        by_shard = defaultdict(list)
+        for row in chunk:
+            by_shard[router.index_for(row["user_address"])].append(row)
+        for index, shard_rows in by_shard.items():
+            shard = router.get_shard(index)
+            await shard_dimensions(shard).intern_rows(shard.engine, shard_rows)
+            async with shard.engine.begin() as conn:
+                await conn.execute(insert(ApiUsage), shard_rows)
+        inserted += len(chunk)
+        print(f"preloaded {inserted}/{rows} rows", file=sys.stderr)
+
+
+async def drive(client, requests: List[Request], concurrency: int) -> Dict[str, Any]:
+    """Replay requests with `concurrency` closed-loop workers."""
+    latencies: Dict[str, List[float]] = defaultdict(list)
+    errors: Dict[str, int] = defaultdict(int)
+    queue = iter(requests)
+
+    async def worker():
+        for name, method, path, body, params in queue:
+            start = time.perf_counter()
+            try:
+                response = await client.request(method, path, json=body, params=params or None)
+                ok = response.status_code < 400 and not (
+                    response.headers.get("content-type", "").startswith("application/json")
+                    and isinstance(response.json(), dict)
+                    and response.json().get("ok") is False
+                )
+            except Exception:
+                ok = False
+            latencies[name].append(time.perf_counter() - start)
+            if not ok:
+                errors[name] += 1
+
+    start = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    duration = time.perf_counter() - start
+    return {"latencies": latencies, "errors": errors, "duration_s": duration}
+
+
+def summarize(run: Dict[str, Any]) -> Dict[str, Any]:
+    """Throughput and latency percentiles per endpoint (milliseconds)."""
+    duration = run["duration_s"]
+    endpoints = {}
+    for name, values in sorted(run["latencies"].items()):
+        ms = np.array(values) * 1000
+        endpoints[name] = {
+            "count": len(values),
+            "errors": run["errors"].get(name, 0),
+            "throughput_rps": len(values) / duration,
+            "mean_ms": float(ms.mean()),
+            "p50_ms": float(np.percentile(ms, 50)),
+            "p95_ms": float(np.percentile(ms, 95)),
+            "p99_ms": float(np.percentile(ms, 99)),
+            "max_ms": float(ms.max()),
+        }
+    total = sum(e["count"] for e in endpoints.values())
+    return {
+        "duration_s": duration,
+        "requests": total,
+        "throughput_rps": total / duration,
+        "endpoints": endpoints,
+    }
+
+
+def git_commit() -> str:
+    try:
+        return subprocess.check_output(
+            ["git", "rev-parse", "--short", "HEAD"], stderr=subprocess.DEVNULL, text=True
+        ).strip()
+    except Exception:
+        return "unknown"
+
+
+def free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+async def run(args) -> Dict[str, Any]:
+    import httpx
+
+    gen = UsageGenerator(n_users=args.users, n_apis=args.apis, zipf_a=args.zipf_a, seed=args.seed)
+
+    server = server_task = None
+    if args.url:
+        client = httpx.AsyncClient(base_url=args.url, timeout=60)
+    else:
+        from app.main import app
+        from app.sharding import get_shard_router
+
+        install_stubs()
+        for shard in get_shard_router().local_shards:
+            shard.engine.echo = False
+        if args.preload:
+            await preload(gen, args.preload_rows, args.history_days)
+        else:
+            await get_shard_router().init_db()
+
+        if args.mode == "inprocess":
+            transport = httpx.ASGITransport(app=app)
+            client = httpx.AsyncClient(transport=transport, base_url="http://guardian", timeout=60)
+        else:
+            import uvicorn
+
+            port = free_port()
+            server = uvicorn.Server(uvicorn.Config(app, host="127.0.0.1", port=port, log_level="warning"))
+            server_task = asyncio.create_task(server.serve())
+            while not server.started:
+                await asyncio.sleep(0.05)
+            client = httpx.AsyncClient(base_url=f"http://127.0.0.1:{port}", timeout=60)
+
+    requests = build_requests(gen, args.requests, args.scenario, args.burst_size, args.batch_size)
+    async with client:
+        if args.warmup:
+            await drive(client, build_requests(gen, args.warmup, "steady", 0), args.concurrency)
+        result = await drive(client, requests, args.concurrency)
+
+    if server is not None:
+        server.should_exit = True
+        await server_task
+
+    summary = summarize(result)
+    if args.scenario == "ingest":
+        summary["events_per_second"] = args.requests / summary["duration_s"]
+    return {
+        "benchmark": "loadtest",
+        "commit": git_commit(),
+        "config": {
+            "mode": "http" if args.url else args.mode,
+            "url": args.url,
+            "scenario": args.scenario,
+            "users": args.users,
+            "apis": args.apis,
+            "zipf_a": args.zipf_a,
+            "preload_rows": args.preload_rows if args.preload else 0,
+            "requests": len(requests),
+            "concurrency": args.concurrency,
+            "ai_latency_ms": args.ai_latency_ms,
+            "seed": args.seed,
+        },
+        "llm_calls": StubAIClient.calls,
+        **summary,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--mode", choices=["inprocess", "http"], default="inprocess")
+    parser.add_argument("--url", help="Target an already running guardian instead of starting one")
+    parser.add_argument("--scenario", choices=["steady", "burst", "ingest"], default="steady")
+    parser.add_argument("--requests", type=int, default=2000)
+    parser.add_argument("--warmup", type=int, default=100)
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument("--users", type=int, default=200)
+    parser.add_argument("--apis", type=int, default=40)
+    parser.add_argument("--zipf-a", type=float, default=1.2)
+    parser.add_argument("--preload-rows", type=int, default=10_000, help="History rows (10k-10M)")
+    parser.add_argument("--history-days", type=int, default=30)
+    parser.add_argument("--no-preload", dest="preload", action="store_false")
+    parser.add_argument("--burst-size", type=int, default=200)
+    parser.add_argument("--batch-size", type=int, default=100, help="Events per call in the ingest scenario")
+    parser.add_argument("--ai-latency-ms", type=float, default=50.0)
+    parser.add_argument("--database-url", help="Default: a fresh SQLite file in a temp directory")
+    parser.add_argument("--seed", type=int, default=7)
+    parser.add_argument("--output", help="Also write the JSON result to this file")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        if not args.url:
+            database_url = args.database_url or f"sqlite+aiosqlite:///{os.path.join(tmp, 'loadtest.db')}"
+            configure_environment(database_url, args.ai_latency_ms / 1000)
+        # Keep stdout for the JSON result; service prints go to stderr
+        with contextlib.redirect_stdout(sys.stderr):
+            result = asyncio.run(run(args))
+
+    output = json.dumps(result, indent=2)
+    print(output)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(output + "\n")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,119 @@
+"""
+Stubs for external services used in benchmarks.
+
+- StubAIClient replaces the OpenAI/Deepseek AsyncOpenAI client with canned JSON
+  responses after a configurable delay, so LLM latency is controlled and no
+  API key or network access is needed.
+- FakeWeb3 replaces the agent wallet's RPC connection with a fixed balance.
+"""
+
+import asyncio
+import json
+import os
+from decimal import Decimal
+from types import SimpleNamespace
+from typing import Any, Dict
+
+
+ANALYSIS_RESPONSE = {
+    "patterns_detected": ["Traffic concentrated on a few endpoints"],
+    "anomalies": [],
+    "recommendations": [{
+        "type": "model_switch",
+        "current_api": "endpoint-0",
+        "suggested_api": "endpoint-1",
+        "description": "Cheaper endpoint with similar output",
+        "estimated_monthly_savings": 4.2,
+        "priority": "medium"
+    }],
+    "estimated_savings": 4.2,
+    "summary": "Stubbed analysis"
+}
+
+PATTERN_RESPONSE = {
+    "is_unusual": True,
+    "likely_cause": "spike",
+    "severity": "medium",
+    "recommendation": "Review recent traffic",
+    "should_pause": False
+}
+
+
+class _StubCompletions:
+    def __init__(self, client: "StubAIClient"):
+        self.client = client
+
+    async def create(self, **kwargs) -> Any:
+        StubAIClient.calls += 1
+        if self.client.latency_s:
+            await asyncio.sleep(self.client.latency_s)
+        prompt = kwargs["messages"][-1]["content"]
+        if "Unusual API usage" in prompt:
+            body: Dict[str, Any] = PATTERN_RESPONSE
+        elif "suggest cost optimizations" in prompt:
+            body = {"optimizations": ANALYSIS_RESPONSE["recommendations"]}
+        else:
+            body = ANALYSIS_RESPONSE
+        message = SimpleNamespace(content=json.dumps(body))
+        return SimpleNamespace(choices=[SimpleNamespace(message=message)])
+
+
+class StubAIClient:
+    """Drop-in for openai.AsyncOpenAI with fixed latency."""
+
+    latency_s = 0.05
+    calls = 0
+
+    def __init__(self, *args, **kwargs):
+        self.chat = SimpleNamespace(completions=_StubCompletions(self))
+
+    @classmethod
+    def reset(cls, latency_s: float):
+        cls.latency_s = latency_s
+        cls.calls = 0
+
+
+class FakeWeb3:
+    """Minimal Web3 stand-in for the agent wallet (balance and unit conversion)."""
+
+    def __init__(self, balance_cro: float = 100.0):
+        balance_wei = int(Decimal(str(balance_cro)) * 10**18)
+        self.eth = SimpleNamespace(get_balance=lambda address: balance_wei)
+
+    @staticmethod
+    def from_wei(value: int, unit: str) -> Decimal:
+        return Decimal(value) / Decimal(10**18)
+
+    @staticmethod
+    def to_wei(value: Any, unit: str) -> int:
+        return int(Decimal(str(value)) * 10**18)
+
+
+def configure_environment(database_url: str, ai_latency_s: float):
+    """
+    Set environment for a benchmark run. Must run before importing `app`.
+
+    Generates a throwaway agent key so wallet endpoints work offline.
+    """
+    from eth_account import Account
+
+    account = Account.create()
+    os.environ["DATABASE_URL"] = database_url
+    os.environ.setdefault("AI_PROVIDER", "openai")
+    os.environ.setdefault("OPENAI_API_KEY", "sk-benchmark")
+    os.environ["AGENT_PRIVATE_KEY"] = account.key.hex()
+    os.environ["AGENT_ADDRESS"] = account.address
+    StubAIClient.reset(ai_latency_s)
+
+
+def install_stubs():
+    """Patch the AI client and agent wallet RPC. Call after importing `app`."""
+    import openai
+    from app import ai_analyzer, agent_wallet
+
+    # The analyzer imports AsyncOpenAI lazily, so patching the SDK is enough
+    openai.AsyncOpenAI = StubAIClient
+    ai_analyzer._clients.clear()
+
+    wallet = agent_wallet.get_agent_wallet()
+    wallet.w3 = FakeWeb3()
@@ -1,7 +1,20 @@
 """
 AI Budget Guardian - Entry point
+
+Usage:
+    python main.py            # Run the server
+    python main.py migrate    # Create or upgrade the database schema
+    python main.py retention  # Roll up and archive old usage rows
+    python main.py recommend  # Compute cost optimization suggestions
+    python main.py reports    # Generate every budget's monthly report [--month YYYY-MM]
+    python main.py backtest   # Replay usage through alert policies
+        [--days 30] [--user 0x...] [--policy name:warning_threshold=0.7,unusual_pattern_multiplier=5 ...]
 """
 
+import argparse
+import asyncio
+import json
+
 import uvicorn
 from app.config import settings
 
@@ -22,5 +35,78 @@ def main():
     )
 
 
+def migrate():
+    """Create or upgrade the database schema on all local shards."""
+    from app.migrations import migrate as run_migrations
+    
+    print("🗄️  Running database migrations...")
+    asyncio.run(run_migrations())
+
+
+def retention():
+    """Roll up and archive old usage rows on all local shards."""
+    from app.retention import run_retention
+    
+    print("🗃️  Running usage retention...")
+    asyncio.run(run_retention())
+
+
+def recommend():
+    """Compute cost optimization suggestions for every user on the local shards."""
+    from app.recommender import run_recommender
+    
+    print("💡 Computing optimization recommendations...")
+    asyncio.run(run_recommender())
+
+
+def reports(month: str):
+    """Generate the monthly report of every budget on the local shards."""
+    from app.reports import run_monthly_reports
+    
+    def show(progress):
+        print(f"\r📊 {progress.done}/{progress.total} users", end="", flush=True)
+    
+    print("📊 Generating monthly reports...")
+    result = asyncio.run(run_monthly_reports(month, on_progress=show))
+    print()
+    print(json.dumps(result, indent=2))
+
+
+def backtest(days: int, user_address: str, policy_specs: list):
+    """Replay usage on the local shards through the current policy and any variants."""
+    from app.backtest import run_backtest
+    from app.schemas import BacktestPolicy
+    
+    policies = [BacktestPolicy()]
+    for spec in policy_specs:
+        name, _, overrides = spec.partition(":")
+        values = dict(item.split("=", 1) for item in overrides.split(",") if item)
+        policies.append(BacktestPolicy(name=name, **values))
+    
+    print(f"🧪 Backtesting {len(policies)} policies over {days} days...")
+    print(json.dumps(asyncio.run(run_backtest(policies, days, user_address)), indent=2))
+
+
 if __name__ == "__main__":
-    main()
+    parser = argparse.ArgumentParser(description="AI Budget Guardian")
+    parser.add_argument(
+        "command", nargs="?", choices=["serve", "migrate", "retention", "recommend", "reports", "backtest"], default="serve"
+    )
+    parser.add_argument("--month", default=None, help="reports: YYYY-MM (default: current month)")
+    parser.add_argument("--days", type=int, default=30, help="backtest: days of usage to replay")
+    parser.add_argument("--user", default=None, help="backtest: one user (default: all local users)")
+    parser.add_argument("--policy", action="append", default=[], help="backtest: name:field=value,... variant")
+    args = parser.parse_args()
+    
+    if args.command == "migrate":
+        migrate()
+    elif args.command == "retention":
+        retention()
+    elif args.command == "recommend":
+        recommend()
+    elif args.command == "reports":
+        reports(args.month)
+    elif args.command == "backtest":
+        backtest(args.days, args.user, args.policy)
+    else:
+        main()
@@ -0,0 +1,70 @@
+"""
+Retention: archived rows stay readable next to the hot table.
+
+A user's old usage is rolled up and archived (in several chunks), and a
+window spanning the retention cutoff is then read back through
+analytics.fetch_usage_columns: every row appears once, from the archive or
+from api_usage.
+"""
+
+import asyncio
+from datetime import datetime, timedelta
+
+import pytest
+from sqlalchemy import insert, select, func
+from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker
+
+from app import retention
+from app.analytics import fetch_usage_columns
+from app.config import settings
+from app.database import Base, ApiUsage, UsageArchive
+from app.dimensions import ApiDimensions
+from app.retention import archive_usage, retention_cutoff, rollup_usage
+
+USER = "0xarchived"
+
+
+def usage(user_address: str, cost_micros: int, timestamp: datetime) -> dict:
+    return {
+        "user_address": user_address, "provider": "openai", "api_id": "gpt-4", "api_name": "GPT-4",
+        "cost_micros": cost_micros, "timestamp": timestamp
+    }
+
+
+async def archive_and_read(tmp_path):
+    engine = create_async_engine(f"sqlite+aiosqlite:///{tmp_path}/usage.db")
+    async with engine.begin() as conn:
+        await conn.run_sync(Base.metadata.create_all)
+
+    now = datetime.utcnow()
+    cutoff = retention_cutoff(now)
+    old = [usage(USER, 1000 + i, cutoff - timedelta(days=30, hours=i)) for i in range(5)]
+    recent = [usage(USER, 2000 + i, now - timedelta(hours=i + 1)) for i in range(3)]
+    other = [usage("0xother", 7, cutoff - timedelta(days=30))]
+    rows = old + recent + other
+    await ApiDimensions().intern_rows(engine, rows)
+    async with engine.begin() as conn:
+        await conn.execute(insert(ApiUsage), rows)
+
+    async with async_sessionmaker(engine, expire_on_commit=False)() as db:
+        await rollup_usage(db, until=now)
+        archives = await archive_usage(db, 0, now)
+        hot = (await db.execute(select(func.count(ApiUsage.id)))).scalar()
+        manifest = (await db.execute(select(UsageArchive.rows))).scalars().all()
+        spanning = await fetch_usage_columns(db, USER, cutoff - timedelta(days=60))
+        archived_only = await fetch_usage_columns(db, USER, cutoff - timedelta(days=60), cutoff)
+    await engine.dispose()
+    return archives, hot, manifest, spanning, archived_only, old, recent
+
+
+def test_read_spans_retention_cutoff(tmp_path, monkeypatch):
+    monkeypatch.setattr(settings, "ARCHIVE_DIR", str(tmp_path / "archive"))
+    monkeypatch.setattr(retention, "ARCHIVE_CHUNK", 2)
+    archives, hot, manifest, spanning, archived_only, old, recent = asyncio.run(archive_and_read(tmp_path))
+
+    assert sum(a["rows"] for a in archives) == sum(manifest) == len(old) + 1
+    assert hot == len(recent)
+
+    assert sorted(spanning.cost_micros.tolist()) == sorted(r["cost_micros"] for r in old + recent)
+    assert sorted(archived_only.cost_micros.tolist()) == sorted(r["cost_micros"] for r in old)
+    assert spanning.cost.sum() == pytest.approx(sum(r["cost_micros"] for r in old + recent) / 1e6)
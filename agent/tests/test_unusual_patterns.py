@@ -0,0 +1,171 @@
+"""
+Unusual-pattern detection: rate estimation and when the LLM is consulted.
+
+The LLM client is a stub that counts its calls, so these tests show that
+steady traffic never reaches the model and a genuine rate spike does (once
+per analysis window), including a spike ingested by other workers.
+"""
+
+import asyncio
+import json
+from datetime import datetime, timedelta
+from types import SimpleNamespace
+
+import pytest
+
+from app import ai_analyzer, guardian_service
+from app.ai_analyzer import AIAnalyzer
+from app.config import settings
+from app.guardian_service import BudgetGuardianService
+from app.money import to_micros
+from app.rate_estimator import RateEstimator, epoch_seconds, BASELINE_ALPHA, RECENT_ALPHA
+from app.sliding_window import SlidingWindowCounter, get_shared_usage_counts
+from app.usage_event import UsageEvent
+
+WEEK_SECONDS = 7 * 24 * 3600
+STEADY_GAP = 10.0  # Seconds between calls: 6 calls/min
+COST = 0.002
+
+
+class StubClient:
+    """AsyncOpenAI stand-in that counts completions and answers "not unusual"."""
+
+    def __init__(self):
+        self.calls = 0
+        self.chat = SimpleNamespace(completions=self)
+
+    async def create(self, **kwargs):
+        self.calls += 1
+        message = SimpleNamespace(content=json.dumps({"is_unusual": False, "likely_cause": "spike"}))
+        return SimpleNamespace(choices=[SimpleNamespace(message=message)])
+
+
+@pytest.fixture
+def client(monkeypatch):
+    monkeypatch.setattr(settings, "AI_PROVIDER", "openai")
+    monkeypatch.setattr(settings, "OPENAI_API_KEY", "sk-test")
+    stub = StubClient()
+    monkeypatch.setitem(ai_analyzer._clients, "openai", stub)
+    return stub
+
+
+def baseline() -> RateEstimator:
+    """Slow estimator seeded with a week of steady traffic."""
+    calls = int(WEEK_SECONDS / STEADY_GAP)
+    return RateEstimator.from_average(BASELINE_ALPHA, calls, calls * COST, WEEK_SECONDS)
+
+
+def call_times(count: int, gap: float, end: float) -> list:
+    """Epoch times of `count` calls `gap` seconds apart, the last at `end`."""
+    return [end - gap * (count - 1 - i) for i in range(count)]
+
+
+def feed(estimator: RateEstimator, times: list) -> RateEstimator:
+    for t in times:
+        estimator.observe(t, COST)
+    return estimator
+
+
+def events(user_address: str, gap: float, count: int) -> list:
+    """`count` calls `gap` seconds apart ending now."""
+    now = datetime.utcnow()
+    return [
+        UsageEvent(user_address, "gpt-4", "GPT-4", "openai", to_micros(COST), now - timedelta(seconds=gap * (count - 1 - i)))
+        for i in range(count)
+    ]
+
+
+def window_with(gap: float, count: int) -> SlidingWindowCounter:
+    """Sliding window over the baseline week, with `count` calls `gap` seconds apart ending now."""
+    window = SlidingWindowCounter(settings.ANALYSIS_WINDOW_MINUTES * 60, baseline())
+    for event in events("0xuser", gap, count):
+        window.record(event)
+    return window
+
+
+def test_steady_traffic_stays_under_threshold():
+    end = epoch_seconds(datetime.utcnow())
+    recent = feed(RateEstimator(RECENT_ALPHA), call_times(30, STEADY_GAP, end))
+    history = baseline()
+
+    assert recent.rate(end) == pytest.approx(history.rate(), rel=0.01)
+    assert recent.rate(end) / history.rate() < settings.UNUSUAL_PATTERN_MULTIPLIER
+    assert recent.cost_rate(end) / history.cost_rate() < settings.UNUSUAL_PATTERN_MULTIPLIER
+
+
+def test_burst_crosses_threshold():
+    end = epoch_seconds(datetime.utcnow())
+    steady = call_times(30, STEADY_GAP, end - 60)
+    recent = feed(RateEstimator(RECENT_ALPHA), steady + call_times(30, 0.5, end))
+
+    assert recent.rate(end) / baseline().rate() > settings.UNUSUAL_PATTERN_MULTIPLIER
+
+
+def test_idle_rate_decays():
+    end = epoch_seconds(datetime.utcnow())
+    recent = feed(RateEstimator(RECENT_ALPHA), call_times(30, 0.5, end))
+
+    assert recent.rate(end + 600) < recent.rate(end) / 100
+
+
+def test_detect_skips_llm_for_normal_rates(client):
+    history = baseline()
+    result = asyncio.run(AIAnalyzer().detect_unusual_pattern(
+        recent_usage=[{"cost": COST, "timestamp": datetime.utcnow().isoformat()}],
+        historical_average={"avg_calls_per_minute": history.rate(), "avg_cost_per_minute": history.cost_rate()},
+        recent_rate=history.rate() * 1.5,
+        recent_cost_rate=history.cost_rate() * 1.5
+    ))
+
+    assert result is None
+    assert client.calls == 0
+
+
+def test_detect_calls_llm_on_spike(client):
+    history = baseline()
+    result = asyncio.run(AIAnalyzer().detect_unusual_pattern(
+        recent_usage=[{"cost": COST, "timestamp": datetime.utcnow().isoformat()}],
+        historical_average={"avg_calls_per_minute": history.rate(), "avg_cost_per_minute": history.cost_rate()},
+        recent_rate=history.rate() * 20,
+        recent_cost_rate=history.cost_rate() * 20
+    ))
+
+    assert result == {"is_unusual": False, "likely_cause": "spike"}
+    assert client.calls == 1
+
+
+@pytest.mark.parametrize("gap, count, llm_calls", [
+    (STEADY_GAP, 30, 0),  # Steady traffic
+    (0.5, 30, 1),  # Burst
+    (0.5, 5, 0),  # Burst too small to judge
+])
+def test_check_unusual_patterns(client, monkeypatch, gap, count, llm_calls):
+    window = window_with(gap, count)
+
+    async def get(db, user_address):
+        return window
+
+    monkeypatch.setattr(guardian_service, "get_usage_windows", lambda user_address: SimpleNamespace(get=get))
+    service = BudgetGuardianService(db=None)
+    user_address = f"0x{gap}-{count}"
+
+    async def check_twice():
+        await service._check_unusual_patterns(user_address)
+        await service._check_unusual_patterns(user_address)  # Within the cooldown
+
+    asyncio.run(check_twice())
+    assert client.calls == llm_calls
+
+
+def test_check_unusual_patterns_sees_other_workers(client, monkeypatch):
+    user_address = "0xspread"
+    local = SlidingWindowCounter(settings.ANALYSIS_WINDOW_MINUTES * 60, baseline())  # Nothing ingested here
+    other_worker = {user_address: SlidingWindowCounter(settings.ANALYSIS_WINDOW_MINUTES * 60, baseline())}
+    asyncio.run(get_shared_usage_counts().record(other_worker, events(user_address, 0.5, 30)))
+
+    async def get(db, user_address):
+        return local
+
+    monkeypatch.setattr(guardian_service, "get_usage_windows", lambda user_address: SimpleNamespace(get=get))
+    asyncio.run(BudgetGuardianService(db=None)._check_unusual_patterns(user_address))
+    assert client.calls == 1
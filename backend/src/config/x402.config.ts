@@ -16,6 +16,9 @@ export const MERCHANT_ADDRESS = process.env.MERCHANT_ADDRESS ?? '';
 
 export const ASSET = NETWORK === CronosNetwork.CronosMainnet ? Contract.USDCe : Contract.DevUSDCe;
 
+/** Base units per whole token (USDC.e has 6 decimals); prices are in base units. */
+export const ASSET_UNIT = 1_000_000;
+
 export const PUBLIC_RESOURCE_URL = process.env.PUBLIC_RESOURCE_URL ?? 'http://localhost:8787';
 
 export const DEFAULT_TIMEOUT_SECONDS = 300;
@@ -31,6 +34,7 @@ export const x402Config = {
   NETWORK,
   MERCHANT_ADDRESS,
   ASSET,
+  ASSET_UNIT,
   PUBLIC_RESOURCE_URL,
   DEFAULT_TIMEOUT_SECONDS,
 };
@@ -40,6 +40,11 @@ export interface RequireX402Options {
   mimeType?: string;
   resource?: string;
   getEntitlementKey?: (req: Request) => string;
+  /**
+   * Pre-payment budget gate, checked before a payment challenge is issued.
+   * Resolving to false rejects the request with 403.
+   */
+  admit?: (req: Request) => Promise<boolean>;
 }
 
 /**
@@ -59,9 +64,10 @@ export const requireX402Payment = (options: RequireX402Options) => {
     mimeType = 'application/json',
     resource,
     getEntitlementKey,
+    admit,
   } = options;
 
-  return (req: Request, res: Response, next: NextFunction): void => {
+  return async (req: Request, res: Response, next: NextFunction): Promise<void> => {
     const entitlementKey = (
       getEntitlementKey?.(req) ?? 
       req.header('x-payment-id') ?? 
@@ -74,6 +80,16 @@ export const requireX402Payment = (options: RequireX402Options) => {
       return;
     }
 
+    // Reject before the client pays if the user's budget is exhausted
+    if (admit && !(await admit(req))) {
+      res.status(403).json({
+        ok: false,
+        error: PaymentStatus.BudgetDenied,
+        message: 'Budget limit reached for this wallet',
+      });
+      return;
+    }
+
     // Generate new payment challenge
     const paymentId = newPaymentId();
 
@@ -1,7 +1,8 @@
 import { Router } from 'express';
 import { MarketplaceController } from '../controllers/marketplace.controller.js';
 import { requireX402Payment } from '../middlewares/x402.middleware.js';
-import { NETWORK, ASSET, MERCHANT_ADDRESS } from '../config/x402.config.js';
+import { NETWORK, ASSET, ASSET_UNIT, MERCHANT_ADDRESS } from '../config/x402.config.js';
+import { guardianService } from '../services/guardian.service.js';
 
 const router = Router();
 const controller = new MarketplaceController();
@@ -101,6 +102,11 @@ const proxyHandler = async (req: any, res: any, next: any) => {
       maxAmountRequired: api.pricePerCall,
       maxTimeoutSeconds: 60,
       description: `Payment for ${api.name} API call`,
+      admit: (req) => guardianService.isAdmitted(
+        req.header('x-wallet-address'),
+        Number(api.pricePerCall) / ASSET_UNIT,
+        api.id
+      ),
     });
     
     console.log('🔐 Checking X402 payment...');
@@ -144,7 +150,23 @@ const proxyHandler = async (req: any, res: any, next: any) => {
     );
     
     console.log('💾 Transaction recorded');
-    
+
+    // Report usage to the guardian. The payment ID is the idempotency key, so
+    // a retried request on the same payment is not counted twice.
+    const walletAddress = req.header('x-wallet-address');
+    if (walletAddress) {
+      await guardianService.recordUsage({
+        user_address: walletAddress,
+        api_id: api.id,
+        api_name: api.name,
+        provider: 'x402',
+        cost: Number(api.pricePerCall) / ASSET_UNIT,
+        endpoint: fullEndpointPath,
+        status: response.ok ? 'success' : 'error',
+        idempotency_key: req.header('x-payment-id'),
+      });
+    }
+
     // Forward the response
     const responseBody = await response.text();
     console.log('📄 Response body length:', responseBody.length);
@@ -223,6 +245,11 @@ router.post('/execute/:id', async (req, res, next) => {
       maxAmountRequired: api.pricePerCall, // Use the API's price
       description: `Execute ${api.name} API`,
       resource: `/api/execute/${id}`,
+      admit: (req) => guardianService.isAdmitted(
+        req.header('x-wallet-address'),
+        Number(api.pricePerCall) / ASSET_UNIT,
+        api.id
+      ),
     });
     
     middleware(req, res, next);
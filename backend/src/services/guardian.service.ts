@@ -2,8 +2,43 @@
  * Guardian service client for AI Budget Guardian integration
  */
 
+import crypto from 'node:crypto';
+
 const GUARDIAN_URL = process.env.GUARDIAN_URL || 'http://localhost:8000';
 
+/**
+ * Base URL of each guardian shard, in shard order (comma-separated).
+ * Must list SHARD_COUNT entries; shards served by the same node repeat its URL.
+ * When unset, every request goes to GUARDIAN_URL.
+ */
+const GUARDIAN_SHARD_URLS = (process.env.GUARDIAN_SHARD_URLS || '')
+  .split(',')
+  .map((url) => url.trim())
+  .filter(Boolean);
+
+/**
+ * Shard index for a user address.
+ * Must match shard_index() in the guardian's app/sharding.py:
+ * first 8 bytes of sha256(lower-cased address), big-endian, modulo shard count.
+ */
+export function shardIndex(userAddress: string, shardCount: number): number {
+  if (shardCount <= 1) {
+    return 0;
+  }
+  const digest = crypto.createHash('sha256').update(userAddress.toLowerCase()).digest();
+  return Number(digest.readBigUInt64BE(0) % BigInt(shardCount));
+}
+
+/**
+ * Guardian base URL serving a user's shard.
+ */
+export function guardianUrlFor(userAddress?: string): string {
+  if (!userAddress || GUARDIAN_SHARD_URLS.length === 0) {
+    return GUARDIAN_URL;
+  }
+  return GUARDIAN_SHARD_URLS[shardIndex(userAddress, GUARDIAN_SHARD_URLS.length)];
+}
+
 interface BudgetConfig {
   user_address: string;
   monthly_limit: number;
@@ -23,6 +58,7 @@ interface ApiUsage {
   endpoint?: string;
   status?: string;
   metadata?: Record<string, any>;
+  idempotency_key?: string; // Transaction hash or x402 payment ID; retries are not counted twice
 }
 
 interface BudgetStatus {
@@ -37,6 +73,18 @@ interface BudgetStatus {
   optimizations_available: any[];
 }
 
+interface AdmissionDecision {
+  user_address: string;
+  allowed: boolean | null;
+  reason: string;
+  rule_id?: number | null;
+  cost: number;
+  current_spend?: number;
+  monthly_limit?: number;
+  remaining_budget?: number | null;
+  shard?: number | null;
+}
+
 class GuardianService {
   private baseURL: string;
 
@@ -44,9 +92,14 @@ class GuardianService {
     this.baseURL = GUARDIAN_URL;
   }
 
-  private async fetchGuardian(endpoint: string, options?: RequestInit): Promise<any> {
+  private async fetchGuardian(
+    endpoint: string,
+    options?: RequestInit,
+    userAddress?: string
+  ): Promise<any> {
+    const baseURL = userAddress ? guardianUrlFor(userAddress) : this.baseURL;
     try {
-      const response = await fetch(`${this.baseURL}${endpoint}`, {
+      const response = await fetch(`${baseURL}${endpoint}`, {
         ...options,
         headers: {
           'Content-Type': 'application/json',
@@ -73,7 +126,7 @@ class GuardianService {
       return await this.fetchGuardian('/api/budget/config', {
         method: 'POST',
         body: JSON.stringify(config),
-      });
+      }, config.user_address);
     } catch (error) {
       console.error('Error creating budget config:', error);
       throw error;
@@ -85,7 +138,7 @@ class GuardianService {
    */
   async getBudgetStatus(userAddress: string): Promise<BudgetStatus> {
     try {
-      return await this.fetchGuardian(`/api/budget/status/${userAddress}`);
+      return await this.fetchGuardian(`/api/budget/status/${userAddress}`, undefined, userAddress);
     } catch (error) {
       console.error('Error getting budget status:', error);
       throw error;
@@ -100,7 +153,7 @@ class GuardianService {
       return await this.fetchGuardian('/api/usage/record', {
         method: 'POST',
         body: JSON.stringify(usage),
-      });
+      }, usage.user_address);
     } catch (error) {
       console.error('Error recording usage:', error);
       // Don't throw - we don't want to break the API call if guardian is down
@@ -114,7 +167,7 @@ class GuardianService {
   async getAlerts(userAddress: string, unreadOnly: boolean = false): Promise<any[]> {
     try {
       const params = unreadOnly ? '?unread_only=true' : '';
-      const data = await this.fetchGuardian(`/api/alerts/${userAddress}${params}`);
+      const data = await this.fetchGuardian(`/api/alerts/${userAddress}${params}`, undefined, userAddress);
       return data;
     } catch (error) {
       console.error('Error getting alerts:', error);
@@ -127,7 +180,7 @@ class GuardianService {
    */
   async getOptimizations(userAddress: string): Promise<any[]> {
     try {
-      return await this.fetchGuardian(`/api/optimizations/${userAddress}`);
+      return await this.fetchGuardian(`/api/optimizations/${userAddress}`, undefined, userAddress);
     } catch (error) {
       console.error('Error getting optimizations:', error);
       return [];
@@ -146,7 +199,7 @@ class GuardianService {
           time_window_hours: timeWindowHours,
           include_recommendations: true,
         }),
-      });
+      }, userAddress);
     } catch (error) {
       console.error('Error analyzing spending:', error);
       throw error;
@@ -158,7 +211,7 @@ class GuardianService {
    */
   async getMonthlyReport(userAddress: string): Promise<any> {
     try {
-      return await this.fetchGuardian(`/api/report/${userAddress}/monthly`);
+      return await this.fetchGuardian(`/api/report/${userAddress}/monthly`, undefined, userAddress);
     } catch (error) {
       console.error('Error getting monthly report:', error);
       throw error;
@@ -177,6 +230,33 @@ class GuardianService {
     }
   }
 
+  /**
+   * Pre-payment budget check for a call costing `cost` (USD)
+   */
+  async admitPayment(userAddress: string, cost: number, apiId?: string): Promise<AdmissionDecision | null> {
+    try {
+      const params = new URLSearchParams({ cost: String(cost) });
+      if (apiId) {
+        params.set('api_id', apiId);
+      }
+      return await this.fetchGuardian(`/api/budget/admit/${userAddress}?${params}`, undefined, userAddress);
+    } catch (error) {
+      console.error('Error checking admission:', error);
+      return null;
+    }
+  }
+
+  /**
+   * Whether a paid call may be served. Fails open if guardian is down.
+   */
+  async isAdmitted(userAddress: string | undefined, cost: number, apiId?: string): Promise<boolean> {
+    if (!userAddress) {
+      return true;
+    }
+    const decision = await this.admitPayment(userAddress, cost, apiId);
+    return decision?.allowed !== false;
+  }
+
   /**
    * Check if user should be blocked from API calls
    */
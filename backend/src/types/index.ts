@@ -38,6 +38,7 @@ export enum PaymentStatus {
   PaymentRequired = 'payment_required',
   VerifyFailed = 'verify_failed',
   SettleFailed = 'settle_failed',
+  BudgetDenied = 'budget_denied',
 }
 
 /**